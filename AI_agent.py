@@ -1,6 +1,7 @@
+import asyncio
 import json
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 import os
 import time
 from datetime import datetime
@@ -13,6 +14,14 @@ except ImportError:
     openai_available = False
     logging.warning("openai模块未安装，服务将以模拟模式运行")
 
+from Utils.metrics import REGISTRY, CONTENT_TYPE, StreamMetrics
+from Utils.prefix_cache_stats import PrefixCacheStats
+from Utils.prompt_budget import BudgetResult, estimate_tokens, fit_java_to_budget, split_top_level_types
+from Utils.review_batch import (ZIP_MIMETYPES, BatchError, afan_out, check_batch, concurrency_limit, fan_out,
+                                files_from_json, files_from_upload, files_from_zip, iter_batch)
+from Utils.review_cache import ReviewCache, cache_key, iter_chunks
+from Utils.tracing import child_span, configure as configure_tracing, current_span, start_span
+
 app = Flask(__name__)
 
 # 配置日志
@@ -22,11 +31,29 @@ logger = logging.getLogger("JavaCodeReviewService")
 # 服务配置
 API_KEY_CIPHERTEXT = b'gAAAAABoJXqyrhK0vAFN5BZ9u5Ra8za8nHQU6BW5AAq6JXzYiqhOkIHTyB22s5LAaW-O66DgkumpiJfDqAPVw2KSjZXITfFcTODtvqLGleuTXTPmvg9-TbcEpsRPNHAagLgIQhWisfGJ'
 DECRYPTION_KEY = b'upe2l6UFonRu7qzhWWRfIeYSHJt25nS11o7arzDFlMs='
-BASE_URL = 'https://api.deepseek.com'
+BASE_URL = os.getenv('LLM_BASE_URL', 'https://api.deepseek.com')
 MODEL_NAME = 'deepseek-chat'  # 使用 deepseek-chat 模型
+PROMPT_VERSION = 'v1'  # 修改系统提示词时递增，使旧的缓存结果失效
+INPUT_TOKEN_BUDGET = int(os.getenv('INPUT_TOKEN_BUDGET', 12000))  # 单次评审的代码输入 token 上限
+# 超过该 token 数且包含多个顶层类型的代码按类型分块并行评审，再汇总为一份结果
+MAP_REDUCE_MIN_TOKENS = int(os.getenv('MAP_REDUCE_MIN_TOKENS', 6000))
+MAP_CONCURRENCY = int(os.getenv('MAP_CONCURRENCY', 8))  # 分块评审同时进行的大模型调用数
+
+# 评审结果缓存：相同代码（忽略注释和空白）直接返回，不再调用大模型
+review_cache = ReviewCache(disk_dir=os.getenv('REVIEW_CACHE_DIR'))
+# 上游提示词前缀缓存命中统计
+prefix_stats = PrefixCacheStats()
+
+# 运行指标，通过 /metrics 以 Prometheus 格式导出
+http_request_latency = REGISTRY.histogram("http_request_duration_seconds",
+                                          "Time until the response starts, by route", ("method", "path", "status"))
+llm_calls = REGISTRY.counter("llm_calls_total", "Calls to the LLM provider by model and status", ("model", "status"))
+stream_metrics = StreamMetrics("review", label="endpoint")
+# 链路追踪：延续 dialog.py 传来的 traceparent
+configure_tracing("design-review")
 
 def get_system_prompt():
-    """返回代码评审系统提示词"""
+    """返回代码评审系统提示词（固定文本，作为可被上游缓存的请求前缀，不要拼入任何变化的内容）"""
     return """
 你是一位资深软件架构师，专注于分析Java代码设计模式和质量评估。你需要：
 1. 全面分析代码结构，识别设计模式（单例、工厂、观察者等）
@@ -59,6 +86,28 @@ def get_system_prompt():
 3. 仅返回有效的JSON对象
 """
 
+def get_map_prompt():
+    """分块评审单个类型的系统提示词：只输出紧凑摘要，供汇总阶段合并（固定文本，可被上游缓存）"""
+    return """
+你是一位资深软件架构师，正在分块评审一个大型Java项目，本次只看到其中一个顶层类型。
+请输出该类型的紧凑摘要，供之后与其他类型的摘要合并：
+1. 该类型的职责（一句话）
+2. 它参与的设计模式及在模式中的角色
+3. 仅凭该类型即可确认的设计问题及严重性（low/medium/high）
+4. 它依赖、继承、实现或组合的其他类型
+5. 该类型的设计质量评分（0-100）
+
+请严格按照以下JSON格式输出，不要包含Markdown语法或额外解释：
+{
+  "type": "类型名",
+  "responsibility": "职责",
+  "patterns": [{"pattern": "模式名称", "role": "角色"}],
+  "issues": [{"issue": "问题类型", "description": "问题描述", "severity": "low/medium/high"}],
+  "relations": [{"target": "类型名", "kind": "extends/implements/uses/contains"}],
+  "qualityScore": 整数分数
+}
+"""
+
 def initialize_openai_client():
     """初始化并返回OpenAI客户端"""
     try:
@@ -80,6 +129,21 @@ if openai_available:
 else:
     logger.warning("未检测到openai库，服务将以模拟模式运行")
 
+@app.before_request
+def start_timer():
+    g.start_time = time.time()
+    g.span = start_span("review.request", request.headers.get("traceparent"), path=request.path)
+
+@app.after_request
+def record_request_latency(response):
+    path = request.url_rule.rule if request.url_rule else "unmatched"
+    http_request_latency.observe(time.time() - g.start_time,
+                                 method=request.method, path=path, status=response.status_code)
+    g.span.set_attribute("http.status_code", response.status_code)
+    # 流式响应在发送完毕、响应关闭时才结束 span
+    response.call_on_close(g.span.end)
+    return response
+
 @app.route('/review', methods=['POST'])
 def review_java_code():
     """Java代码评审API端点"""
@@ -124,6 +188,7 @@ def review_java_code():
             return sync_review(java_code, start_time)
     
     except Exception as e:
+        llm_calls.inc(model=MODEL_NAME, status=getattr(e, "status_code", "error"))
         logger.error(f"代码评审失败: {str(e)}", exc_info=True)
         return jsonify({
             "status": "error",
@@ -131,99 +196,368 @@ def review_java_code():
             "execution_time": time.time() - start_time
         }), 500
 
-def sync_review(java_code, start_time):
-    """处理同步代码评审"""
+def map_reduce_plan(java_code):
+    """代码较长且包含多个顶层类型时返回 ([(类型名, 分块源码)], token 数)，否则返回 None"""
+    header, types = split_top_level_types(java_code)
+    if len(types) < 2:
+        return None
+    tokens = estimate_tokens(java_code)
+    if tokens <= MAP_REDUCE_MIN_TOKENS:
+        return None
+    # 每块带上 package 和 import，便于模型判断依赖
+    return [(name, f"{header}\n\n{code}" if header else code) for name, code in types], tokens
+
+def single_messages(java_code):
+    """单次评审的消息，超出输入预算时先裁剪"""
+    budget = fit_java_to_budget(java_code, INPUT_TOKEN_BUDGET)
+    if budget.trimmed:
+        logger.info(f"代码超出输入预算，已裁剪: {budget.to_dict()}")
+    # 固定的系统提示词和指令在前、代码紧随其后，变化的裁剪说明放在最后，尽量延长可缓存的前缀
     messages = [
         {"role": "system", "content": get_system_prompt()},
-        {"role": "user", "content": f"请评审以下Java代码：\n```java\n{java_code}\n```"}
+        {"role": "user", "content": f"请评审以下Java代码：\n```java\n{budget.code}\n```\n{budget.note()}"}
     ]
+    return messages, budget
+
+def build_messages(java_code, span=None):
+    """构造评审请求消息：代码较长且包含多个顶层类型时先分块评审再汇总，否则超出输入预算时先裁剪"""
+    plan = map_reduce_plan(java_code) if openai_client else None
+    if plan is None:
+        return single_messages(java_code)
+    types, tokens = plan
+    span = span or current_span()
+    start = time.time()
+    # 未缓存的类型并行评审，在批量评审中与批次共享并发上限
+    summaries, missing = cached_map_summaries(types)
+    results = fan_out([types[index] for index in missing], lambda item: review_type(*item, span), MAP_CONCURRENCY)
+    for index, summary in zip(missing, results):
+        summaries[index] = summary
+    logger.info(f"分块评审 {len(types)} 个类型耗时 {time.time() - start:.1f}s")
+    return reduce_messages(types, summaries, tokens)
+
+async def abuild_messages(java_code, client, span):
+    """build_messages 的异步版本：分块评审用 AsyncOpenAI 客户端在事件循环上并发，不占用线程"""
+    plan = await asyncio.to_thread(map_reduce_plan, java_code)
+    if plan is None:
+        # 裁剪超长代码需要分词，放到线程中避免阻塞事件循环
+        return await asyncio.to_thread(single_messages, java_code)
+    types, tokens = plan
+    start = time.time()
+    summaries, missing = cached_map_summaries(types)
+    results = await afan_out([types[index] for index in missing], lambda item: areview_type(client, *item, span),
+                             MAP_CONCURRENCY)
+    for index, summary in zip(missing, results):
+        summaries[index] = summary
+    logger.info(f"分块评审 {len(types)} 个类型耗时 {time.time() - start:.1f}s")
+    return reduce_messages(types, summaries, tokens)
+
+def cached_map_summaries(types):
+    """分块阶段先查缓存，返回 (摘要列表, 未命中的序号)；未命中的摘要为 None"""
+    summaries = [review_cache.get(map_cache_key(code)) for _, code in types]
+    return summaries, [index for index, summary in enumerate(summaries) if summary is None]
+
+def map_cache_key(code):
+    return cache_key(code, PROMPT_VERSION, MODEL_NAME, "map")
+
+def map_messages(code):
+    budget = fit_java_to_budget(code, INPUT_TOKEN_BUDGET)
+    return [
+        {"role": "system", "content": get_map_prompt()},
+        {"role": "user", "content": f"请评审以下Java类型：\n```java\n{budget.code}\n```\n{budget.note()}"}
+    ]
+
+def review_type(name, code, span):
+    """评审单个顶层类型，返回 JSON 摘要文本；摘要按类型代码缓存，只改动一个类时其余类直接命中"""
+    with child_span(span, "llm.map", model=MODEL_NAME, type=name):
+        response = openai_client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=map_messages(code),
+            temperature=0.2,
+            max_tokens=800,
+            stream=False
+        )
+    return store_map_summary(code, response)
+
+async def areview_type(client, name, code, span):
+    """review_type 的异步版本"""
+    messages = await asyncio.to_thread(map_messages, code)
+    with child_span(span, "llm.map", model=MODEL_NAME, type=name):
+        response = await client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=messages,
+            temperature=0.2,
+            max_tokens=800,
+            stream=False
+        )
+    return store_map_summary(code, response)
+
+def store_map_summary(code, response):
+    llm_calls.inc(model=MODEL_NAME, status=200)
+    prefix_stats.record(response.usage)
+    summary = response.choices[0].message.content.strip()
+    review_cache.set(map_cache_key(code), summary)
+    return summary
+
+def compact_summary(summary):
+    """摘要是合法 JSON 时去掉多余空白，减少汇总阶段的输入"""
+    try:
+        return json.dumps(json.loads(summary), ensure_ascii=False, separators=(",", ":"))
+    except ValueError:
+        return summary
+
+def reduce_messages(types, summaries, tokens_before):
+    """
+    汇总阶段的消息：由各类型摘要合并设计模式、跨类型问题、整体评分和完整类图，输出格式与单次评审相同。
+    摘要总长超出 INPUT_TOKEN_BUDGET 时把每个类型的摘要截断到平均份额以内。
+    """
+    names = [name for name, _ in types]
+    summaries = [compact_summary(summary) for summary in summaries]
+    trimmed = [f"按 {len(types)} 个顶层类型分块评审后汇总"]
+    truncated = False
+    content = "\n\n".join(f"## {name}\n{summary}" for name, summary in zip(names, summaries))
+    tokens = estimate_tokens(content)
+    if tokens > INPUT_TOKEN_BUDGET:
+        share = max((INPUT_TOKEN_BUDGET - estimate_tokens("\n\n".join(names))) // len(types), 1)
+        cut = 0
+        for index, summary in enumerate(summaries):
+            summary_tokens = estimate_tokens(summary)
+            if summary_tokens > share:
+                summaries[index] = summary[:int(len(summary) * share / summary_tokens)] + "…"
+                cut += 1
+        content = "\n\n".join(f"## {name}\n{summary}" for name, summary in zip(names, summaries))
+        tokens = estimate_tokens(content)
+        trimmed.append(f"{cut} 个类型的摘要超出汇总预算，已截断")
+        truncated = True
+        logger.info(f"汇总输入超出预算，已截断 {cut} 个类型的摘要")
+
+    note = "\n（注意：部分类型的摘要过长，已截断）" if truncated else ""
+    messages = [
+        {"role": "system", "content": get_system_prompt()},
+        {"role": "user", "content": "以下Java项目过大，已按顶层类型分块评审，下面是各类型的评审摘要。"
+                                    "请据此汇总：合并各类型参与的设计模式，找出跨类型的设计问题，给出项目整体评分，"
+                                    "并根据类型间的关系生成包含所有类型的类图：\n\n" + content + note}
+    ]
+    return messages, BudgetResult(content, tokens_before, tokens, trimmed, truncated)
+
+def review_once(java_code, span):
+    """非流式评审一段代码，返回 (评审结果, 是否命中缓存, 输入预算)；批量评审在工作线程中调用，span 需显式传入"""
+    key = cache_key(java_code, PROMPT_VERSION, MODEL_NAME)
+    cached = review_cache.get(key)
+    if cached is not None:
+        span.add_event("review_cache_hit")
+        return cached, True, None
+
+    if not openai_client:
+        raise RuntimeError("服务未正确初始化，请检查openai库安装和API配置")
+    messages, budget = build_messages(java_code, span)
     
-    response = openai_client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=messages,
-        temperature=0.2,
-        max_tokens=2500,
-        stream=False
-    )
+    with span.child("llm.completion", model=MODEL_NAME):
+        response = openai_client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=messages,
+            temperature=0.2,
+            max_tokens=2500,
+            stream=False
+        )
     
-    # 处理响应
-    execution_time = time.time() - start_time
+    llm_calls.inc(model=MODEL_NAME, status=200)
+    prefix_stats.record(response.usage)
+
     review_result = response.choices[0].message.content.strip()
-    
+    review_cache.set(key, review_result)
+    return review_result, False, budget
+
+def sync_review(java_code, start_time):
+    """处理同步代码评审"""
+    review_result, cached, budget = review_once(java_code, g.span)
+    if cached:
+        return jsonify({
+            "status": "success",
+            "model": MODEL_NAME,
+            "review_result": review_result,
+            "cached": True,
+            "execution_time": time.time() - start_time
+        })
+
     return jsonify({
         "status": "success",
         "model": MODEL_NAME,
         "review_result": review_result,
-        "execution_time": execution_time
+        "budget": budget.to_dict(),
+        "execution_time": time.time() - start_time
     })
 
+# NDJSON 流式记录，Flask 模式和 ASGI 模式（Utils/review_asgi.py）共用，保证两种模式输出的字节一致
+def stream_started_record(**fields):
+    return json.dumps({
+        "status": "stream_started",
+        "model": MODEL_NAME,
+        **fields,
+        "start_time": datetime.now().isoformat()
+    }) + "\n"
+
+def chunk_record(content_chunk):
+    return json.dumps({
+        "chunk": content_chunk
+    }) + "\n"
+
+def completed_record(full_result, execution_time):
+    return json.dumps({
+        "status": "completed",
+        "full_result": full_result,
+        "execution_time": execution_time
+    }) + "\n"
+
+def ndjson_line(record):
+    """批量评审等新接口的 NDJSON 记录"""
+    return json.dumps(record) + "\n"
+
+def stream_error_record(error):
+    return json.dumps({
+        "status": "stream_error",
+        "error": f"流处理中断: {str(error)}"
+    }) + "\n"
+
 def stream_review(java_code, start_time):
     """处理流式代码评审"""
-    messages = [
-        {"role": "system", "content": get_system_prompt()},
-        {"role": "user", "content": f"请评审以下Java代码：\n```java\n{java_code}\n```"}
-    ]
+    key = cache_key(java_code, PROMPT_VERSION, MODEL_NAME)
+    cached = review_cache.get(key)
+    if cached is not None:
+        g.span.add_event("review_cache_hit")
+        return app.response_class(stream_metrics.wrap_sync(replay_cached_review(cached, start_time), "review_cached"),
+                                  mimetype='text/event-stream')
+
+    messages, budget = build_messages(java_code, g.span)
     
     # 调用流式API
-    response_stream = openai_client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=messages,
-        temperature=0.2,
-        max_tokens=2500,
-        stream=True
-    )
+    request_time = time.time()
+    llm_span = g.span.child("llm.stream", model=MODEL_NAME)
+    try:
+        response_stream = openai_client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=messages,
+            temperature=0.2,
+            max_tokens=2500,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+    except Exception as e:
+        llm_span.end(error=str(e))
+        raise
+    llm_calls.inc(model=MODEL_NAME, status=200)
     
     # 创建流式响应生成器
     def generate():
         review_content = []
         # 发送流开始信号
-        yield json.dumps({
-            "status": "stream_started",
-            "model": MODEL_NAME,
-            "start_time": datetime.now().isoformat()
-        }) + "\n"
+        yield stream_started_record(budget=budget.to_dict())
         
         # 处理流式响应
         try:
+            ttft = None
             for chunk in response_stream:
+                if chunk.usage:
+                    prefix_stats.record(chunk.usage, ttft)
                 if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    if ttft is None:
+                        ttft = time.time() - request_time
+                        llm_span.add_event("first_token")
                     content_chunk = chunk.choices[0].delta.content
                     review_content.append(content_chunk)
                     # 发送每个内容块
-                    yield json.dumps({
-                        "chunk": content_chunk
-                    }) + "\n"
+                    yield chunk_record(content_chunk)
         except Exception as e:
+            llm_calls.inc(model=MODEL_NAME, status="stream_error")
+            llm_span.end(error=str(e))
             logger.error(f"流处理中断: {str(e)}")
-            yield json.dumps({
-                "status": "stream_error",
-                "error": f"流处理中断: {str(e)}"
-            }) + "\n"
+            yield stream_error_record(e)
             return
+        finally:
+            llm_span.end()
         
         # 发送最终结果
         execution_time = time.time() - start_time
         full_response = ''.join(review_content)
-        yield json.dumps({
-            "status": "completed",
-            "full_result": full_response,
-            "execution_time": execution_time
-        }) + "\n"
+        review_cache.set(key, full_response)
+        yield completed_record(full_response, execution_time)
     
     # 返回流式响应
-    return app.response_class(generate(), mimetype='text/event-stream')
+    return app.response_class(stream_metrics.wrap_sync(generate(), "review"), mimetype='text/event-stream')
+
+def replay_cached_review(review_result, start_time):
+    """以与 stream_review 相同的 NDJSON 格式重放缓存的评审结果"""
+    yield stream_started_record(cached=True)
+    for content_chunk in iter_chunks(review_result):
+        yield chunk_record(content_chunk)
+    yield completed_record(review_result, time.time() - start_time)
+
+@app.route('/review/batch', methods=['POST'])
+def review_batch():
+    """批量评审：接收 JSON 数组、multipart 上传或 zip 包，按完成顺序以 NDJSON 流式返回每个文件的结果和最终汇总"""
+    start_time = time.time()
+    try:
+        files = check_batch(read_batch_files())
+        concurrency = concurrency_limit(request.args.get('concurrency'))
+    except BatchError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e),
+            "execution_time": time.time() - start_time
+        }), 400
+
+    # 工作线程中没有请求上下文，先取出本请求的 span
+    span = g.span
+
+    def review_one(name, code):
+        with span.child("review.file", file=name) as file_span:
+            try:
+                review_result, cached, _ = review_once(code, file_span)
+            except Exception as e:
+                llm_calls.inc(model=MODEL_NAME, status=getattr(e, "status_code", "error"))
+                logger.error(f"批量评审 {name} 失败: {str(e)}")
+                raise
+        return review_result, cached
+
+    records = (ndjson_line(record) for record in iter_batch(files, review_one, concurrency))
+    return app.response_class(stream_metrics.wrap_sync(records, "review_batch"), mimetype='text/event-stream')
+
+def read_batch_files():
+    """从 multipart 上传、zip 请求体或 JSON 请求体中取出 [(文件名, 代码)]"""
+    if request.files:
+        files = []
+        for field in request.files:
+            for upload in request.files.getlist(field):
+                files.extend(files_from_upload(upload.filename or field, upload.read()))
+        return files
+    if request.mimetype in ZIP_MIMETYPES:
+        return files_from_zip(request.get_data())
+    data = request.get_json(silent=True)
+    if data is None:
+        raise BatchError("请求体应为 JSON、multipart 或 zip")
+    return files_from_json(data)
 
 @app.route('/status', methods=['GET'])
 def service_status():
     """服务健康检查端点"""
-    status = "running" if openai_available and openai_client else "error"
-    return jsonify({
+    return jsonify(status_report(openai_client))
+
+def status_report(client):
+    """/status 的返回内容，client 为当前使用的大模型客户端"""
+    status = "running" if openai_available and client else "error"
+    return {
         "status": status,
         "model": MODEL_NAME,
         "openai_available": openai_available,
-        "client_initialized": bool(openai_client),
+        "client_initialized": bool(client),
+        "cache": review_cache.stats(),
+        "prefix_cache": prefix_stats.stats(),
         "timestamp": datetime.now().isoformat()
-    })
+    }
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 指标导出端点"""
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 @app.route('/', methods=['GET'])
 def index():
@@ -1,6 +1,6 @@
 import json
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 import os
 import time
 from datetime import datetime
@@ -13,6 +13,14 @@ except ImportError:
     openai_available = False
     logging.warning("openai模块未安装，服务将以模拟模式运行")
 
+from Utils.metrics import REGISTRY, CONTENT_TYPE, StreamMetrics
+from Utils.prefix_cache_stats import PrefixCacheStats
+from Utils.prompt_budget import fit_java_to_budget
+from Utils.review_batch import (ZIP_MIMETYPES, BatchError, check_batch, concurrency_limit, files_from_json,
+                                files_from_upload, files_from_zip, iter_batch)
+from Utils.review_cache import ReviewCache, cache_key, iter_chunks
+from Utils.tracing import configure as configure_tracing, start_span
+
 # 在文件顶部的app初始化后添加
 app = Flask(__name__)
 app.json.ensure_ascii = False  # 添加这行配置
@@ -26,11 +34,26 @@ logger = logging.getLogger("JavaCodeReviewService")
 # 服务配置
 API_KEY_CIPHERTEXT = b'gAAAAABoJXqyrhK0vAFN5BZ9u5Ra8za8nHQU6BW5AAq6JXzYiqhOkIHTyB22s5LAaW-O66DgkumpiJfDqAPVw2KSjZXITfFcTODtvqLGleuTXTPmvg9-TbcEpsRPNHAagLgIQhWisfGJ'
 DECRYPTION_KEY = b'upe2l6UFonRu7qzhWWRfIeYSHJt25nS11o7arzDFlMs='
-BASE_URL = 'https://api.deepseek.com'
+BASE_URL = os.getenv('LLM_BASE_URL', 'https://api.deepseek.com')
 MODEL_NAME = 'deepseek-chat'  # 使用 deepseek-chat 模型
+PROMPT_VERSION = 'v1'  # 修改系统提示词时递增，使旧的缓存结果失效
+INPUT_TOKEN_BUDGET = int(os.getenv('INPUT_TOKEN_BUDGET', 8000))  # 单次评审的代码输入 token 上限
+
+# 评审结果缓存：相同代码（忽略注释和空白）直接返回，不再调用大模型
+review_cache = ReviewCache(disk_dir=os.getenv('REVIEW_CACHE_DIR'))
+# 上游提示词前缀缓存命中统计
+prefix_stats = PrefixCacheStats()
+
+# 运行指标，通过 /metrics 以 Prometheus 格式导出
+http_request_latency = REGISTRY.histogram("http_request_duration_seconds",
+                                          "Time until the response starts, by route", ("method", "path", "status"))
+llm_calls = REGISTRY.counter("llm_calls_total", "Calls to the LLM provider by model and status", ("model", "status"))
+stream_metrics = StreamMetrics("review", label="endpoint")
+# 链路追踪：延续 dialog.py 传来的 traceparent
+configure_tracing("code-review")
 
 def get_system_prompt():
-    """返回代码评审系统提示词"""
+    """返回代码评审系统提示词（固定文本，作为可被上游缓存的请求前缀，不要拼入任何变化的内容）"""
     return """您是一个经验丰富的Java代码评审专家。请分析下面的Java代码并生成专业的评审报告，报告需要包含以下部分：
 
 # 总体评价
@@ -85,6 +108,21 @@ if openai_available:
 else:
     logger.warning("未检测到openai库，服务将以模拟模式运行")
 
+@app.before_request
+def start_timer():
+    g.start_time = time.time()
+    g.span = start_span("review.request", request.headers.get("traceparent"), path=request.path)
+
+@app.after_request
+def record_request_latency(response):
+    path = request.url_rule.rule if request.url_rule else "unmatched"
+    http_request_latency.observe(time.time() - g.start_time,
+                                 method=request.method, path=path, status=response.status_code)
+    g.span.set_attribute("http.status_code", response.status_code)
+    # 流式响应在发送完毕、响应关闭时才结束 span
+    response.call_on_close(g.span.end)
+    return response
+
 @app.route('/review', methods=['POST'])
 def review_java_code():
     """Java代码评审API端点"""
@@ -129,6 +167,7 @@ def review_java_code():
             return sync_review(java_code, start_time)
     
     except Exception as e:
+        llm_calls.inc(model=MODEL_NAME, status=getattr(e, "status_code", "error"))
         logger.error(f"代码评审失败: {str(e)}", exc_info=True)
         return jsonify({
             "status": "error",
@@ -136,98 +175,236 @@ def review_java_code():
             "execution_time": time.time() - start_time
         }), 500
 
-def sync_review(java_code, start_time):
-    """处理同步代码评审"""
+def build_messages(java_code):
+    """构造评审请求消息，代码超出输入预算时先裁剪"""
+    budget = fit_java_to_budget(java_code, INPUT_TOKEN_BUDGET)
+    if budget.trimmed:
+        logger.info(f"代码超出输入预算，已裁剪: {budget.to_dict()}")
+    # 固定的系统提示词和指令在前、代码紧随其后，变化的裁剪说明放在最后，尽量延长可缓存的前缀
     messages = [
         {"role": "system", "content": get_system_prompt()},
-        {"role": "user", "content": f"请评审以下Java代码：\n```java\n{java_code}\n```"}
+        {"role": "user", "content": f"请评审以下Java代码：\n```java\n{budget.code}\n```\n{budget.note()}"}
     ]
+    return messages, budget
+
+def review_once(java_code, span):
+    """非流式评审一段代码，返回 (评审结果, 是否命中缓存, 输入预算)；批量评审在工作线程中调用，span 需显式传入"""
+    key = cache_key(java_code, PROMPT_VERSION, MODEL_NAME)
+    cached = review_cache.get(key)
+    if cached is not None:
+        span.add_event("review_cache_hit")
+        return cached, True, None
+
+    if not openai_client:
+        raise RuntimeError("服务未正确初始化，请检查openai库安装和API配置")
+    messages, budget = build_messages(java_code)
     
-    response = openai_client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=messages,
-        temperature=0.2,
-        max_tokens=2500,
-        stream=False
-    )
+    with span.child("llm.completion", model=MODEL_NAME):
+        response = openai_client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=messages,
+            temperature=0.2,
+            max_tokens=2500,
+            stream=False
+        )
     
-    # 处理响应
-    execution_time = time.time() - start_time
+    llm_calls.inc(model=MODEL_NAME, status=200)
+    prefix_stats.record(response.usage)
+
     review_result = response.choices[0].message.content.strip()
+    review_cache.set(key, review_result)
+    return review_result, False, budget
+
+def sync_review(java_code, start_time):
+    """处理同步代码评审"""
+    review_result, cached, budget = review_once(java_code, g.span)
+    if cached:
+        return jsonify({
+            "status": "success",
+            "model": MODEL_NAME,
+            "review_result": review_result,
+            "cached": True,
+            "execution_time": time.time() - start_time
+        })
 
     return jsonify({
         "status": "success",
         "model": MODEL_NAME,
         "review_result": review_result,
-        "execution_time": execution_time
+        "budget": budget.to_dict(),
+        "execution_time": time.time() - start_time
     })
 
+# NDJSON 流式记录，Flask 模式和 ASGI 模式（Utils/review_asgi.py）共用，保证两种模式输出的字节一致
+def stream_started_record(**fields):
+    return json.dumps({
+        "status": "stream_started",
+        "model": MODEL_NAME,
+        **fields,
+        "start_time": datetime.now().isoformat()
+    }, ensure_ascii=False) + "\n"
+
+def chunk_record(content_chunk):
+    return json.dumps({
+        "chunk": content_chunk
+    }, ensure_ascii=False) + "\n"
+
+def completed_record(full_result, execution_time):
+    return json.dumps({
+        "status": "completed",
+        "full_result": full_result,
+        "execution_time": execution_time
+    }) + "\n"
+
+def ndjson_line(record):
+    """批量评审等新接口的 NDJSON 记录"""
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+def stream_error_record(error):
+    return json.dumps({
+        "status": "stream_error",
+        "error": f"流处理中断: {str(error)}"
+    }) + "\n"
+
 def stream_review(java_code, start_time):
     """处理流式代码评审"""
-    messages = [
-        {"role": "system", "content": get_system_prompt()},
-        {"role": "user", "content": f"请评审以下Java代码：\n```java\n{java_code}\n```"}
-    ]
+    key = cache_key(java_code, PROMPT_VERSION, MODEL_NAME)
+    cached = review_cache.get(key)
+    if cached is not None:
+        g.span.add_event("review_cache_hit")
+        return app.response_class(stream_metrics.wrap_sync(replay_cached_review(cached, start_time), "review_cached"),
+                                  mimetype='text/event-stream')
+
+    messages, budget = build_messages(java_code)
 
     # 调用流式API
-    response_stream = openai_client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=messages,
-        temperature=0.2,
-        max_tokens=2500,
-        stream=True
-    )
+    request_time = time.time()
+    llm_span = g.span.child("llm.stream", model=MODEL_NAME)
+    try:
+        response_stream = openai_client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=messages,
+            temperature=0.2,
+            max_tokens=2500,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+    except Exception as e:
+        llm_span.end(error=str(e))
+        raise
+    llm_calls.inc(model=MODEL_NAME, status=200)
 
     def generate():
         review_content = []
         # 发送流开始信号
-        yield json.dumps({
-            "status": "stream_started",
-            "model": MODEL_NAME,
-            "start_time": datetime.now().isoformat()
-        }, ensure_ascii=False) + "\n"  # 添加ensure_ascii=False
+        yield stream_started_record(budget=budget.to_dict())
 
         # 处理流式响应
         try:
+            ttft = None
             for chunk in response_stream:
+                if chunk.usage:
+                    prefix_stats.record(chunk.usage, ttft)
                 if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    if ttft is None:
+                        ttft = time.time() - request_time
+                        llm_span.add_event("first_token")
                     content_chunk = chunk.choices[0].delta.content
                     review_content.append(content_chunk)
                     # 发送每个内容块
-                    yield json.dumps({
-                        "chunk": content_chunk
-                    }, ensure_ascii=False) + "\n"  # 添加ensure_ascii=False
+                    yield chunk_record(content_chunk)
         except Exception as e:
+            llm_calls.inc(model=MODEL_NAME, status="stream_error")
+            llm_span.end(error=str(e))
             logger.error(f"流处理中断: {str(e)}")
-            yield json.dumps({
-                "status": "stream_error",
-                "error": f"流处理中断: {str(e)}"
-            }) + "\n"
+            yield stream_error_record(e)
             return
+        finally:
+            llm_span.end()
         
         # 发送最终结果
         execution_time = time.time() - start_time
         full_response = ''.join(review_content)
-        yield json.dumps({
-            "status": "completed",
-            "full_result": full_response,
-            "execution_time": execution_time
-        }) + "\n"
+        review_cache.set(key, full_response)
+        yield completed_record(full_response, execution_time)
     
     # 返回流式响应
-    return app.response_class(generate(), mimetype='text/event-stream')
+    return app.response_class(stream_metrics.wrap_sync(generate(), "review"), mimetype='text/event-stream')
+
+def replay_cached_review(review_result, start_time):
+    """以与 stream_review 相同的 NDJSON 格式重放缓存的评审结果"""
+    yield stream_started_record(cached=True)
+    for content_chunk in iter_chunks(review_result):
+        yield chunk_record(content_chunk)
+    yield completed_record(review_result, time.time() - start_time)
+
+@app.route('/review/batch', methods=['POST'])
+def review_batch():
+    """批量评审：接收 JSON 数组、multipart 上传或 zip 包，按完成顺序以 NDJSON 流式返回每个文件的结果和最终汇总"""
+    start_time = time.time()
+    try:
+        files = check_batch(read_batch_files())
+        concurrency = concurrency_limit(request.args.get('concurrency'))
+    except BatchError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e),
+            "execution_time": time.time() - start_time
+        }), 400
+
+    # 工作线程中没有请求上下文，先取出本请求的 span
+    span = g.span
+
+    def review_one(name, code):
+        with span.child("review.file", file=name) as file_span:
+            try:
+                review_result, cached, _ = review_once(code, file_span)
+            except Exception as e:
+                llm_calls.inc(model=MODEL_NAME, status=getattr(e, "status_code", "error"))
+                logger.error(f"批量评审 {name} 失败: {str(e)}")
+                raise
+        return review_result, cached
+
+    records = (ndjson_line(record) for record in iter_batch(files, review_one, concurrency))
+    return app.response_class(stream_metrics.wrap_sync(records, "review_batch"), mimetype='text/event-stream')
+
+def read_batch_files():
+    """从 multipart 上传、zip 请求体或 JSON 请求体中取出 [(文件名, 代码)]"""
+    if request.files:
+        files = []
+        for field in request.files:
+            for upload in request.files.getlist(field):
+                files.extend(files_from_upload(upload.filename or field, upload.read()))
+        return files
+    if request.mimetype in ZIP_MIMETYPES:
+        return files_from_zip(request.get_data())
+    data = request.get_json(silent=True)
+    if data is None:
+        raise BatchError("请求体应为 JSON、multipart 或 zip")
+    return files_from_json(data)
 
 @app.route('/status', methods=['GET'])
 def service_status():
     """服务健康检查端点"""
-    status = "running" if openai_available and openai_client else "error"
-    return jsonify({
+    return jsonify(status_report(openai_client))
+
+def status_report(client):
+    """/status 的返回内容，client 为当前使用的大模型客户端"""
+    status = "running" if openai_available and client else "error"
+    return {
         "status": status,
         "model": MODEL_NAME,
         "openai_available": openai_available,
-        "client_initialized": bool(openai_client),
+        "client_initialized": bool(client),
+        "cache": review_cache.stats(),
+        "prefix_cache": prefix_stats.stats(),
         "timestamp": datetime.now().isoformat()
-    })
+    }
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 指标导出端点"""
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 @app.route('/', methods=['GET'])
 def index():
@@ -0,0 +1,7 @@
+USE `dialog_znxz`;
+
+-- 历史记录按 (user_id / session_id, created_at, id) 做 keyset 分页，
+-- InnoDB 二级索引末尾自带主键 id，因此组合索引即可覆盖排序和游标条件。
+ALTER TABLE `session` ADD INDEX `idx_session_user_created` (`user_id`, `created_at`);
+
+ALTER TABLE `dialog` ADD INDEX `idx_dialog_session_created` (`session_id`, `created_at`);
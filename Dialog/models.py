@@ -1,3 +1,6 @@
+from datetime import datetime
+from typing import Optional
+
 from pydantic import BaseModel
 
 class Session(BaseModel):
@@ -6,6 +9,7 @@ class Session(BaseModel):
     """
     session_id: int
     session_name: str
+    created_at: Optional[datetime] = None
 
 class Dialog(BaseModel):
     """
@@ -13,7 +17,8 @@ class Dialog(BaseModel):
     """
     dialog_id: int
     question: str
-    dialog_content: str
+    dialog_content: str = ""  # 精简模式下不返回
+    created_at: Optional[datetime] = None
 
 class Result(BaseModel):
     """
@@ -23,6 +28,7 @@ class Result(BaseModel):
     message: str
     session_history: list[Session] = []
     dialog_history: list[Dialog] = []
+    next_cursor: Optional[str] = None  # 还有下一页时，作为下一次请求的 after 参数
 
 class Task(BaseModel):
     """
@@ -8,7 +8,8 @@ CREATE TABLE IF NOT EXISTS `session` (
     `id` INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
     `session_name` varchar(255) NOT NULL,
     `user_id` INT NOT NULL,
-    `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP
+    `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX `idx_session_user_created` (`user_id`, `created_at`)
 );
 
 CREATE TABLE IF NOT EXISTS `dialog` (
@@ -16,7 +17,6 @@ CREATE TABLE IF NOT EXISTS `dialog` (
     `session_id` int(11) NOT NULL,
     `question` text NOT NULL,
     `message` text NOT NULL,
-    `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP
+    `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX `idx_dialog_session_created` (`session_id`, `created_at`)
 );
-
-SELECT MAX(id) FROM session;
\ No newline at end of file
@@ -0,0 +1,239 @@
+import asyncio
+import math
+import time
+import weakref
+from collections import OrderedDict, deque
+
+from Utils.metrics import REGISTRY
+
+admission_in_flight = REGISTRY.gauge("admission_in_flight", "Admitted upstream calls in progress", ("upstream",))
+admission_queued = REGISTRY.gauge("admission_queue_length", "Requests waiting for an upstream slot", ("upstream",))
+admission_rejected = REGISTRY.counter("admission_rejected_total", "Requests rejected because the queue was full",
+                                      ("upstream", "reason"))
+admission_wait = REGISTRY.histogram("admission_wait_seconds", "Time spent waiting for an upstream slot",
+                                    ("upstream",))
+
+
+class QueueFull(Exception):
+    """等待队列已满，retry_after 为建议的重试间隔（秒）"""
+
+    def __init__(self, upstream: str, retry_after: int):
+        super().__init__(f"{upstream} is overloaded, retry after {retry_after}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class QueueTimeout(Exception):
+    """排队时间超过了 max_wait"""
+
+
+class Ticket:
+    """一次上游调用的准入凭证，用完（或客户端放弃）后必须 release"""
+
+    def __init__(self, controller: "AdmissionController", user):
+        self.controller = controller
+        self.user = user
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.released = False
+        self._granted = asyncio.get_running_loop().create_future()
+
+    @property
+    def granted(self) -> bool:
+        return self._granted.done()
+
+    def position(self) -> int:
+        return self.controller.position(self)
+
+    async def wait(self, update_interval: float = 1.0):
+        """
+        等待获得上游名额，期间每当排队位置变化时产出新的位置（前面还有几个请求）。
+
+        超过控制器的 max_wait 仍未轮到时抛出 QueueTimeout。
+        """
+        deadline = self.enqueued_at + self.controller.max_wait
+        last = None
+        while not self.granted:
+            position = self.position()
+            if position != last:
+                last = position
+                yield position
+            timeout = min(update_interval, deadline - time.monotonic())
+            if timeout <= 0:
+                raise QueueTimeout(f"waited more than {self.controller.max_wait}s for {self.controller.name}")
+            try:
+                await asyncio.wait_for(asyncio.shield(self._granted), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self):
+        self.controller.release(self)
+
+
+class AdmissionController:
+    """
+    单个上游的准入控制。
+
+    同时进行的调用不超过 max_concurrent，其余请求进入有界等待队列；队列按用户分组轮转出队，
+    一个用户连发多个请求时不会挤占其他用户的名额。队列已满或单个用户排队过多时立即拒绝，
+    并根据近期的平均占用时间估算 Retry-After。
+    """
+
+    def __init__(self, name: str, max_concurrent: int = 16, max_queue: int = 64, max_queued_per_user: int = 4,
+                 max_wait: float = 120.0, expected_service_time: float = 10.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.max_wait = max_wait
+        self.service_time = expected_service_time  # 单次调用占用名额的时长（指数滑动平均）
+        self.active = 0
+        self._queues = OrderedDict()  # user -> deque[Ticket]，键的顺序即轮转顺序
+        self._queued = 0
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def retry_after(self) -> int:
+        return max(math.ceil((self._queued + 1) / self.max_concurrent * self.service_time), 1)
+
+    def enqueue(self, user) -> Ticket:
+        """申请一个名额：有空闲时直接获得，否则排队；无法排队时抛出 QueueFull"""
+        ticket = Ticket(self, user)
+        if self.active < self.max_concurrent and not self._queued:
+            self._grant(ticket)
+            return ticket
+        if self._queued >= self.max_queue:
+            admission_rejected.inc(upstream=self.name, reason="queue_full")
+            raise QueueFull(self.name, self.retry_after())
+        if len(self._queues.get(user, ())) >= self.max_queued_per_user:
+            admission_rejected.inc(upstream=self.name, reason="user_limit")
+            raise QueueFull(self.name, self.retry_after())
+        self._queues.setdefault(user, deque()).append(ticket)
+        self._queued += 1
+        admission_queued.set(self._queued, upstream=self.name)
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """按轮转出队的顺序估算 ticket 前面还有多少个请求"""
+        if ticket.granted or ticket.user not in self._queues:
+            return 0
+        own = self._queues[ticket.user]
+        if ticket not in own:
+            return 0
+        index = own.index(ticket)
+        ahead = index
+        before = True
+        for user, queue in self._queues.items():
+            if user == ticket.user:
+                before = False
+                continue
+            # 排在轮转顺序前面的用户在本轮也会先出队一个
+            ahead += min(len(queue), index + 1 if before else index)
+        return ahead
+
+    def release(self, ticket: Ticket):
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted:
+            self.active -= 1
+            admission_in_flight.set(self.active, upstream=self.name)
+            held = time.monotonic() - ticket.granted_at
+            self.service_time = 0.8 * self.service_time + 0.2 * held
+        else:
+            # 还在排队时客户端就断开了
+            queue = self._queues.get(ticket.user)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[ticket.user]
+                admission_queued.set(self._queued, upstream=self.name)
+        self._dispatch()
+
+    def _grant(self, ticket: Ticket):
+        self.active += 1
+        ticket.granted_at = time.monotonic()
+        ticket._granted.set_result(None)
+        admission_in_flight.set(self.active, upstream=self.name)
+        admission_wait.observe(ticket.granted_at - ticket.enqueued_at, upstream=self.name)
+
+    def _dispatch(self):
+        while self.active < self.max_concurrent and self._queued:
+            user, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            self._grant(ticket)
+        admission_queued.set(self._queued, upstream=self.name)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "queued": self._queued,
+            "queued_users": len(self._queues),
+            "avg_service_time": self.service_time,
+        }
+
+
+class AdmissionRegistry:
+    """按上游名称管理 AdmissionController，未单独配置的上游使用默认参数"""
+
+    def __init__(self, **defaults):
+        self.defaults = defaults
+        self._controllers = {}
+
+    def configure(self, name: str, **limits) -> AdmissionController:
+        """
+        指定上游的准入参数。已有控制器时原地更新（expected_service_time 只作为初始估计，不再覆盖），
+        已发出的 ticket 继续有效，调大 max_concurrent 后排队的请求立即出队。
+        """
+        controller = self._controllers.get(name)
+        if controller is None:
+            self._controllers[name] = AdmissionController(name, **{**self.defaults, **limits})
+            return self._controllers[name]
+        limits.pop("expected_service_time", None)
+        for key, value in limits.items():
+            setattr(controller, key, value)
+        controller._dispatch()
+        return controller
+
+    def get(self, name: str) -> AdmissionController:
+        controller = self._controllers.get(name)
+        if controller is None:
+            controller = self.configure(name)
+        return controller
+
+    def stats(self) -> dict:
+        return {name: controller.stats() for name, controller in self._controllers.items()}
+
+
+def admitted(ticket: Ticket, source, queue_notice: str, timeout_notice: str):
+    """
+    等到 ticket 获得名额后再开始消费 source，排队期间按 queue_notice 模板输出当前位置；
+    流结束或客户端断开时释放名额。返回的生成器没被迭代就被回收时（客户端在响应开始前断开）同样会释放。
+    """
+    stream = _admitted(ticket, source, queue_notice, timeout_notice)
+    weakref.finalize(stream, ticket.release)
+    return stream
+
+
+async def _admitted(ticket: Ticket, source, queue_notice: str, timeout_notice: str):
+    try:
+        try:
+            async for position in ticket.wait():
+                yield queue_notice.format(position=position)
+        except QueueTimeout:
+            yield timeout_notice
+            return
+        async for chunk in source:
+            yield chunk
+    finally:
+        ticket.release()
+        await source.aclose()
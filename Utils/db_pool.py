@@ -0,0 +1,164 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+import aiomysql
+
+from Utils.metrics import REGISTRY
+
+# MySQL 客户端错误码：连接已断开 / 查询过程中丢失连接
+_CONNECTION_LOST_CODES = (2006, 2013, 2055)
+
+db_query_latency = REGISTRY.histogram("db_query_duration_seconds", "Database query latency",
+                                      ("database", "statement"))
+db_query_errors = REGISTRY.counter("db_query_errors_total", "Failed database queries", ("database", "statement"))
+
+
+class DbError(Exception):
+    """数据库访问失败"""
+
+
+class DbTimeout(DbError):
+    """单条查询超过了超时时间"""
+
+
+class DbPool:
+    """
+    基于 aiomysql 的异步连接池。
+
+    替代模块级的单个 mysql.connector 连接：查询在池中的多个连接上并发执行，
+    不会阻塞事件循环；连接空闲过久时先做健康检查，断线会自动重连。
+    """
+
+    def __init__(self, database: str, user: str = "root", password: str = "123456",
+                 host: str = "localhost", port: int = 3306,
+                 minsize: int = 1, maxsize: int = 10,
+                 query_timeout: float = 10.0, health_check_interval: float = 30.0,
+                 pool_recycle: int = 3600):
+        self.database = database
+        self.user = user
+        self.password = password
+        self.host = host
+        self.port = port
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.query_timeout = query_timeout
+        self.health_check_interval = health_check_interval
+        self.pool_recycle = pool_recycle
+        self._pool = None
+
+    async def open(self):
+        if self._pool is not None:
+            return
+        self._pool = await aiomysql.create_pool(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            db=self.database,
+            minsize=self.minsize,
+            maxsize=self.maxsize,
+            autocommit=True,
+            charset="utf8mb4",
+            pool_recycle=self.pool_recycle,
+        )
+
+    async def close(self):
+        if self._pool is None:
+            return
+        self._pool.close()
+        await self._pool.wait_closed()
+        self._pool = None
+
+    @asynccontextmanager
+    async def acquire(self):
+        """从池中取出一个健康的连接"""
+        if self._pool is None:
+            await self.open()
+        conn = await self._pool.acquire()
+        try:
+            # 空闲超过检查间隔的连接先 ping 一次，断开则就地重连
+            last_used = getattr(conn, "_znxz_last_used", 0.0)
+            if time.monotonic() - last_used > self.health_check_interval:
+                try:
+                    await asyncio.wait_for(conn.ping(reconnect=True), self.query_timeout)
+                except (asyncio.TimeoutError, aiomysql.Error, OSError) as e:
+                    # 重连失败的连接关闭后交还，连接池会丢弃它
+                    conn.close()
+                    raise DbError(f"connection health check failed: {e}") from e
+            yield conn
+        finally:
+            conn._znxz_last_used = time.monotonic()
+            self._pool.release(conn)
+
+    async def _run(self, sql: str, args, fetch: str, many: bool, retry: bool, timeout: float = None):
+        statement = sql.split(None, 1)[0].upper()
+        start_time = time.monotonic()
+        try:
+            return await self._run_with_retry(sql, args, fetch, many, retry, timeout)
+        except DbError:
+            db_query_errors.inc(database=self.database, statement=statement)
+            raise
+        finally:
+            db_query_latency.observe(time.monotonic() - start_time, database=self.database, statement=statement)
+
+    async def _run_with_retry(self, sql: str, args, fetch: str, many: bool, retry: bool, timeout: float = None):
+        timeout = timeout or self.query_timeout
+        attempts = 2 if retry else 1
+        for attempt in range(attempts):
+            async with self.acquire() as conn:
+                try:
+                    return await asyncio.wait_for(self._execute(conn, sql, args, fetch, many), timeout)
+                except asyncio.TimeoutError as e:
+                    # 超时后连接状态未知，关闭它让连接池丢弃
+                    conn.close()
+                    raise DbTimeout(f"query timed out after {timeout}s") from e
+                except aiomysql.OperationalError as e:
+                    conn.close()
+                    if e.args and e.args[0] in _CONNECTION_LOST_CODES and attempt + 1 < attempts:
+                        continue
+                    raise DbError(str(e)) from e
+                except aiomysql.Error as e:
+                    raise DbError(str(e)) from e
+
+    @staticmethod
+    async def _execute(conn, sql: str, args, fetch: str, many: bool):
+        async with conn.cursor() as cursor:
+            if many:
+                await cursor.executemany(sql, args)
+            else:
+                await cursor.execute(sql, args)
+            if fetch == "one":
+                return await cursor.fetchone()
+            if fetch == "all":
+                return await cursor.fetchall()
+            if fetch == "lastrowid":
+                return cursor.lastrowid
+            return cursor.rowcount
+
+    async def fetchone(self, sql: str, args=None, timeout: float = None):
+        return await self._run(sql, args, "one", many=False, retry=True, timeout=timeout)
+
+    async def fetchall(self, sql: str, args=None, timeout: float = None):
+        return await self._run(sql, args, "all", many=False, retry=True, timeout=timeout)
+
+    async def execute(self, sql: str, args=None, timeout: float = None) -> int:
+        """执行写语句并返回 lastrowid（写操作不自动重试，避免重复写入）"""
+        return await self._run(sql, args, "lastrowid", many=False, retry=False, timeout=timeout)
+
+    async def executemany(self, sql: str, seq_of_args, timeout: float = None) -> int:
+        return await self._run(sql, seq_of_args, "rowcount", many=True, retry=False, timeout=timeout)
+
+
+def create_pool(database: str, **kwargs):
+    """
+    按环境变量创建连接池：默认连接 MySQL；DB_BACKEND=sqlite 时换成接口相同的 SQLite 替身，
+    数据文件放在 SQLITE_DIR 下（未设置时用内存库），建表脚本由 SQLITE_SCHEMA 指定。
+    """
+    if os.getenv("DB_BACKEND", "mysql") == "sqlite":
+        from Utils.sqlite_pool import SqlitePool
+        directory = os.getenv("SQLITE_DIR")
+        path = os.path.join(directory, f"{database}.db") if directory else ":memory:"
+        return SqlitePool(database, path=path, schema=os.getenv("SQLITE_SCHEMA"))
+    return DbPool(database, **kwargs)
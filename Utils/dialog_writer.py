@@ -0,0 +1,135 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from Utils.db_pool import DbPool
+from Utils.tracing import Span
+
+logger = logging.getLogger(__name__)
+
+INSERT_DIALOG_SQL = "INSERT INTO dialog (session_id, question, message, created_at) VALUES (%s, %s, %s, %s)"
+
+
+class DialogWriter:
+    """
+    对话记录的后台批量写入器（write-behind）。
+
+    流结束时只把记录放入有界内存队列，由后台任务按数量或时间触发多行批量 INSERT，
+    一次提交写入多条对话。写库失败的批次和队列满时溢出的记录追加到本地 spill 文件，启动时重放；
+    文件写入都在线程中进行，不阻塞事件循环。关闭时先排空队列再退出。
+    """
+
+    def __init__(self, db: DbPool, batch_size: int = 100, flush_interval: float = 0.5,
+                 max_queue: int = 10000, spill_path: str = "dialog_spill.jsonl"):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+        # 队列满时溢出的记录，由一个后台任务成批写入 spill 文件
+        self._overflow = []
+        self._spilling = None
+        self._spill_lock = threading.Lock()
+
+    async def start(self):
+        await self.replay()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # None 作为结束标记，排在已有记录之后
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        if self._spilling is not None:
+            await self._spilling
+
+    def submit(self, session_id: int, question: str, message: str, trace: Span = None):
+        """提交一条对话记录，不等待数据库；传入 trace 时记录从提交到落库的 db.persist span"""
+        row = (session_id, question, message, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        span = trace.child("db.persist", session_id=session_id) if trace is not None else None
+        try:
+            self._queue.put_nowait((row, span))
+        except asyncio.QueueFull:
+            # 队列已满说明数据库跟不上，交给后台任务落盘等待重放，不阻塞流式响应和事件循环
+            logger.warning("dialog queue full, spilling record to %s", self.spill_path)
+            self._overflow.append(row)
+            if self._spilling is None:
+                self._spilling = asyncio.get_running_loop().create_task(self._spill_overflow())
+            if span is not None:
+                span.end(error="queue full, spilled")
+
+    async def _spill_overflow(self):
+        try:
+            while self._overflow:
+                rows, self._overflow = self._overflow, []
+                await asyncio.to_thread(self._spill, rows)
+        except OSError as e:
+            logger.error("dialog spill failed, %d records lost: %s", len(rows) + len(self._overflow), e)
+            self._overflow = []
+        finally:
+            self._spilling = None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush([row for row, _ in batch], [span for _, span in batch if span is not None])
+
+    async def _flush(self, batch: list, spans: list = ()):
+        error = None
+        try:
+            await self.db.executemany(INSERT_DIALOG_SQL, batch)
+        except Exception as e:
+            logger.error("dialog batch insert failed (%d rows): %s", len(batch), e)
+            error = str(e)
+            await asyncio.to_thread(self._spill, batch)
+        for span in spans:
+            span.set_attribute("batch_size", len(batch))
+            span.end(error=error)
+
+    def _spill(self, rows: list):
+        # 溢出和写库失败的记录可能同时在不同线程中落盘
+        with self._spill_lock, open(self.spill_path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    async def replay(self):
+        """把上次写库失败落盘的记录重新写入数据库"""
+        replay_path = self.spill_path + ".replay"
+        if os.path.exists(self.spill_path):
+            # 上次重放中断时 replay 文件可能还在，追加而不是覆盖
+            with open(self.spill_path, encoding="utf-8") as src, open(replay_path, "a", encoding="utf-8") as dst:
+                dst.write(src.read())
+            os.remove(self.spill_path)
+        if not os.path.exists(replay_path):
+            return
+        with open(replay_path, encoding="utf-8") as f:
+            rows = [tuple(json.loads(line)) for line in f if line.strip()]
+
+        for i in range(0, len(rows), self.batch_size):
+            # 重放失败的批次会再次写入 spill 文件
+            await self._flush(rows[i:i + self.batch_size])
+        os.remove(replay_path)
+        logger.info("replayed %d spilled dialog records", len(rows))
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from urllib.parse import urlsplit
+
+import httpx
+
+from Utils.tracing import inject_traceparent
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    h2_available = True
+except ImportError:
+    h2_available = False
+
+
+class UpstreamConfig:
+    """
+    单个上游服务的连接配置。
+    """
+
+    def __init__(self, timeout: float = 60.0, connect_timeout: float = 10.0,
+                 max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 60.0, http2: bool = False):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """响应体关闭时（读完、出错或被放弃）调用一次 release"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+
+
+class _TrackingTransport(httpx.AsyncHTTPTransport):
+    """统计进行中的请求数（到响应体关闭为止），归零时调用 on_idle"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.in_flight = 0
+        self.on_idle = None
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self._release()
+            raise
+        response.stream = _ReleasingStream(response.stream, self._release)
+        return response
+
+    def _release(self):
+        self.in_flight -= 1
+        if self.in_flight == 0 and self.on_idle is not None:
+            self.on_idle()
+
+
+def upstream_key(url: str) -> str:
+    """按 scheme://host:port 归并上游，同一上游的不同路径共享连接"""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return f"{parts.scheme}://{parts.hostname}:{port}"
+
+
+class HttpClientRegistry:
+    """
+    按上游复用的 httpx.AsyncClient 注册表。
+
+    每个上游只创建一个带连接池的客户端，请求之间复用已建立的 keep-alive 连接，
+    省掉每次请求的 TCP/TLS 握手。配置变更后旧客户端在进行中的请求全部结束后关闭，
+    其余客户端在应用 lifespan 结束时统一关闭。
+    所有请求都会带上当前 span 的 W3C traceparent 头。
+
+    pool 用于区分同一上游上配置不同的调用方（如路由表中的各个模式）：每个 (pool, 上游) 有自己的
+    配置和客户端，互不覆盖；没有为该 pool 配置时使用该上游不分 pool 的配置。
+    """
+
+    def __init__(self, default: UpstreamConfig = None):
+        self.default = default or UpstreamConfig()
+        self._configs = {}
+        self._clients = {}
+        self._transports = {}
+        self._retired = []
+        self._closing = set()
+
+    def configure(self, url: str, config: UpstreamConfig, pool: str = None):
+        key = (pool, upstream_key(url))
+        current = self._configs.get(key)
+        if current is not None and vars(current) == vars(config):
+            return
+        self._configs[key] = config
+        # 配置变更后旧客户端作废，下次 get 时按新配置重建
+        old = self._clients.pop(key, None)
+        if old is not None:
+            logger.info("upstream %s (pool %s) reconfigured, old client will be closed", key[1], pool)
+            self._retire(old, self._transports.pop(key))
+
+    def _retire(self, client: httpx.AsyncClient, transport: _TrackingTransport):
+        """进行中的请求结束后关闭旧客户端；没有运行中的事件循环时留到 aclose() 关闭"""
+        self._retired.append(client)
+
+        def close():
+            try:
+                task = asyncio.get_running_loop().create_task(client.aclose())
+            except RuntimeError:
+                return
+            self._retired.remove(client)
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+        if transport.in_flight == 0:
+            close()
+        else:
+            transport.on_idle = close
+
+    def get(self, url: str, pool: str = None) -> httpx.AsyncClient:
+        key = (pool, upstream_key(url))
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            config = self._configs.get(key) or self._configs.get((None, key[1]), self.default)
+            client, self._transports[key] = self._create(config)
+            self._clients[key] = client
+        return client
+
+    @staticmethod
+    def _create(config: UpstreamConfig) -> tuple:
+        http2 = config.http2 and h2_available
+        if config.http2 and not h2_available:
+            logger.warning("h2 未安装，上游将退回 HTTP/1.1")
+        transport = _TrackingTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+        )
+        client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+            event_hooks={"request": [inject_traceparent]},
+        )
+        return client, transport
+
+    async def aclose(self):
+        clients = list(self._clients.values()) + self._retired
+        self._clients.clear()
+        self._transports.clear()
+        self._retired = []
+        for client in clients:
+            await client.aclose()
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
@@ -0,0 +1,496 @@
+"""
+Java 源码的结构大纲：包名、import、类型（含嵌套类型）、方法签名、字段及其行号范围。
+
+基于一个轻量的词法分析器，注释、字符串和文本块中的内容不会被误认为声明；不做完整的语法分析，
+方法体和字段初始化表达式只按括号配对跳过。大纲按代码摘要缓存，同一份代码只解析一次。
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+OUTLINE_CACHE_SIZE = 256
+
+_TOKEN_RE = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<text>"""(?:\\.|[^\\])*?(?:"""|\Z))
+  | (?P<string>"(?:\\.|[^"\\\n])*"?)
+  | (?P<char>'(?:\\.|[^'\\\n])*'?)
+  | (?P<ident>[^\W\d][\w$]*|\$[\w$]*)
+  | (?P<number>\.?\d(?:[\w.]|(?<=[eEpP])[+-])*)
+  | (?P<op>\S)
+''', re.VERBOSE | re.DOTALL)
+_SPACE_RE = re.compile(r"\s+")
+
+MODIFIERS = frozenset(("public", "protected", "private", "static", "final", "abstract", "native", "synchronized",
+                       "transient", "volatile", "strictfp", "default", "sealed"))
+TYPE_KINDS = frozenset(("class", "interface", "enum", "record"))
+# 代码片段中以这些关键字开头的是语句，不是成员声明
+STATEMENT_KEYWORDS = frozenset(("if", "else", "for", "while", "do", "switch", "case", "try", "catch", "finally",
+                                "return", "throw", "new", "assert", "break", "continue", "yield", "this", "super"))
+_OPENERS = "([{"
+_CLOSERS = ")]}"
+
+Token = namedtuple("Token", "kind text start end line")
+
+
+def tokenize(code: str) -> list:
+    """把 Java 代码切分为 Token 列表，跳过空白和注释；未闭合的字符串或注释延伸到行尾或文件尾"""
+    tokens = []
+    line = 1
+    for match in _TOKEN_RE.finditer(code):
+        kind = match.lastgroup
+        text = match.group()
+        if kind not in ("space", "comment"):
+            tokens.append(Token(kind, text, match.start(), match.end(), line))
+        line += text.count("\n")
+    return tokens
+
+
+def _squash(text: str) -> str:
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+class JavaField:
+    def __init__(self, name: str, type: str, modifiers: list, start: int, end: int, line: int):
+        self.name = name
+        self.type = type
+        self.modifiers = modifiers
+        self.start = start
+        self.end = end
+        self.line = line
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "type": self.type, "modifiers": self.modifiers, "line": self.line}
+
+
+class JavaMethod:
+    """
+    方法或构造器。signature 为规整空白后的声明（修饰符到 throws 子句，不含注解和方法体）；
+    body_start 为方法体左花括号的位置，抽象方法和接口方法为 None。
+    """
+
+    def __init__(self, name: str, signature: str, return_type: str, params: list, modifiers: list,
+                 start: int, end: int, start_line: int, end_line: int, body_start: int = None):
+        self.name = name
+        self.signature = signature
+        self.return_type = return_type
+        self.params = params
+        self.modifiers = modifiers
+        self.start = start
+        self.end = end
+        self.start_line = start_line
+        self.end_line = end_line
+        self.body_start = body_start
+
+    @property
+    def constructor(self) -> bool:
+        return not self.return_type
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "signature": self.signature,
+            "return_type": self.return_type,
+            "params": self.params,
+            "constructor": self.constructor,
+            "lines": [self.start_line, self.end_line],
+        }
+
+
+class JavaType:
+    """
+    类、接口、枚举、record 或注解类型。
+
+    start 为第一个注解或修饰符的位置；doc_start 为上一个词法单元之后的位置，
+    code[doc_start:end] 包含声明前的 javadoc 和注释。
+    """
+
+    def __init__(self, kind: str, name: str, modifiers: list, start: int, doc_start: int, start_line: int):
+        self.kind = kind
+        self.name = name
+        self.modifiers = modifiers
+        self.start = start
+        self.doc_start = doc_start
+        self.end = start
+        self.start_line = start_line
+        self.end_line = start_line
+        self.methods = []
+        self.fields = []
+        self.types = []
+
+    def method(self, name: str):
+        return next((method for method in self.methods if method.name == name), None)
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "modifiers": self.modifiers,
+            "lines": [self.start_line, self.end_line],
+            "fields": [field.to_dict() for field in self.fields],
+            "methods": [method.to_dict() for method in self.methods],
+            "types": [nested.to_dict() for nested in self.types],
+        }
+
+
+class JavaOutline:
+    """
+    一份 Java 源码的大纲。types 为顶层类型；methods 和 fields 为不属于任何类型的成员，
+    用户只粘贴了方法片段时出现在这里。
+    """
+
+    def __init__(self, code: str):
+        self.code = code
+        self.package = None
+        self.imports = []
+        self.types = []
+        self.methods = []
+        self.fields = []
+
+    def iter_types(self):
+        """按源码顺序深度优先遍历所有类型，包括嵌套类型"""
+        stack = list(reversed(self.types))
+        while stack:
+            java_type = stack.pop()
+            yield java_type
+            stack.extend(reversed(java_type.types))
+
+    def primary_type(self):
+        """文件的主类型：第一个 public 顶层类型，没有时取第一个顶层类型"""
+        return next((t for t in self.types if "public" in t.modifiers), self.types[0] if self.types else None)
+
+    def find_type(self, name: str):
+        return next((t for t in self.iter_types() if t.name == name), None)
+
+    def source(self, declaration, with_doc: bool = False) -> str:
+        """取出类型、方法或字段的源码片段"""
+        start = declaration.doc_start if with_doc and hasattr(declaration, "doc_start") else declaration.start
+        return self.code[start:declaration.end]
+
+    def to_dict(self) -> dict:
+        return {
+            "package": self.package,
+            "imports": self.imports,
+            "types": [java_type.to_dict() for java_type in self.types],
+            "methods": [method.to_dict() for method in self.methods],
+            "fields": [field.to_dict() for field in self.fields],
+        }
+
+
+class _Parser:
+    def __init__(self, code: str):
+        self.code = code
+        self.tokens = tokenize(code)
+        self.i = 0
+
+    def text(self, offset: int = 0) -> str:
+        index = self.i + offset
+        return self.tokens[index].text if index < len(self.tokens) else ""
+
+    def skip_balanced(self):
+        """当前位于左括号，跳到与之配对的右括号之后"""
+        depth = 0
+        while self.i < len(self.tokens):
+            text = self.tokens[self.i].text
+            self.i += 1
+            if text in _OPENERS:
+                depth += 1
+            elif text in _CLOSERS:
+                depth -= 1
+                if depth <= 0:
+                    return
+
+    def skip_until(self, stops: str):
+        """跳过括号配对的内容，停在同一层的 stops 中的任一符号处"""
+        while self.i < len(self.tokens):
+            text = self.tokens[self.i].text
+            if text in stops:
+                return
+            if text in _OPENERS:
+                self.skip_balanced()
+            else:
+                self.i += 1
+
+    def modifiers(self) -> list:
+        """跳过注解，收集修饰符"""
+        modifiers = []
+        while self.i < len(self.tokens):
+            text = self.text()
+            if text == "@" and self.text(1) != "interface":
+                self.i += 2
+                while self.text() == "." and self.i + 1 < len(self.tokens):
+                    self.i += 2
+                if self.text() == "(":
+                    self.skip_balanced()
+            elif text in MODIFIERS:
+                modifiers.append(text)
+                self.i += 1
+            elif text == "non" and self.text(1) == "-" and self.text(2) == "sealed":
+                modifiers.append("non-sealed")
+                self.i += 3
+            else:
+                return modifiers
+        return modifiers
+
+    def qualified_name(self) -> str:
+        """读到分号为止的名字，用于 package 和 import"""
+        start = self.i
+        while self.i < len(self.tokens) and self.text() != ";":
+            self.i += 1
+        name = "".join(token.text for token in self.tokens[start:self.i])
+        self.i += 1
+        return name.replace("static", "static ", 1) if name.startswith("static") else name
+
+    def doc_start(self, index: int) -> int:
+        return self.tokens[index - 1].end if index > 0 else 0
+
+    def parse(self) -> JavaOutline:
+        outline = JavaOutline(self.code)
+        while self.i < len(self.tokens):
+            text = self.text()
+            if text == "package":
+                self.i += 1
+                outline.package = self.qualified_name()
+            elif text == "import":
+                self.i += 1
+                outline.imports.append(self.qualified_name())
+            elif text in ";}":
+                self.i += 1
+            else:
+                start = self.i
+                modifiers = self.modifiers()
+                java_type = self.type_declaration(start, modifiers)
+                if java_type is not None:
+                    outline.types.append(java_type)
+                elif self.text() == "{":
+                    self.skip_balanced()
+                else:
+                    # 不在任何类型中的成员，例如只粘贴了一个方法
+                    self.member(outline, start, modifiers)
+                if self.i == start:
+                    self.i += 1
+        return outline
+
+    def type_declaration(self, start: int, modifiers: list):
+        tokens = self.tokens
+        if self.text() == "@" and self.text(1) == "interface":
+            kind = "@interface"
+            self.i += 2
+        elif self.text() in TYPE_KINDS and self.i + 1 < len(tokens) and tokens[self.i + 1].kind == "ident":
+            kind = self.text()
+            self.i += 1
+        else:
+            return None
+        if self.i >= len(tokens):
+            return None
+        name_token = tokens[self.i]
+        first = tokens[min(start, len(tokens) - 1)]
+        java_type = JavaType(kind, name_token.text, modifiers, first.start, self.doc_start(start), first.line)
+        self.i += 1
+        # 跳过类型参数、extends/implements/permits 和 record 的组件列表
+        self.skip_until("{;")
+        if self.text() == "{":
+            self.i += 1
+            if kind == "enum":
+                # 枚举常量（可带参数和类体）到第一个同层分号为止
+                self.skip_until(";}")
+                if self.text() == ";":
+                    self.i += 1
+            self.members(java_type)
+        last = tokens[min(self.i, len(tokens) - 1)]
+        java_type.end = last.end if self.i < len(tokens) else len(self.code)
+        java_type.end_line = last.line
+        self.i += 1
+        return java_type
+
+    def members(self, owner: JavaType):
+        while self.i < len(self.tokens) and self.text() != "}":
+            text = self.text()
+            if text == ";":
+                self.i += 1
+                continue
+            start = self.i
+            modifiers = self.modifiers()
+            if self.text() == "{":
+                # 实例或静态初始化块
+                self.skip_balanced()
+                continue
+            nested = self.type_declaration(start, modifiers)
+            if nested is not None:
+                owner.types.append(nested)
+                continue
+            self.member(owner, start, modifiers)
+            if self.i == start:
+                self.i += 1
+
+    def member(self, owner, start: int, modifiers: list):
+        """解析一个方法、构造器或字段声明，owner 为 JavaType 或 JavaOutline"""
+        tokens = self.tokens
+        head = self.i
+        if self.text() in STATEMENT_KEYWORDS:
+            self.skip_until(";{}")
+            if self.text() == "{":
+                self.skip_balanced()
+            elif self.text() == ";":
+                self.i += 1
+            return
+        angle = 0
+        while self.i < len(tokens):
+            text = self.text()
+            if text == "<":
+                angle += 1
+            elif text == ">":
+                angle -= 1
+            elif angle <= 0:
+                if text == "(" and self.i > head and tokens[self.i - 1].kind == "ident":
+                    owner.methods.append(self.method(start, modifiers, head))
+                    return
+                if text in "=;," and self.i > head:
+                    owner.fields.extend(self.fields(start, modifiers, head))
+                    return
+                if text == "{" and self.i == head + 1 and tokens[head].kind == "ident":
+                    # record 的紧凑构造器
+                    owner.methods.append(self.method(start, modifiers, head))
+                    return
+                if text in "{}":
+                    return
+            self.i += 1
+
+    def method(self, start: int, modifiers: list, head: int) -> JavaMethod:
+        tokens = self.tokens
+        code = self.code
+        name_index = self.i - 1
+        name_token = tokens[name_index]
+        # 返回类型之前可能是泛型方法的类型参数
+        type_start = head
+        if tokens[head].text == "<":
+            angle = 0
+            while type_start < name_index:
+                text = tokens[type_start].text
+                angle += (text == "<") - (text == ">")
+                type_start += 1
+                if angle == 0:
+                    break
+        return_type = _squash(code[tokens[type_start].start:name_token.start]) if type_start < name_index else ""
+
+        params = []
+        if self.text() == "(":
+            open_index = self.i
+            self.skip_balanced()
+            params = self.params(open_index + 1, self.i - 1)
+        # throws 子句、注解方法的 default 值
+        self.skip_until("{;}")
+        signature_end = tokens[self.i - 1].end
+        body_start = None
+        if self.text() == "{":
+            body_start = tokens[self.i].start
+            self.skip_balanced()
+            last = tokens[self.i - 1]
+        elif self.text() == ";":
+            last = tokens[self.i]
+            self.i += 1
+        else:
+            last = tokens[self.i - 1]
+        signature = " ".join(modifiers + [_squash(code[tokens[head].start:signature_end])])
+        first = tokens[start]
+        return JavaMethod(name_token.text, signature, return_type, params, modifiers,
+                          first.start, last.end, first.line, last.line, body_start)
+
+    def params(self, begin: int, end: int) -> list:
+        """参数列表中每个参数的类型（规整空白、去掉注解和 final，名字后的 [] 并入类型）"""
+        params = []
+        depth = 0
+        piece = begin
+        for index in range(begin, end + 1):
+            text = self.tokens[index].text if index < end else ","
+            if text in "<([":
+                depth += 1
+            elif text in ">)]":
+                depth -= 1
+            elif text == "," and depth <= 0:
+                param_type = self.param_type(self.tokens[piece:index])
+                if param_type:
+                    params.append(param_type)
+                piece = index + 1
+        return params
+
+    def param_type(self, tokens: list) -> str:
+        i = 0
+        while i < len(tokens):
+            if tokens[i].text == "final":
+                i += 1
+            elif tokens[i].text == "@":
+                # 注解名（可带包名）和括号中的参数
+                i += 2
+                while i + 1 < len(tokens) and tokens[i].text == ".":
+                    i += 2
+                if i < len(tokens) and tokens[i].text == "(":
+                    depth = 0
+                    while i < len(tokens):
+                        depth += (tokens[i].text == "(") - (tokens[i].text == ")")
+                        i += 1
+                        if depth == 0:
+                            break
+            else:
+                break
+        tokens = tokens[i:]
+        dims = 0
+        while len(tokens) > 2 and tokens[-1].text == "]" and tokens[-2].text == "[":
+            # 旧式数组参数 int arr[]
+            tokens = tokens[:-2]
+            dims += 1
+        names = [index for index, token in enumerate(tokens) if token.kind == "ident"]
+        if not names or names[-1] == 0:
+            return ""
+        type_tokens = tokens[:names[-1]]
+        return _squash(self.code[type_tokens[0].start:type_tokens[-1].end]) + "[]" * dims
+
+    def fields(self, start: int, modifiers: list, head: int) -> list:
+        tokens = self.tokens
+        first = tokens[start]
+        name_index = self.i - 1
+        while name_index > head and tokens[name_index].kind != "ident":
+            name_index -= 1  # 旧式数组声明 int a[];
+        type_text = _squash(self.code[tokens[head].start:tokens[name_index].start])
+        names = [tokens[name_index]]
+        while self.i < len(tokens):
+            if self.text() == "=":
+                self.skip_until(",;}")
+            if self.text() == ",":
+                self.i += 1
+                if self.i < len(tokens) and tokens[self.i].kind == "ident":
+                    names.append(tokens[self.i])
+                self.skip_until("=,;}")
+                continue
+            break
+        last = tokens[min(self.i, len(tokens) - 1)]
+        if self.text() == ";":
+            self.i += 1
+        return [JavaField(name.text, type_text, modifiers, first.start, last.end, name.line) for name in names]
+
+
+def parse_outline(code: str) -> JavaOutline:
+    """解析 Java 代码的大纲，不使用缓存。语法错误或不完整的代码尽量解析，不会抛出异常"""
+    return _Parser(code).parse()
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def outline(code: str) -> JavaOutline:
+    """按代码摘要缓存的 parse_outline；返回的大纲在多个调用者之间共享，不要修改"""
+    key = hashlib.sha256(code.encode("utf-8", "surrogatepass")).hexdigest()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            return cached
+    result = parse_outline(code)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > OUTLINE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
@@ -1,13 +1,17 @@
 import json
+import os
+import time
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from cryptography.fernet import Fernet
 
+from Utils.prefix_cache_stats import PrefixCacheStats
+
 api_key = b'gAAAAABoJXqyrhK0vAFN5BZ9u5Ra8za8nHQU6BW5AAq6JXzYiqhOkIHTyB22s5LAaW-O66DgkumpiJfDqAPVw2KSjZXITfFcTODtvqLGleuTXTPmvg9-TbcEpsRPNHAagLgIQhWisfGJ'
 key = b'upe2l6UFonRu7qzhWWRfIeYSHJt25nS11o7arzDFlMs='
 cipher = Fernet(key)
 
-BASE_URL = 'https://api.deepseek.com'
+BASE_URL = os.getenv('LLM_BASE_URL', 'https://api.deepseek.com')  # 压测时指向本地模拟服务
 MODEL_V3 = 'deepseek-chat'  # DeepSeek V3
 MODEL_R1 = 'deepseek-reasoner'  # DeepSeek V3
 
@@ -16,9 +20,19 @@ dp_client = OpenAI(
     api_key=cipher.decrypt(api_key).decode()
 )
 
+# 异步客户端：在 FastAPI 的事件循环中等待网络时不会阻塞其他请求
+dp_async_client = AsyncOpenAI(
+    base_url=BASE_URL,
+    api_key=cipher.decrypt(api_key).decode()
+)
+
 # prompt
+# 系统提示词必须保持逐字节不变并放在消息最前面，上游才能复用已缓存的前缀
 SYS_ROLE = "你是大学软件工程课程助手"
 
+# 前缀缓存命中统计
+prefix_cache_stats = PrefixCacheStats()
+
 
 class LlmApi:
     def znxz(self, msg: str):
@@ -64,6 +78,59 @@ class StreamLlmApi:
         return stream_response()
 
 
+class AsyncLlmApi:
+    """LlmApi 的异步版本，供 async 路由中使用"""
+
+    async def znxz(self, msg: str):
+        response = await dp_async_client.chat.completions.create(
+            model=MODEL_R1,
+            messages=[
+                {"role": "system", "content": SYS_ROLE},
+                {"role": "user", "content": msg},
+            ],
+            stream=False
+        )
+        prefix_cache_stats.record(response.usage)
+
+        return response.choices[0].message.content
+
+
+class AsyncStreamLlmApi:
+    """DeepSeek-V3 的异步流式输出API，返回异步生成器"""
+
+    async def znxz(self, msg: str):
+        start_time = time.monotonic()
+        response = await dp_async_client.chat.completions.create(
+            model="deepseek-chat",
+            messages=[
+                {"role": "system", "content": SYS_ROLE},
+                {"role": "user", "content": msg},
+            ],
+            max_tokens=1024,
+            temperature=0.7,
+            stream=True,
+            # 最后一个分片附带 usage，其中包含前缀缓存命中的 token 数
+            stream_options={"include_usage": True}
+        )
+
+        # Async generator to yield chunks of data
+        async def stream_response():
+            ttft = None
+            try:
+                async for chunk in response:
+                    if chunk.usage:
+                        prefix_cache_stats.record(chunk.usage, ttft)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if ttft is None:
+                            ttft = time.monotonic() - start_time
+                        yield chunk.choices[0].delta.content
+            finally:
+                # 客户端中途断开时及时释放上游连接
+                await response.close()
+
+        return stream_response()
+
+
 if __name__ == '__main__':
     # model = LlmApi()
     model = StreamLlmApi()
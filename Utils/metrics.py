@@ -0,0 +1,246 @@
+import asyncio
+import threading
+import time
+
+from Utils.prompt_budget import estimate_tokens
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+RATE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key: tuple, value) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_sample(self, key: tuple, value) -> list:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """进程内的指标注册表，按 Prometheus 文本格式导出"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class StreamMeter:
+    """
+    一次流式响应中真正内容的计数：首个内容分片的时间、分片数和估算的 token 数。
+
+    输出中夹杂连接提示、排队提示等本地状态行时，由生成内容的代码对每个内容分片调用 content()，
+    首分片延迟和吞吐只按这些分片统计。
+    """
+
+    def __init__(self):
+        self.first = None
+        self.chunks = 0
+        self.tokens = 0
+
+    def content(self, chunk: str) -> str:
+        if chunk:
+            if self.first is None:
+                self.first = time.monotonic()
+            self.chunks += 1
+            self.tokens += estimate_tokens(chunk)
+        return chunk
+
+
+class StreamMetrics:
+    """
+    流式响应的指标：首个分片延迟、总耗时、每秒分片数/token 数以及正在进行的流数量。
+
+    label 用于区分对话模式或接口，async 和同步生成器分别用 wrap / wrap_sync 包装。
+    不传 meter 时每个输出分片都算内容；传入 meter 时 wrap 只统计耗时和流数量，内容由 meter 计数。
+    """
+
+    def __init__(self, prefix: str, label: str = "mode", registry: MetricsRegistry = REGISTRY):
+        labels = (label,)
+        self.label = label
+        self.ttfb = registry.histogram(f"{prefix}_stream_first_chunk_seconds",
+                                       "Time from request start to the first streamed chunk", labels)
+        self.duration = registry.histogram(f"{prefix}_stream_duration_seconds",
+                                           "Total duration of streamed responses", labels)
+        self.chunk_rate = registry.histogram(f"{prefix}_stream_chunks_per_second",
+                                             "Chunks per second of streamed responses", labels, RATE_BUCKETS)
+        self.token_rate = registry.histogram(f"{prefix}_stream_tokens_per_second",
+                                             "Estimated tokens per second of streamed responses", labels,
+                                             RATE_BUCKETS)
+        self.active = registry.gauge(f"{prefix}_active_streams", "Streams currently being sent", labels)
+
+    def _start(self, value: str):
+        self.active.inc(**{self.label: value})
+        return time.monotonic()
+
+    def _finish(self, value: str, start: float, meter: StreamMeter):
+        labels = {self.label: value}
+        self.active.dec(**labels)
+        elapsed = time.monotonic() - start
+        self.duration.observe(elapsed, **labels)
+        if meter.first is not None:
+            self.ttfb.observe(meter.first - start, **labels)
+            streaming = time.monotonic() - meter.first
+            if streaming > 0 and meter.chunks > 1:
+                self.chunk_rate.observe(meter.chunks / streaming, **labels)
+                self.token_rate.observe(meter.tokens / streaming, **labels)
+
+    async def wrap(self, source, value: str, start: float = None, meter: StreamMeter = None):
+        started = self._start(value)
+        start = start if start is not None else started
+        counted = meter is None
+        meter = meter or StreamMeter()
+        try:
+            async for chunk in source:
+                if counted:
+                    meter.content(chunk)
+                yield chunk
+        finally:
+            self._finish(value, start, meter)
+
+    def wrap_sync(self, source, value: str, start: float = None, meter: StreamMeter = None):
+        started = self._start(value)
+        start = start if start is not None else started
+        counted = meter is None
+        meter = meter or StreamMeter()
+        try:
+            for chunk in source:
+                if counted:
+                    meter.content(chunk)
+                yield chunk
+        finally:
+            self._finish(value, start, meter)
+
+
+async def monitor_event_loop_lag(interval: float = 0.5, registry: MetricsRegistry = REGISTRY):
+    """周期性测量事件循环的调度延迟，长时间的阻塞调用会直接体现在这里"""
+    lag_gauge = registry.gauge("event_loop_lag_seconds", "Most recent event loop scheduling lag")
+    lag_histogram = registry.histogram("event_loop_lag_seconds_distribution", "Event loop scheduling lag")
+    loop = asyncio.get_running_loop()
+    while True:
+        before = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - before - interval, 0.0)
+        lag_gauge.set(lag)
+        lag_histogram.observe(lag)
@@ -0,0 +1,126 @@
+import json
+from typing import AsyncGenerator, AsyncIterable
+
+_INVALID = object()
+
+
+class NdjsonFramer:
+    """
+    增量 NDJSON 分帧器。
+
+    上游的文本分片与行边界无关：一行可能被拆成几片，一片也可能包含多行。
+    feed() 缓冲不完整的行，只对完整的行做 JSON 解码；不像 JSON 的行直接作为文本返回，
+    正常数据路径上不会抛出异常。跨多行的 JSON 文档（如格式化输出）须以独占一行的 { 或 [ 开始，
+    会被拼接后整体解码，解码失败时按原文输出。
+
+    不完整的行去掉前导空白后不以 { 或 [ 开头时不可能是 JSON 记录，立即作为文本返回，
+    该行余下的部分也随到随返回，纯文本上游（如模式 2/3 的长段落）不会被攒到换行才输出。
+
+    返回的每个记录要么是解码后的 JSON 对象（dict/list），要么是原样文本（str，保留换行）。
+    """
+
+    def __init__(self, max_pending_lines: int = 10000):
+        self.max_pending_lines = max_pending_lines
+        self._buffer = ""
+        self._pending = None
+        # 当前行已经作为文本开始输出，直到换行前的内容都直接返回
+        self._passing = False
+
+    def feed(self, text: str) -> list:
+        if not text:
+            return []
+        records = []
+        if self._passing:
+            newline = text.find("\n")
+            if newline < 0:
+                return [text]
+            records.append(text[:newline + 1])
+            self._passing = False
+            text = text[newline + 1:]
+
+        data = self._buffer + text
+        last_newline = data.rfind("\n")
+        if last_newline < 0:
+            self._buffer = data
+        else:
+            self._buffer = data[last_newline + 1:]
+            for line in data[:last_newline].split("\n"):
+                self._frame(line, records)
+
+        partial = self._buffer.lstrip()
+        if partial and self._pending is None and partial[0] not in "{[":
+            records.append(self._buffer)
+            self._buffer = ""
+            self._passing = True
+        return records
+
+    def close(self) -> list:
+        """上游结束时处理剩余的缓冲内容"""
+        self._passing = False
+        records = []
+        if self._buffer:
+            line, self._buffer = self._buffer, ""
+            self._frame(line, records, final=True)
+        if self._pending is not None:
+            # 未能闭合的多行文档按原文输出
+            self._flush_pending(records)
+        return records
+
+    def _flush_pending(self, records: list):
+        records.append("".join(self._pending))
+        self._pending = None
+
+    def _frame(self, line: str, records: list, final: bool = False):
+        newline = "" if final else "\n"
+
+        if self._pending is not None:
+            self._pending.append(line + newline)
+            stripped = line.strip()
+            if len(self._pending) == 2 and self._pending[0].rstrip() == "{" and stripped and stripped[0] not in "\"}":
+                # 格式化的 JSON 对象第二行只能是键或闭合括号，否则是以 { 独占一行的普通文本（如 Allman 风格代码）
+                self._flush_pending(records)
+                return
+            # 多行文档只在行首出现闭合括号时尝试解码，解码失败说明不是 JSON，按原文输出
+            if line[:1] in ("}", "]"):
+                record = _decode("".join(self._pending))
+                if record is _INVALID:
+                    self._flush_pending(records)
+                else:
+                    records.append(record)
+                    self._pending = None
+                return
+            if len(self._pending) > self.max_pending_lines:
+                self._flush_pending(records)
+            return
+
+        stripped = line.strip()
+        if not stripped:
+            if line or newline:
+                records.append(line + newline)
+            return
+        if line.rstrip() in ("{", "["):
+            # 只有独占一行、位于行首的左括号才开始缓冲多行文档
+            self._pending = [line + newline]
+            return
+        if stripped[0] in "{[" and stripped[-1] in "}]":
+            record = _decode(stripped)
+            records.append(line + newline if record is _INVALID else record)
+            return
+        records.append(line + newline)
+
+
+async def aiter_records(texts: AsyncIterable[str]) -> AsyncGenerator:
+    """把上游文本分片流转换为 NDJSON 记录流"""
+    framer = NdjsonFramer()
+    async for text in texts:
+        for record in framer.feed(text):
+            yield record
+    for record in framer.close():
+        yield record
+
+
+def _decode(text: str):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return _INVALID
@@ -0,0 +1,71 @@
+import threading
+
+
+def cached_prompt_tokens(usage) -> tuple:
+    """
+    从响应的 usage 中取出 (命中缓存的 prompt token 数, 未命中的 prompt token 数)。
+
+    DeepSeek 返回 prompt_cache_hit_tokens / prompt_cache_miss_tokens；
+    其他 OpenAI 兼容服务返回 prompt_tokens_details.cached_tokens。
+    """
+    if usage is None:
+        return 0, 0
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    miss = getattr(usage, "prompt_cache_miss_tokens", None)
+    if hit is not None and miss is not None:
+        return hit, miss
+    details = getattr(usage, "prompt_tokens_details", None)
+    hit = getattr(details, "cached_tokens", None) or 0
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    return hit, max(prompt_tokens - hit, 0)
+
+
+class PrefixCacheStats:
+    """
+    统计上游提示词前缀缓存的命中情况。
+
+    每次调用记录 usage 中的缓存命中/未命中 token 数；流式调用同时记录首 token 延迟，
+    按前缀是否命中（命中 token 占一半以上）分组求平均，估算前缀缓存节省的延迟。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hit_tokens = 0
+        self.miss_tokens = 0
+        self.completion_tokens = 0
+        self._ttft = {True: [0, 0.0], False: [0, 0.0]}  # 是否命中 -> [次数, 首 token 延迟总和]
+
+    def record(self, usage, ttft: float = None):
+        hit, miss = cached_prompt_tokens(usage)
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        with self._lock:
+            self.calls += 1
+            self.hit_tokens += hit
+            self.miss_tokens += miss
+            self.completion_tokens += completion
+            if ttft is not None:
+                group = self._ttft[hit * 2 >= hit + miss and hit > 0]
+                group[0] += 1
+                group[1] += ttft
+
+    def stats(self) -> dict:
+        with self._lock:
+            prompt_tokens = self.hit_tokens + self.miss_tokens
+            hit_calls, hit_ttft = self._ttft[True]
+            miss_calls, miss_ttft = self._ttft[False]
+            avg_hit = hit_ttft / hit_calls if hit_calls else None
+            avg_miss = miss_ttft / miss_calls if miss_calls else None
+            saved = None
+            if avg_hit is not None and avg_miss is not None:
+                saved = max(avg_miss - avg_hit, 0.0) * hit_calls
+            return {
+                "calls": self.calls,
+                "prompt_cache_hit_tokens": self.hit_tokens,
+                "prompt_cache_miss_tokens": self.miss_tokens,
+                "completion_tokens": self.completion_tokens,
+                "hit_ratio": self.hit_tokens / prompt_tokens if prompt_tokens else 0.0,
+                "avg_ttft_prefix_hit": avg_hit,
+                "avg_ttft_prefix_miss": avg_miss,
+                "estimated_saved_seconds": saved,
+            }
@@ -0,0 +1,227 @@
+import re
+
+from Utils.java_outline import outline, tokenize
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken 未安装或编码表不可用时退回估算
+    _encoding = None
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+_IMPORT_RE = re.compile(r"^\s*import\s+[\w.*]+\s*;\s*$", re.MULTILINE)
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+_ACCESSOR_NAME_RE = re.compile(r"(?:get|is|set)[A-Z]")
+_GENERATED_RE = re.compile(r"^[ \t]*@(?:javax\.annotation\.|jakarta\.annotation\.)?Generated\b", re.MULTILINE)
+_EDITOR_FOLD_RE = re.compile(r"^[ \t]*//\s*<editor-fold.*?^[ \t]*//\s*</editor-fold>[ \t]*\n?",
+                             re.MULTILINE | re.DOTALL)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的 token 数。
+
+    安装了 tiktoken 时用 cl100k_base 编码计数；否则按 DeepSeek 文档的经验值估算：
+    1 个中文字符约 0.6 token，1 个英文字符约 0.3 token。
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK_RE.findall(text))
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
+
+
+class BudgetResult:
+    """按预算裁剪后的代码及裁剪报告"""
+
+    def __init__(self, code: str, tokens_before: int, tokens_after: int, trimmed: list, truncated: bool):
+        self.code = code
+        self.tokens_before = tokens_before
+        self.tokens_after = tokens_after
+        self.trimmed = trimmed
+        self.truncated = truncated
+
+    def to_dict(self) -> dict:
+        return {
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "trimmed": self.trimmed,
+            "truncated": self.truncated,
+        }
+
+    def note(self) -> str:
+        """提示模型哪些内容被省略，避免把省略误判为代码问题"""
+        if not self.trimmed:
+            return ""
+        return "（注意：为控制长度，代码中已省略：" + "；".join(self.trimmed) + "）\n"
+
+
+def strip_comments(code: str) -> str:
+    """删除 // 和 /* */ 注释，保留字符串字面量"""
+    out = []
+    i = 0
+    n = len(code)
+    while i < n:
+        c = code[i]
+        if c == "/" and i + 1 < n and code[i + 1] == "/":
+            end = code.find("\n", i)
+            i = n if end < 0 else end
+        elif c == "/" and i + 1 < n and code[i + 1] == "*":
+            end = code.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+        elif c in "\"'":
+            j = i + 1
+            while j < n and code[j] != c and code[j] != "\n":
+                j += 2 if code[j] == "\\" else 1
+            out.append(code[i:j + 1])
+            i = j + 1
+        else:
+            out.append(c)
+            i += 1
+    return "".join(out)
+
+
+def _member_end(code: str, start: int) -> int:
+    """
+    返回从 start（注解名之后）开始的成员声明的结束位置：同一层的第一个 ; 或第一个顶层 {...} 代码块之后，
+    以先出现者为准。字段初始化表达式中的 {...}（数组、匿名类、lambda）不结束声明，字符串和注释中的括号不计。
+    """
+    depth = 0
+    initializer = False
+    for token in tokenize(code[start:]):
+        if token.kind != "op":
+            continue
+        if token.text in "([{":
+            depth += 1
+        elif token.text in ")]}":
+            depth -= 1
+            if depth < 0:
+                return start + token.start  # 到了外层类型的结尾
+            if depth == 0 and token.text == "}" and not initializer:
+                return start + token.end
+        elif depth == 0 and token.text == ";":
+            return start + token.end
+        elif depth == 0 and token.text == "=":
+            initializer = True
+    return len(code)
+
+
+def elide_generated(code: str) -> tuple:
+    """省略 @Generated 成员和 editor-fold 折叠区域，返回 (代码, 省略的区域数)"""
+    code, folds = _EDITOR_FOLD_RE.subn("    // ... 折叠区域已省略\n", code)
+    # 只处理真正的注解，跳过注释和字符串中的 @Generated
+    annotations = {token.start for token in tokenize(code) if token.text == "@"}
+    parts = []
+    position = 0
+    for match in _GENERATED_RE.finditer(code):
+        if match.start() < position or code.index("@", match.start()) not in annotations:
+            continue
+        parts.append(code[position:match.start()] + "    // ... 生成代码已省略")
+        position = _member_end(code, match.end())
+    parts.append(code[position:])
+    return "".join(parts), folds + len(parts) - 1
+
+
+def _is_accessor(code: str, method) -> bool:
+    """名为 get/is/set 开头、方法体最多一条语句的方法"""
+    if method.body_start is None or not _ACCESSOR_NAME_RE.match(method.name):
+        return False
+    body = [token.text for token in tokenize(code[method.body_start + 1:method.end - 1])]
+    return "{" not in body and "}" not in body and body.count(";") <= 1
+
+
+def elide_accessors(code: str) -> tuple:
+    """把简单的 getter/setter 替换为说明，每个类型一条，返回 (代码, 省略的方法名列表)"""
+    # 方法 -> 所属类型第一个被省略的方法处要放的说明
+    summaries = {}
+    accessors = []
+    for java_type in outline(code).iter_types():
+        elided = [method for method in java_type.methods if _is_accessor(code, method)]
+        if elided:
+            summaries[elided[0].start] = "省略 getter/setter: " + ", ".join(method.name for method in elided)
+            accessors.extend(elided)
+    accessors.sort(key=lambda method: method.start)
+    names = [method.name for method in accessors]
+    parts = []
+    position = 0
+    for method in accessors:
+        summary = summaries.get(method.start)
+        start = code.rfind("\n", 0, method.start) + 1
+        end = method.end
+        if code[start:method.start].strip():
+            # 与其他代码同一行，只替换方法本身
+            start = method.start
+            replacement = f"/* ... {summary} */" if summary else ""
+        else:
+            # 方法独占的行整行删除
+            while end < len(code) and code[end] in " \t":
+                end += 1
+            if code.startswith("\n", end):
+                end += 1
+            indent = code[start:method.start]
+            replacement = f"{indent}// ... {summary}\n" if summary else ""
+        parts.append(code[position:start])
+        parts.append(replacement)
+        position = end
+    parts.append(code[position:])
+    return "".join(parts), names
+
+
+def split_top_level_types(code: str) -> tuple:
+    """
+    按顶层类型拆分 Java 源码，返回 (文件头, [(类型名, 源码)])。
+
+    文件头是 package 和 import 语句；每个类型的源码包含它前面的注释和注解。
+    """
+    types = outline(code).types
+    if not types:
+        return code.strip(), []
+    header = code[:types[0].doc_start].strip()
+    return header, [(java_type.name, code[java_type.doc_start:java_type.end].strip("\n")) for java_type in types]
+
+
+def fit_java_to_budget(code: str, max_tokens: int) -> BudgetResult:
+    """
+    把 Java 代码裁剪到输入 token 预算以内。
+
+    按价值从低到高逐步裁剪，每一步之后重新估算，一旦满足预算就停止：
+    空行和 import → 注释 → 生成代码 → getter/setter → 按行截断。
+    未超预算的代码原样返回，行号与原文一致。
+    """
+    tokens_before = estimate_tokens(code)
+    trimmed = []
+    if tokens_before <= max_tokens:
+        return BudgetResult(code, tokens_before, tokens_before, trimmed, False)
+
+    code, imports = _IMPORT_RE.subn("", code)
+    code = _BLANK_LINES_RE.sub("\n", code)
+    trimmed.append(f"空行及 {imports} 条 import 语句" if imports else "空行")
+    tokens = estimate_tokens(code)
+
+    if tokens > max_tokens:
+        code = _BLANK_LINES_RE.sub("\n", strip_comments(code))
+        trimmed.append("注释")
+        tokens = estimate_tokens(code)
+
+    if tokens > max_tokens:
+        code, generated = elide_generated(code)
+        if generated:
+            trimmed.append(f"{generated} 处生成代码")
+            tokens = estimate_tokens(code)
+
+    if tokens > max_tokens:
+        code, accessors = elide_accessors(code)
+        if accessors:
+            trimmed.append(f"{len(accessors)} 个 getter/setter")
+            tokens = estimate_tokens(code)
+
+    truncated = False
+    if tokens > max_tokens:
+        # 仍然超出预算时按比例截断到整行
+        keep = int(len(code) * max_tokens / tokens)
+        cut = code.rfind("\n", 0, keep)
+        code = code[:cut if cut > 0 else keep] + "\n// ... 以下代码超出长度限制，已截断\n"
+        trimmed.append("超出预算的末尾代码")
+        truncated = True
+        tokens = estimate_tokens(code)
+
+    return BudgetResult(code, tokens_before, tokens, trimmed, truncated)
@@ -0,0 +1,64 @@
+import tempfile
+
+
+class ResponseAccumulator:
+    """
+    流式响应的累积缓冲区。
+
+    用分片列表代替字符串 +=，避免长回答的反复拷贝；累计超过 max_memory_chars 后
+    转存到临时文件，每个连接占用的内存有上限。流结束时用 finish() 取出完整内容交给持久化。
+    """
+
+    def __init__(self, max_memory_chars: int = 64 * 1024):
+        self.max_memory_chars = max_memory_chars
+        self._chunks = []
+        self._memory_chars = 0
+        self._length = 0
+        self._file = None
+
+    def append(self, text: str):
+        if not text:
+            return
+        self._length += len(text)
+        if self._file is not None:
+            self._file.write(text)
+            return
+        self._chunks.append(text)
+        self._memory_chars += len(text)
+        if self._memory_chars > self.max_memory_chars:
+            self._spill()
+
+    def _spill(self):
+        self._file = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+        self._file.write("".join(self._chunks))
+        self._chunks = []
+        self._memory_chars = 0
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def getvalue(self) -> str:
+        if self._file is None:
+            return "".join(self._chunks)
+        self._file.flush()
+        self._file.seek(0)
+        value = self._file.read()
+        self._file.seek(0, 2)
+        return value
+
+    def finish(self) -> str:
+        """返回完整内容并释放缓冲区（包括临时文件）"""
+        value = self.getvalue()
+        self.close()
+        return value
+
+    def close(self):
+        self._chunks = []
+        self._memory_chars = 0
+        if self._file is not None:
+            self._file.close()
+            self._file = None
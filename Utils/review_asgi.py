@@ -0,0 +1,325 @@
+"""
+评审服务（AI_agent.py / AI_reviewer.py）的异步 ASGI 运行模式。
+
+Flask 开发服务器每个进行中的评审占用一个线程；这里用 AsyncOpenAI 在事件循环上并发处理大量流式评审，
+/review、/review/batch、/status、/metrics 的请求和返回内容与 Flask 模式逐字节一致，dialog.py 的转发逻辑无需改动。
+
+    python -m Utils.review_asgi AI_agent --port 8002 --workers 4
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+
+from Utils.metrics import CONTENT_TYPE, REGISTRY
+from Utils.review_batch import (ZIP_MIMETYPES, BatchError, aiter_batch, check_batch, concurrency_limit,
+                                files_from_json, files_from_upload, files_from_zip)
+from Utils.review_cache import cache_key
+from Utils.tracing import Span, set_current_span, start_span, traced_stream
+
+SERVICES = ("AI_agent", "AI_reviewer")
+
+try:
+    from openai import AsyncOpenAI
+except ImportError:
+    AsyncOpenAI = None
+
+
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
+
+
+def create_app(service) -> FastAPI:
+    """
+    用评审服务模块的提示词、缓存、指标和 NDJSON 记录函数构建 ASGI 应用。
+
+    service 为已导入的 AI_agent 或 AI_reviewer 模块；JSON 响应沿用该模块 Flask 应用的
+    ensure_ascii / sort_keys 设置和紧凑格式（与关闭 debug 的 Flask 输出相同）。
+    """
+    client = None
+    if AsyncOpenAI is not None and service.openai_client is not None:
+        # 复用同步客户端已解密的密钥
+        client = AsyncOpenAI(base_url=service.BASE_URL, api_key=service.openai_client.api_key)
+    model_name = service.MODEL_NAME
+    logger = service.logger
+    app = FastAPI()
+
+    def jsonify(payload: dict, status_code: int = 200) -> Response:
+        body = json.dumps(payload, ensure_ascii=service.app.json.ensure_ascii,
+                          sort_keys=service.app.json.sort_keys, separators=(",", ":"))
+        return Response(body + "\n", status_code=status_code, media_type="application/json")
+
+    @app.middleware("http")
+    async def trace_request(request: Request, call_next):
+        start_time = time.time()
+        span = start_span("review.request", request.headers.get("traceparent"), path=request.url.path)
+        request.state.span = span
+        # 放到线程中执行的 build_messages 通过上下文取得当前 span
+        set_current_span(span)
+        try:
+            response = await call_next(request)
+        except Exception as e:
+            span.end(error=str(e))
+            raise
+        route = request.scope.get("route")
+        service.http_request_latency.observe(time.time() - start_time, method=request.method,
+                                             path=route.path if route else "unmatched",
+                                             status=response.status_code)
+        span.set_attribute("http.status_code", response.status_code)
+        # 流式响应在发送完毕时才结束 span
+        response.body_iterator = traced_stream(response.body_iterator, span)
+        return response
+
+    async def build_messages(java_code: str, span: Span) -> tuple:
+        """服务提供 abuild_messages（如分块评审）时在事件循环上构造消息，否则放到线程中执行"""
+        if hasattr(service, "abuild_messages"):
+            return await service.abuild_messages(java_code, client, span)
+        # 裁剪超长代码需要分词，放到线程中避免阻塞事件循环
+        return await asyncio.to_thread(service.build_messages, java_code)
+
+    async def review_once(java_code: str, span: Span) -> tuple:
+        """非流式评审一段代码，返回 (评审结果, 是否命中缓存, 输入预算)"""
+        key = cache_key(java_code, service.PROMPT_VERSION, model_name)
+        cached = service.review_cache.get(key)
+        if cached is not None:
+            span.add_event("review_cache_hit")
+            return cached, True, None
+
+        if client is None:
+            raise RuntimeError("服务未正确初始化，请检查openai库安装和API配置")
+        messages, budget = await build_messages(java_code, span)
+        with span.child("llm.completion", model=model_name):
+            response = await client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                temperature=0.2,
+                max_tokens=2500,
+                stream=False
+            )
+        service.llm_calls.inc(model=model_name, status=200)
+        service.prefix_stats.record(response.usage)
+
+        review_result = response.choices[0].message.content.strip()
+        service.review_cache.set(key, review_result)
+        return review_result, False, budget
+
+    async def sync_review(java_code: str, start_time: float, span: Span) -> Response:
+        review_result, cached, budget = await review_once(java_code, span)
+        if cached:
+            return jsonify({
+                "status": "success",
+                "model": model_name,
+                "review_result": review_result,
+                "cached": True,
+                "execution_time": time.time() - start_time
+            })
+        return jsonify({
+            "status": "success",
+            "model": model_name,
+            "review_result": review_result,
+            "budget": budget.to_dict(),
+            "execution_time": time.time() - start_time
+        })
+
+    async def stream_review(java_code: str, start_time: float, span: Span) -> StreamingResponse:
+        key = cache_key(java_code, service.PROMPT_VERSION, model_name)
+        cached = service.review_cache.get(key)
+        if cached is not None:
+            span.add_event("review_cache_hit")
+            replay = _aiter(service.replay_cached_review(cached, start_time))
+            return StreamingResponse(service.stream_metrics.wrap(replay, "review_cached"),
+                                     media_type="text/event-stream")
+
+        messages, budget = await build_messages(java_code, span)
+        request_time = time.time()
+        llm_span = span.child("llm.stream", model=model_name)
+        try:
+            response_stream = await client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                temperature=0.2,
+                max_tokens=2500,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+        except Exception as e:
+            llm_span.end(error=str(e))
+            raise
+        service.llm_calls.inc(model=model_name, status=200)
+
+        async def generate():
+            review_content = []
+            yield service.stream_started_record(budget=budget.to_dict())
+            try:
+                ttft = None
+                async for chunk in response_stream:
+                    if chunk.usage:
+                        service.prefix_stats.record(chunk.usage, ttft)
+                    if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                        if ttft is None:
+                            ttft = time.time() - request_time
+                            llm_span.add_event("first_token")
+                        content_chunk = chunk.choices[0].delta.content
+                        review_content.append(content_chunk)
+                        yield service.chunk_record(content_chunk)
+            except Exception as e:
+                service.llm_calls.inc(model=model_name, status="stream_error")
+                llm_span.end(error=str(e))
+                logger.error(f"流处理中断: {str(e)}")
+                yield service.stream_error_record(e)
+                return
+            finally:
+                llm_span.end()
+                # 客户端中途断开时及时释放到大模型的连接
+                await response_stream.close()
+
+            full_response = ''.join(review_content)
+            service.review_cache.set(key, full_response)
+            yield service.completed_record(full_response, time.time() - start_time)
+
+        return StreamingResponse(service.stream_metrics.wrap(generate(), "review"), media_type="text/event-stream")
+
+    @app.post("/review")
+    async def review_java_code(request: Request):
+        """Java代码评审API端点"""
+        start_time = time.time()
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or 'code' not in data:
+            return jsonify({
+                "status": "error",
+                "message": "缺少 'code' 参数",
+                "execution_time": time.time() - start_time
+            }, 400)
+
+        java_code = data['code']
+        stream = data.get('stream', False)
+
+        # 模拟模式（当openai库不可用时）
+        if client is None:
+            return jsonify({
+                "status": "simulation",
+                "review_result": f"# Java代码评审模拟报告\n\n**代码摘要:**\n{java_code[:200]}...\n\n"
+                                 f"**备注:** 服务未正确初始化，请检查openai库安装和API配置",
+                "execution_time": time.time() - start_time
+            })
+
+        try:
+            if stream:
+                return await stream_review(java_code, start_time, request.state.span)
+            return await sync_review(java_code, start_time, request.state.span)
+        except Exception as e:
+            service.llm_calls.inc(model=model_name, status=getattr(e, "status_code", "error"))
+            logger.error(f"代码评审失败: {str(e)}", exc_info=True)
+            return jsonify({
+                "status": "error",
+                "error": f"处理失败: {str(e)}",
+                "execution_time": time.time() - start_time
+            }, 500)
+
+    @app.post("/review/batch")
+    async def review_batch(request: Request):
+        """批量评审：接收 JSON 数组、multipart 上传或 zip 包，按完成顺序以 NDJSON 流式返回每个文件的结果和最终汇总"""
+        start_time = time.time()
+        try:
+            files = check_batch(await read_batch_files(request))
+            concurrency = concurrency_limit(request.query_params.get("concurrency"))
+        except BatchError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e),
+                "execution_time": time.time() - start_time
+            }, 400)
+        span = request.state.span
+
+        async def review_one(name: str, code: str) -> tuple:
+            with span.child("review.file", file=name) as file_span:
+                try:
+                    review_result, cached, _ = await review_once(code, file_span)
+                except Exception as e:
+                    service.llm_calls.inc(model=model_name, status=getattr(e, "status_code", "error"))
+                    logger.error(f"批量评审 {name} 失败: {str(e)}")
+                    raise
+            return review_result, cached
+
+        async def records():
+            async for record in aiter_batch(files, review_one, concurrency):
+                yield service.ndjson_line(record)
+
+        return StreamingResponse(service.stream_metrics.wrap(records(), "review_batch"), media_type="text/event-stream")
+
+    @app.get("/status")
+    async def service_status():
+        """服务健康检查端点"""
+        return jsonify(service.status_report(client))
+
+    @app.get("/metrics")
+    async def metrics():
+        """Prometheus 指标导出端点"""
+        return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+    @app.get("/", response_class=HTMLResponse)
+    async def index():
+        """服务首页"""
+        return service.index()
+
+    return app
+
+
+async def read_batch_files(request: Request) -> list:
+    """从 multipart 上传、zip 请求体或 JSON 请求体中取出 [(文件名, 代码)]"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == "multipart/form-data":
+        try:
+            form = await request.form()
+        except AssertionError as e:
+            # starlette 解析 multipart 依赖 python-multipart
+            raise BatchError(f"无法解析 multipart 请求: {e}") from e
+        files = []
+        for field, upload in form.multi_items():
+            if hasattr(upload, "read"):
+                files.extend(files_from_upload(upload.filename or field, await upload.read()))
+        return files
+    if content_type in ZIP_MIMETYPES:
+        return files_from_zip(await request.body())
+    try:
+        data = await request.json()
+    except ValueError as e:
+        raise BatchError("请求体应为 JSON、multipart 或 zip") from e
+    return files_from_json(data)
+
+
+def app_from_env() -> FastAPI:
+    """供 uvicorn --factory 使用：按 REVIEW_SERVICE 环境变量导入评审服务并构建应用，每个 worker 进程各调用一次"""
+    name = os.getenv("REVIEW_SERVICE", "AI_agent")
+    if name not in SERVICES:
+        raise ValueError(f"REVIEW_SERVICE must be one of {', '.join(SERVICES)}")
+    return create_app(importlib.import_module(name))
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="以 ASGI 模式启动评审服务")
+    parser.add_argument("service", choices=SERVICES)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8002)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 1)),
+                        help="worker 进程数，每个进程在事件循环上并发处理多个评审")
+    args = parser.parse_args()
+
+    os.environ["REVIEW_SERVICE"] = args.service
+    uvicorn.run("Utils.review_asgi:app_from_env", factory=True, host=args.host, port=args.port,
+                workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
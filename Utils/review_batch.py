@@ -0,0 +1,303 @@
+"""
+批量评审：一次提交多个 Java 文件（JSON 数组、multipart 上传或 zip 包），按并发上限同时评审，
+每个文件评审完立即输出一条 NDJSON 记录，最后输出汇总。Flask 模式用线程池，ASGI 模式用 asyncio。
+
+并发上限按大模型调用计：批次中的每个文件占用一个名额，文件内部再并发的调用（如分块评审）
+通过 fan_out / afan_out 只借用空闲名额，整个批次同时进行的上游调用不超过上限。
+"""
+import asyncio
+import contextvars
+import io
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+MAX_BATCH_FILES = int(os.getenv("REVIEW_BATCH_MAX_FILES", 500))
+MAX_FILE_BYTES = int(os.getenv("REVIEW_BATCH_MAX_FILE_BYTES", 1024 * 1024))
+# 一个批次解压后的代码总量上限
+MAX_BATCH_BYTES = int(os.getenv("REVIEW_BATCH_MAX_BYTES", 32 * 1024 * 1024))
+BATCH_CONCURRENCY = int(os.getenv("REVIEW_BATCH_CONCURRENCY", 4))
+ZIP_MIMETYPES = ("application/zip", "application/x-zip-compressed", "application/octet-stream")
+
+
+# 当前批次的调用名额（Flask 模式为 threading.BoundedSemaphore，ASGI 模式为 asyncio.Semaphore），批次之外为 None
+_call_slots = contextvars.ContextVar("review_call_slots", default=None)
+
+
+class BatchError(ValueError):
+    """批量评审请求的内容无法解析或超出限制"""
+
+
+def _decode(name: str, data: bytes) -> str:
+    if len(data) > MAX_FILE_BYTES:
+        raise BatchError(f"{name} 超过 {MAX_FILE_BYTES} 字节")
+    return data.decode("utf-8", errors="replace")
+
+
+def files_from_json(data) -> list:
+    """
+    解析 JSON 请求体：{"files": [...]} 或直接是数组；数组元素为 {"name": ..., "code": ...} 或代码字符串。
+    返回 [(文件名, 代码)]。
+    """
+    items = data.get("files") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise BatchError("请求体应为文件数组或包含 'files' 数组的对象")
+    files = []
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            files.append((f"file{index + 1}.java", item))
+        elif isinstance(item, dict) and isinstance(item.get("code"), str):
+            files.append((str(item.get("name") or f"file{index + 1}.java"), item["code"]))
+        else:
+            raise BatchError(f"第 {index + 1} 个文件缺少 'code'")
+    return files
+
+
+def files_from_zip(data: bytes) -> list:
+    """
+    取出 zip 包中的所有 .java 文件，文件名保留包内路径。
+
+    先按目录中声明的解压后大小检查文件数、单个文件和总量的上限，超出时在解压任何内容之前拒绝，
+    避免高压缩比的 zip 包（解压炸弹）耗尽内存。
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile as e:
+        raise BatchError(f"无法解析 zip 文件: {e}") from e
+    with archive:
+        entries = []
+        total = 0
+        for info in archive.infolist():
+            if info.is_dir() or not info.filename.endswith(".java") or info.filename.startswith("__MACOSX/"):
+                continue
+            if len(entries) >= MAX_BATCH_FILES:
+                raise BatchError(f"单次最多评审 {MAX_BATCH_FILES} 个文件，zip 包中的 Java 文件超过此数量")
+            if info.file_size > MAX_FILE_BYTES:
+                raise BatchError(f"{info.filename} 超过 {MAX_FILE_BYTES} 字节")
+            total += info.file_size
+            if total > MAX_BATCH_BYTES:
+                raise BatchError(f"zip 包中的 Java 文件解压后超过 {MAX_BATCH_BYTES} 字节")
+            entries.append(info)
+        # 实际解压时也限制读取长度，声明的大小与内容不符时不会读入超量数据
+        return [(info.filename, _decode(info.filename, _read_entry(archive, info))) for info in entries]
+
+
+def _read_entry(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytes:
+    try:
+        with archive.open(info) as f:
+            return f.read(MAX_FILE_BYTES + 1)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError) as e:
+        raise BatchError(f"无法解压 {info.filename}: {e}") from e
+
+
+def files_from_upload(name: str, data: bytes) -> list:
+    """multipart 中的单个上传文件：zip 包展开，其余按 Java 源文件处理"""
+    if name.endswith(".zip") or data[:4] == b"PK\x03\x04":
+        return files_from_zip(data)
+    return [(name, _decode(name, data))]
+
+
+def check_batch(files: list) -> list:
+    if not files:
+        raise BatchError("没有找到需要评审的 Java 文件")
+    if len(files) > MAX_BATCH_FILES:
+        raise BatchError(f"单次最多评审 {MAX_BATCH_FILES} 个文件，收到 {len(files)} 个")
+    if sum(len(code) for _, code in files) > MAX_BATCH_BYTES:
+        raise BatchError(f"单次评审的代码总量超过 {MAX_BATCH_BYTES} 个字符")
+    return files
+
+
+def concurrency_limit(requested) -> int:
+    """请求可以指定更小的并发数，上限为 REVIEW_BATCH_CONCURRENCY"""
+    try:
+        value = int(requested) if requested is not None else BATCH_CONCURRENCY
+    except (TypeError, ValueError):
+        raise BatchError("concurrency 必须是整数")
+    return max(1, min(value, BATCH_CONCURRENCY))
+
+
+def _group(files: list) -> dict:
+    """同一批次中内容相同的文件只评审一次：代码 -> 文件序号列表"""
+    groups = {}
+    for index, (_, code) in enumerate(files):
+        groups.setdefault(code, []).append(index)
+    return groups
+
+
+class BatchSummary:
+    def __init__(self, files: list, concurrency: int):
+        self.files = files
+        self.concurrency = concurrency
+        self.start_time = time.time()
+        self.succeeded = 0
+        self.failed = 0
+        self.cached = 0
+
+    def started(self) -> dict:
+        return {"status": "batch_started", "total": len(self.files), "concurrency": self.concurrency}
+
+    def file_records(self, indices: list, result, error: Exception, started_at: float) -> list:
+        records = []
+        for index in indices:
+            record = {"index": index, "name": self.files[index][0], "execution_time": time.time() - started_at}
+            if error is not None:
+                self.failed += 1
+                record.update(status="file_error", error=f"评审失败: {error}")
+            else:
+                review_result, cached = result
+                self.succeeded += 1
+                self.cached += bool(cached)
+                record.update(status="file_completed", review_result=review_result, cached=cached)
+            records.append(record)
+        return records
+
+    def completed(self) -> dict:
+        return {
+            "status": "batch_completed",
+            "total": len(self.files),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cached": self.cached,
+            "execution_time": time.time() - self.start_time,
+        }
+
+
+def iter_batch(files: list, review_one, concurrency: int):
+    """
+    在线程池中评审 files，按完成顺序产出记录字典：batch_started、每个文件一条、最后 batch_completed。
+
+    review_one(name, code) 返回 (评审结果, 是否命中缓存)，抛出的异常记为该文件失败。
+    """
+    summary = BatchSummary(files, concurrency)
+    yield summary.started()
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def run(name: str, code: str):
+        with slots:
+            token = _call_slots.set(slots)
+            try:
+                return review_one(name, code)
+            finally:
+                _call_slots.reset(token)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="review-batch")
+    try:
+        futures = {}
+        for code, indices in _group(files).items():
+            future = executor.submit(run, files[indices[0]][0], code)
+            futures[future] = (indices, time.time())
+        for future in as_completed(futures):
+            indices, started_at = futures[future]
+            error = future.exception()
+            for record in summary.file_records(indices, None if error else future.result(), error, started_at):
+                yield record
+    finally:
+        # 客户端中途断开时不再开始排队中的评审
+        executor.shutdown(wait=False, cancel_futures=True)
+    yield summary.completed()
+
+
+async def aiter_batch(files: list, review_one, concurrency: int):
+    """iter_batch 的 asyncio 版本，review_one 为协程函数，并发数由信号量限制"""
+    summary = BatchSummary(files, concurrency)
+    yield summary.started()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(indices: list, code: str):
+        started_at = time.time()
+        async with semaphore:
+            # 每个 run 是独立的任务，设置的名额只在本任务的上下文中可见
+            _call_slots.set(semaphore)
+            try:
+                return indices, await review_one(files[indices[0]][0], code), None, started_at
+            except Exception as e:
+                return indices, None, e, started_at
+
+    tasks = [asyncio.create_task(run(indices, code)) for code, indices in _group(files).items()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            indices, result, error, started_at = await next_done
+            for record in summary.file_records(indices, result, error, started_at):
+                yield record
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield summary.completed()
+
+
+def _fan_out_width(items: list, limit: int) -> int:
+    return max(min(limit, len(items)) - 1, 0)
+
+
+def fan_out(items: list, fn, limit: int) -> list:
+    """
+    对 items 逐个调用 fn，按顺序返回结果，最多 limit 个同时进行（调用方线程也参与）。
+
+    在批量评审的文件中调用时，调用方已占用一个名额，额外的线程只借用批次中空闲的名额，不等待；
+    没有空闲名额时在调用方线程中依次执行。任一调用出错时不再开始新的调用，并抛出该异常。
+    """
+    slots = _call_slots.get()
+    results = [None] * len(items)
+    indices = iter(range(len(items)))
+    lock = threading.Lock()
+    failed = threading.Event()
+
+    def worker():
+        while not failed.is_set():
+            with lock:
+                index = next(indices, None)
+            if index is None:
+                return
+            try:
+                results[index] = fn(items[index])
+            except BaseException:
+                failed.set()
+                raise
+
+    borrowed = 0
+    while borrowed < _fan_out_width(items, limit) and (slots is None or slots.acquire(blocking=False)):
+        borrowed += 1
+    if not borrowed:
+        worker()
+        return results
+    try:
+        with ThreadPoolExecutor(max_workers=borrowed, thread_name_prefix="review-fan-out") as executor:
+            futures = [executor.submit(worker) for _ in range(borrowed)]
+            worker()
+            for future in futures:
+                future.result()
+    finally:
+        if slots is not None:
+            for _ in range(borrowed):
+                slots.release()
+    return results
+
+
+async def afan_out(items: list, fn, limit: int) -> list:
+    """fan_out 的 asyncio 版本，fn 为协程函数，借用的是批次的 asyncio.Semaphore 名额"""
+    slots = _call_slots.get()
+    results = [None] * len(items)
+    indices = iter(range(len(items)))
+
+    async def worker():
+        for index in indices:
+            results[index] = await fn(items[index])
+
+    borrowed = 0
+    while borrowed < _fan_out_width(items, limit) and (slots is None or not slots.locked()):
+        if slots is not None:
+            await slots.acquire()  # 未上锁时立即返回
+        borrowed += 1
+    tasks = [asyncio.ensure_future(worker()) for _ in range(borrowed + 1)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if slots is not None:
+            for _ in range(borrowed):
+                slots.release()
+    return results
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_SPACE_RE = re.compile(r"\s+")
+_PUNCT_SPACE_RE = re.compile(r" ?([^\w ]) ?")
+
+
+def normalize_java(code: str) -> str:
+    """
+    去掉注释并规整空白，得到用于计算缓存键的 Java 代码。
+
+    字符串和字符字面量原样保留；只有格式或注释不同的两份代码得到相同结果。
+    """
+    parts = []
+    segment = []
+    i = 0
+    n = len(code)
+    while i < n:
+        c = code[i]
+        if c == "/" and i + 1 < n and code[i + 1] == "/":
+            end = code.find("\n", i)
+            i = n if end < 0 else end
+            segment.append(" ")
+        elif c == "/" and i + 1 < n and code[i + 1] == "*":
+            end = code.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+            segment.append(" ")
+        elif c in "\"'":
+            # 字面量之前的代码段先规整空白
+            parts.append(_squash("".join(segment)))
+            segment = []
+            j = i + 1
+            while j < n and code[j] != c and code[j] != "\n":
+                j += 2 if code[j] == "\\" else 1
+            parts.append(code[i:j + 1])
+            i = j + 1
+        else:
+            segment.append(c)
+            i += 1
+    parts.append(_squash("".join(segment)))
+    return "".join(parts).strip()
+
+
+def _squash(segment: str) -> str:
+    return _PUNCT_SPACE_RE.sub(r"\1", _SPACE_RE.sub(" ", segment))
+
+
+def cache_key(code: str, prompt_version: str, model: str, extra: str = "") -> str:
+    """由规整后的代码、提示词版本和模型名计算缓存键"""
+    digest = hashlib.sha256()
+    for part in (prompt_version, model, extra, normalize_java(code)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def iter_chunks(text: str, size: int = 64):
+    """把缓存的完整结果切成小块，按流式接口重放"""
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+class ReviewCache:
+    """
+    代码评审/测试生成结果缓存，支持 TTL 过期和 LRU 淘汰。
+
+    内存中最多保留 max_entries 条；指定 disk_dir 时同时写入磁盘，
+    进程重启或内存淘汰后仍能命中。线程安全，可在 Flask 的多线程模式下使用。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 7 * 24 * 3600, disk_dir: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value):
+        expires_at = time.time() + self.ttl
+        self._memory_set(key, expires_at, value)
+        self._disk_set(key, expires_at, value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def _memory_set(self, key: str, expires_at: float, value):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + ".json")
+
+    def _disk_get(self, key: str, now: float):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires_at"] <= now:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            return None
+        # 磁盘命中后提升到内存
+        self._memory_set(key, entry["expires_at"], entry["value"])
+        return entry["value"]
+
+    def _disk_set(self, key: str, expires_at: float, value):
+        if not self.disk_dir:
+            return
+        tmp_path = self._path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            pass
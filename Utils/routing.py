@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from Utils.http_pool import UpstreamConfig
+from Utils.stream_shaper import ShapingConfig
+from Utils.upstream_health import TUNNEL_ERROR_STATUSES
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = ("llm", "ndjson", "testgen")
+FORMATS = ("remote", "review")
+
+
+class RouteConfigError(Exception):
+    """路由配置文件格式错误"""
+
+
+# 数值字段 -> (是否必须为整数, 最小值)
+NUMERIC_FIELDS = {
+    "timeout": (False, 0),
+    "connect_timeout": (False, 0),
+    "pool_size": (True, 1),
+    "max_concurrent": (True, 1),
+    "max_queue": (True, 0),
+    "max_queued_per_user": (True, 1),
+    "expected_service_time": (False, 0),
+    "slow_call_seconds": (False, 0),
+    "hedge_after": (False, 0),
+}
+SHAPING_FIELDS = {
+    "max_chars": (True, 1),
+    "max_delay": (False, 0),
+}
+
+
+def _check_numbers(mode: str, options: dict, fields: dict, prefix: str = ""):
+    """检查配置中的数值字段类型和范围；JSON 中的 "60" 或 true 不会被当作数字"""
+    for name, (integer, minimum) in fields.items():
+        value = options.get(name)
+        if value is None:
+            continue
+        allowed = int if integer else (int, float)
+        if isinstance(value, bool) or not isinstance(value, allowed):
+            kind = "an integer" if integer else "a number"
+            raise RouteConfigError(f"mode {mode}: {prefix}{name} must be {kind}, got {value!r}")
+        if value < minimum:
+            raise RouteConfigError(f"mode {mode}: {prefix}{name} must be >= {minimum}, got {value!r}")
+
+
+class Route:
+    """
+    一个对话模式的路由：由哪类处理器处理、转发到哪些地址以及对应的连接池、超时、并发和缓存参数。
+    single_flight 为真时，同一时刻内容相同的请求合并为一次上游调用。
+
+    extra_params 会合并到转发给远程智能体的请求体中（如评审服务的 {"stream": true}）。
+
+    urls 的第一个地址是主地址，第二个（可选）是对冲/故障切换用的备用地址。首个分片超过 hedge_after 秒
+    未到达时向备用地址发对冲请求，未指定时取 expected_service_time：非流式上游要等完整结果才有首个分片，
+    固定的几秒会让每个请求都触发对冲；流式上游应显式指定较短的值。
+    设置了 url_env 时，同名环境变量覆盖主地址，<url_env>_STANDBY 覆盖备用地址。
+    failure_statuses 为熔断器计为失败的非 5xx 状态码，默认是隧道断开时的 404。
+    """
+
+    def __init__(self, mode: str, handler: str, urls: list = None, url_env: str = None,
+                 payload_name: str = "question", format: str = "remote",
+                 timeout: float = 60.0, connect_timeout: float = 10.0, pool_size: int = 100,
+                 max_concurrent: int = 16, max_queue: int = 64, max_queued_per_user: int = 4,
+                 expected_service_time: float = 10.0, slow_call_seconds: float = 20.0, hedge_after: float = None,
+                 failure_statuses: list = None, cache: dict = None, shaping: dict = None,
+                 single_flight: bool = True, extra_params: dict = None):
+        if handler not in HANDLERS:
+            raise RouteConfigError(f"mode {mode}: unknown handler {handler!r}")
+        if format not in FORMATS:
+            raise RouteConfigError(f"mode {mode}: unknown format {format!r}")
+        urls = list(urls or [])
+        if url_env:
+            if os.getenv(url_env):
+                urls[:1] = [os.environ[url_env]]
+            if os.getenv(f"{url_env}_STANDBY"):
+                urls[1:2] = [os.environ[f"{url_env}_STANDBY"]]
+        if failure_statuses is None:
+            failure_statuses = TUNNEL_ERROR_STATUSES
+        if not all(isinstance(status, int) and 100 <= status <= 599 for status in failure_statuses):
+            raise RouteConfigError(f"mode {mode}: failure_statuses must be HTTP status codes")
+        if handler != "llm" and not urls:
+            raise RouteConfigError(f"mode {mode}: handler {handler!r} needs at least one url")
+        self.mode = mode
+        self.handler = handler
+        self.urls = urls
+        self.payload_name = payload_name
+        self.format = format
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.pool_size = pool_size
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.expected_service_time = expected_service_time
+        self.slow_call_seconds = slow_call_seconds
+        self.hedge_after = hedge_after if hedge_after is not None else expected_service_time
+        self.failure_statuses = tuple(failure_statuses)
+        self.cache = cache or {}
+        self.shaping = ShapingConfig(**(shaping or {}))
+        self.single_flight = single_flight
+        self.extra_params = extra_params or {}
+
+    @property
+    def url(self) -> str:
+        return self.urls[0] if self.urls else None
+
+    @property
+    def standby_url(self) -> str:
+        return self.urls[1] if len(self.urls) > 1 else None
+
+    @property
+    def admission_name(self) -> str:
+        return f"mode{self.mode}"
+
+    @property
+    def pool_name(self) -> str:
+        """连接池按路由区分，多个模式转发到同一主机时各自的超时和连接数上限互不覆盖"""
+        return f"mode{self.mode}"
+
+    def cache_enabled(self) -> bool:
+        return bool(self.cache) and self.cache.get("enabled", True)
+
+    def upstream_config(self) -> UpstreamConfig:
+        return UpstreamConfig(timeout=self.timeout, connect_timeout=self.connect_timeout,
+                              max_connections=self.pool_size,
+                              max_keepalive_connections=min(self.pool_size, 20))
+
+    def admission_limits(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "max_queued_per_user": self.max_queued_per_user,
+            "expected_service_time": self.expected_service_time,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "handler": self.handler,
+            "urls": self.urls,
+            "payload_name": self.payload_name,
+            "extra_params": self.extra_params,
+            "format": self.format,
+            "timeout": self.timeout,
+            "pool_size": self.pool_size,
+            **self.admission_limits(),
+            "slow_call_seconds": self.slow_call_seconds,
+            "hedge_after": self.hedge_after,
+            "failure_statuses": list(self.failure_statuses),
+            "cache": self.cache,
+            "single_flight": self.single_flight,
+            "shaping": {"max_chars": self.shaping.max_chars, "max_delay": self.shaping.max_delay},
+        }
+
+
+def load_routes(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        try:
+            raw = json.load(f)
+        except json.JSONDecodeError as e:
+            raise RouteConfigError(f"{path}: {e}") from e
+    routes = {}
+    for mode, options in raw.items():
+        if mode.startswith("_"):
+            continue  # 以下划线开头的键用作注释
+        if not isinstance(options, dict):
+            raise RouteConfigError(f"mode {mode}: route must be an object")
+        _check_numbers(mode, options, NUMERIC_FIELDS)
+        for name, fields in (("shaping", SHAPING_FIELDS), ("cache", {"threshold": (False, 0)})):
+            if options.get(name) is not None and not isinstance(options[name], dict):
+                raise RouteConfigError(f"mode {mode}: {name} must be an object")
+            _check_numbers(mode, options.get(name) or {}, fields, f"{name}.")
+        try:
+            routes[mode] = Route(mode, **options)
+        except TypeError as e:
+            raise RouteConfigError(f"mode {mode}: {e}") from e
+    return routes
+
+
+class RouteTable:
+    """
+    从 JSON 文件加载的模式路由表。
+
+    get() 时最多每 check_interval 秒检查一次文件修改时间，文件变化后自动重新加载，
+    不需要重启服务；新配置有错误时保留旧路由表并记录日志。加载成功后调用 on_change(routes)。
+    """
+
+    def __init__(self, path: str, on_change=None, check_interval: float = 1.0):
+        self.path = path
+        self.on_change = on_change
+        self.check_interval = check_interval
+        self._routes = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self) -> dict:
+        """重新读取配置文件，失败时抛出 RouteConfigError 并保留当前路由"""
+        with self._lock:
+            mtime = os.path.getmtime(self.path)
+            routes = load_routes(self.path)
+            self._routes = routes
+            self._mtime = mtime
+        logger.info("loaded %d routes from %s", len(routes), self.path)
+        if self.on_change is not None:
+            self.on_change(routes)
+        return routes
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            if os.path.getmtime(self.path) != self._mtime:
+                self.reload()
+        except (OSError, RouteConfigError) as e:
+            logger.error("route reload failed, keeping previous routes: %s", e)
+            # 避免每次检查都重复报错，等文件再次变化
+            try:
+                self._mtime = os.path.getmtime(self.path)
+            except OSError:
+                pass
+
+    def get(self, mode: str):
+        self._maybe_reload()
+        return self._routes.get(mode)
+
+    def routes(self) -> dict:
+        self._maybe_reload()
+        return dict(self._routes)
@@ -0,0 +1,151 @@
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_NOISE_RE = re.compile(r"[\s\W_]+")
+
+
+def shingles(text: str, n: int = 2) -> set:
+    """规整文本（小写、去掉空白和标点）后切分为字符 n-gram 集合"""
+    text = _NOISE_RE.sub("", text.lower())
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _shingle_hash(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class _Entry:
+    __slots__ = ("question", "answer", "shingles", "bands", "created_at", "hits")
+
+    def __init__(self, question: str, answer: str, shingle_set: set, bands: list):
+        self.question = question
+        self.answer = answer
+        self.shingles = shingle_set
+        self.bands = bands
+        self.created_at = time.time()
+        self.hits = 0
+
+
+class SemanticCache:
+    """
+    近似重复问题的回答缓存，不依赖任何外部服务。
+
+    问题切分为字符 n-gram，用 MinHash 签名 + LSH 分桶快速找到候选的历史问题，
+    再用精确 Jaccard 相似度确认；相似度不低于 threshold 时直接复用历史回答。
+    超过 max_entries 时按 LRU 淘汰，超过 ttl 的条目视为过期。
+    """
+
+    def __init__(self, threshold: float = 0.8, max_entries: int = 5000, ttl: float = 7 * 24 * 3600,
+                 num_perm: int = 64, bands: int = 16, ngram: int = 2, min_shingles: int = 4, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+        self.min_shingles = min_shingles
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+                       for _ in range(num_perm)]
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.recent_hits = deque(maxlen=100)
+
+    def _signature(self, shingle_set: set) -> list:
+        hashes = [_shingle_hash(s) for s in shingle_set]
+        return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms]
+
+    def _band_keys(self, signature: list) -> list:
+        return [(i, tuple(signature[i * self.rows:(i + 1) * self.rows])) for i in range(self.bands)]
+
+    def lookup(self, question: str):
+        """查找相似的历史问题，命中时返回 (回答, 相似度)，否则返回 None"""
+        query = shingles(question, self.ngram)
+        if len(query) < self.min_shingles:
+            return None
+        band_keys = self._band_keys(self._signature(query))
+        now = time.time()
+
+        with self._lock:
+            candidates = set()
+            for key in band_keys:
+                candidates.update(self._buckets.get(key, ()))
+
+            best_id, best_score = None, 0.0
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if now - entry.created_at > self.ttl:
+                    continue
+                score = len(query & entry.shingles) / len(query | entry.shingles)
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+
+            entry = self._entries[best_id]
+            entry.hits += 1
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            self.recent_hits.append({
+                "question": question[:50],
+                "matched": entry.question[:50],
+                "similarity": round(best_score, 3),
+                "entry_hits": entry.hits,
+            })
+            return entry.answer, best_score
+
+    def store(self, question: str, answer: str):
+        shingle_set = shingles(question, self.ngram)
+        if len(shingle_set) < self.min_shingles or not answer:
+            return
+        band_keys = self._band_keys(self._signature(shingle_set))
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(question, answer, shingle_set, band_keys)
+            for key in band_keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        entry_id, entry = self._entries.popitem(last=False)
+        for key in entry.bands:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+        self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            similarities = [hit["similarity"] for hit in self.recent_hits]
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "avg_hit_similarity": sum(similarities) / len(similarities) if similarities else 0.0,
+                "recent_hits": list(self.recent_hits)[-10:],
+            }
@@ -0,0 +1,73 @@
+import hashlib
+import re
+
+from Utils.metrics import REGISTRY
+
+single_flight_joined = REGISTRY.counter("single_flight_joined_total",
+                                        "Requests served by joining an identical in-flight generation", ("mode",))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def flight_key(mode: str, *parts: str) -> str:
+    """模式加归一化后的输入（去掉首尾空白、合并连续空白）的摘要"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(_WHITESPACE.sub(" ", part or "").strip().encode("utf-8"))
+        digest.update(b"\0")
+    return f"{mode}:{digest.hexdigest()}"
+
+
+class Flight:
+    """一次被多个相同请求共享的生成"""
+
+    def __init__(self, key: str, session_id: int):
+        self.key = key
+        self.sessions = [session_id]  # 共享本次结果的会话，生成结束时各写一条对话记录
+        self.stream = None  # 生成输出所在的 HubStream，由发起请求设置
+        self.closed = False
+
+
+class SingleFlight:
+    """
+    相同请求合并：同一时刻内容相同的请求只向上游发起一次调用。
+
+    第一个请求 lead() 发起生成，之后到达的相同请求 join() 订阅同一个输出流，先重放已生成的部分再跟随实时输出；
+    生成结束时 finish() 返回所有参与的会话，之后到达的相同请求重新发起调用。
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    def running(self, key: str) -> bool:
+        flight = self._flights.get(key)
+        return flight is not None and flight.stream is not None
+
+    def join(self, key: str, session_id: int, mode: str = None):
+        """加入正在进行的相同请求，没有时返回 None"""
+        flight = self._flights.get(key)
+        if flight is None or flight.stream is None:
+            return None
+        flight.sessions.append(session_id)
+        single_flight_joined.inc(mode=mode or key.split(":", 1)[0])
+        return flight
+
+    def lead(self, key: str, session_id: int) -> Flight:
+        flight = Flight(key, session_id)
+        self._flights[key] = flight
+        return flight
+
+    def finish(self, flight: Flight) -> list:
+        """结束合并，返回需要写入结果的会话；重复调用时返回空列表"""
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        if flight.closed:
+            return []
+        flight.closed = True
+        return list(flight.sessions)
+
+    def stats(self) -> dict:
+        return {
+            "flights": len(self._flights),
+            "sessions": sum(len(flight.sessions) for flight in self._flights.values()),
+        }
@@ -0,0 +1,99 @@
+import asyncio
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from Utils.db_pool import DbError, DbTimeout, db_query_errors, db_query_latency
+
+# MySQL 方言到 SQLite 的最小翻译：占位符和 LEFT()
+_LEFT_RE = re.compile(r"\bLEFT\((\w+),\s*(\d+)\)", re.IGNORECASE)
+
+sqlite3.register_adapter(datetime, lambda value: value.strftime("%Y-%m-%d %H:%M:%S"))
+sqlite3.register_converter("DATETIME", lambda raw: datetime.fromisoformat(raw.decode()))
+sqlite3.register_converter("TIMESTAMP", lambda raw: datetime.fromisoformat(raw.decode()))
+
+
+def translate(sql: str) -> str:
+    return _LEFT_RE.sub(r"substr(\1, 1, \2)", sql.replace("%s", "?"))
+
+
+class SqlitePool:
+    """
+    与 DbPool 接口相同的 SQLite 替身，用于离线压测和本地开发。
+
+    所有查询在同一个连接上串行执行（放到线程中，不阻塞事件循环）；
+    open() 时执行 schema 脚本建表。通过环境变量 DB_BACKEND=sqlite 启用，见 db_pool.create_pool。
+    """
+
+    def __init__(self, database: str, path: str = ":memory:", schema: str = None, query_timeout: float = 10.0):
+        self.database = database
+        self.path = path
+        self.schema = schema
+        self.query_timeout = query_timeout
+        self._conn = None
+        self._lock = threading.Lock()
+
+    async def open(self):
+        if self._conn is not None:
+            return
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        if self.schema:
+            with open(self.schema, encoding="utf-8") as f:
+                self._conn.executescript(f.read())
+
+    async def close(self):
+        if self._conn is None:
+            return
+        self._conn.close()
+        self._conn = None
+
+    def _execute(self, sql: str, args, fetch: str, many: bool):
+        with self._lock:
+            cursor = self._conn.cursor()
+            try:
+                if many:
+                    cursor.executemany(sql, args)
+                else:
+                    cursor.execute(sql, args or ())
+                if fetch == "one":
+                    return cursor.fetchone()
+                if fetch == "all":
+                    return cursor.fetchall()
+                if fetch == "lastrowid":
+                    return cursor.lastrowid
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+    async def _run(self, sql: str, args, fetch: str, many: bool, timeout: float = None):
+        if self._conn is None:
+            await self.open()
+        statement = sql.split(None, 1)[0].upper()
+        timeout = timeout or self.query_timeout
+        start_time = time.monotonic()
+        try:
+            return await asyncio.wait_for(
+                asyncio.to_thread(self._execute, translate(sql), args, fetch, many), timeout)
+        except asyncio.TimeoutError as e:
+            db_query_errors.inc(database=self.database, statement=statement)
+            raise DbTimeout(f"query timed out after {timeout}s") from e
+        except sqlite3.Error as e:
+            db_query_errors.inc(database=self.database, statement=statement)
+            raise DbError(str(e)) from e
+        finally:
+            db_query_latency.observe(time.monotonic() - start_time, database=self.database, statement=statement)
+
+    async def fetchone(self, sql: str, args=None, timeout: float = None):
+        return await self._run(sql, args, "one", many=False, timeout=timeout)
+
+    async def fetchall(self, sql: str, args=None, timeout: float = None):
+        return await self._run(sql, args, "all", many=False, timeout=timeout)
+
+    async def execute(self, sql: str, args=None, timeout: float = None) -> int:
+        return await self._run(sql, args, "lastrowid", many=False, timeout=timeout)
+
+    async def executemany(self, sql: str, seq_of_args, timeout: float = None) -> int:
+        return await self._run(sql, seq_of_args, "rowcount", many=True, timeout=timeout)
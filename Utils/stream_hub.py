@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from itertools import islice
+
+from Utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+resumable_streams = REGISTRY.gauge("resumable_streams", "Generations kept in the replay buffer")
+stream_resumes = REGISTRY.counter("stream_resumes_total", "Reconnects to a running or finished generation",
+                                  ("result",))
+
+
+class StreamGone(Exception):
+    """客户端要求的事件已经被挤出回放缓冲区，无法从断点续传"""
+
+
+class HubStream:
+    """
+    一次生成的输出：后台任务持续写入，带递增事件编号的分片保存在环形缓冲区中，
+    缓冲区同时受分片数和总字符数限制（与 ResponseAccumulator 的内存上限一致）；
+    任意数量的订阅者可以从某个事件编号之后开始回放，然后跟随实时输出。
+    """
+
+    def __init__(self, stream_id: str, owner=None, buffer_size: int = 4096, max_chars: int = 64 * 1024):
+        self.id = stream_id
+        self.owners = {owner}  # 可以重连的用户，合并的相同请求会加入
+        self.events = deque(maxlen=buffer_size)  # (事件编号, 分片)，编号从 1 开始
+        self.max_chars = max_chars
+        self.chars = 0  # 缓冲区中分片的总字符数
+        self.last_id = 0
+        self.done = False
+        self.error = None
+        self.finished_at = None
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, chunk: str):
+        self.last_id += 1
+        if len(self.events) == self.events.maxlen:
+            self.chars -= len(self.events[0][1])
+        self.events.append((self.last_id, chunk))
+        self.chars += len(chunk)
+        # 按总字符数淘汰最早的分片，至少保留最新的一个
+        while self.chars > self.max_chars and len(self.events) > 1:
+            self.chars -= len(self.events.popleft()[1])
+        self._notify()
+
+    def finish(self, error: str = None):
+        self.done = True
+        self.error = error
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def can_resume(self, last_event_id: int) -> bool:
+        """last_event_id 之后的事件是否都还在缓冲区中"""
+        first = self.events[0][0] if self.events else self.last_id + 1
+        return last_event_id + 1 >= first
+
+    async def subscribe(self, last_event_id: int = 0):
+        """
+        产出 last_event_id 之后的 (事件编号, 分片)：先重放缓冲区中已有的，再等待新的输出，生成结束时返回。
+
+        订阅者落后太多、需要的事件已被挤出缓冲区时抛出 StreamGone。
+        """
+        next_id = last_event_id + 1
+        while True:
+            if not self.can_resume(next_id - 1):
+                raise StreamGone(f"event {next_id} of stream {self.id} is no longer buffered")
+            if next_id <= self.last_id:
+                start = next_id - self.events[0][0]
+                for event_id, chunk in list(islice(self.events, start, None)):
+                    yield event_id, chunk
+                    next_id = event_id + 1
+                continue
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+class StreamHub:
+    """
+    可续传的流式生成。
+
+    start() 把输出流交给后台任务消费，客户端断开不会中断生成；重连的客户端凭 stream id 和
+    Last-Event-ID 从断点继续接收。生成结束 grace_period 秒后释放缓冲区。
+    每个生成的缓冲区最多 buffer_size 个分片、max_chars 个字符，落后更多的订阅者无法续传。
+    """
+
+    def __init__(self, buffer_size: int = 4096, max_chars: int = 64 * 1024, grace_period: float = 60.0):
+        self.buffer_size = buffer_size
+        self.max_chars = max_chars
+        self.grace_period = grace_period
+        self._streams = {}
+
+    def start(self, source, owner=None) -> HubStream:
+        stream = HubStream(uuid.uuid4().hex, owner, self.buffer_size, self.max_chars)
+        stream.task = asyncio.create_task(self._run(stream, source))
+        self._streams[stream.id] = stream
+        resumable_streams.set(len(self._streams))
+        return stream
+
+    async def _run(self, stream: HubStream, source):
+        error = None
+        try:
+            async for chunk in source:
+                stream.append(chunk)
+        except asyncio.CancelledError:
+            error = "cancelled"
+            raise
+        except Exception as e:
+            logger.exception("stream %s failed", stream.id)
+            error = str(e)
+        finally:
+            await source.aclose()
+            stream.finish(error)
+            asyncio.get_running_loop().call_later(self.grace_period, self._evict, stream.id)
+
+    def _evict(self, stream_id: str):
+        self._streams.pop(stream_id, None)
+        resumable_streams.set(len(self._streams))
+
+    def get(self, stream_id: str) -> HubStream:
+        return self._streams.get(stream_id)
+
+    async def aclose(self):
+        """应用关闭时取消仍在进行的生成"""
+        tasks = [stream.task for stream in self._streams.values() if not stream.done]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._streams.clear()
+        resumable_streams.set(0)
+
+    def stats(self) -> dict:
+        running = sum(1 for stream in self._streams.values() if not stream.done)
+        return {
+            "streams": len(self._streams),
+            "running": running,
+            "buffered_events": sum(len(stream.events) for stream in self._streams.values()),
+            "buffered_chars": sum(stream.chars for stream in self._streams.values()),
+        }
+
+
+def sse_event(event_id: int, data: str, event: str = None) -> str:
+    """按 text/event-stream 格式编码一个事件，多行数据拆成多个 data 行"""
+    lines = [f"id: {event_id}"]
+    if event:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
@@ -0,0 +1,90 @@
+import asyncio
+from contextlib import suppress
+from typing import AsyncGenerator, AsyncIterable
+
+
+class ShapingConfig:
+    """
+    流式输出的合并参数。
+
+    max_chars: 缓冲区累计到该字符数立即发送
+    max_delay: 缓冲区中最早的内容最多等待的秒数
+    flush_first: 第一个分片不等待直接发送，保证首字节延迟
+    """
+
+    def __init__(self, max_chars: int = 256, max_delay: float = 0.05, flush_first: bool = True):
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        self.flush_first = flush_first
+
+
+DEFAULT_SHAPING = ShapingConfig()
+
+
+async def coalesce(source: AsyncIterable[str], config: ShapingConfig = DEFAULT_SHAPING) -> AsyncGenerator[str, None]:
+    """
+    把上游零碎的增量合并成较大的帧再发送。
+
+    按大小或时间窗口触发发送，不再在每个分片后固定 sleep。下游由 StreamHub 的后台任务独立消费、
+    写入回放缓冲区，发送节奏不受客户端连接背压的影响；读得慢的客户端由缓冲区上限兜底。
+    """
+    loop = asyncio.get_running_loop()
+    iterator = source.__aiter__()
+    buffer = []
+    size = 0
+    deadline = 0.0
+    first = config.flush_first
+    pending = None
+
+    try:
+        while True:
+            if not buffer and pending is None:
+                # 缓冲区为空时没有截止时间，直接等待下一个分片
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+            else:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                # 缓冲区为空时（刚按时间窗口发送过）没有截止时间
+                timeout = max(0.0, deadline - loop.time()) if buffer else None
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    # 时间窗口到期，先把已有内容发出去，上游读取继续挂起
+                    yield "".join(buffer)
+                    buffer = []
+                    size = 0
+                    continue
+                task, pending = pending, None
+                try:
+                    chunk = task.result()
+                except StopAsyncIteration:
+                    break
+
+            if not chunk:
+                continue
+            if first:
+                first = False
+                yield chunk
+                continue
+
+            if not buffer:
+                deadline = loop.time() + config.max_delay
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= config.max_chars:
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+            with suppress(BaseException):
+                await pending
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
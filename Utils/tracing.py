@@ -0,0 +1,261 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_service_name = os.getenv("SERVICE_NAME", "znxz")
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def configure(service_name: str):
+    """设置导出 span 时使用的服务名"""
+    global _service_name
+    _service_name = service_name
+
+
+def parse_traceparent(header: str):
+    """解析 W3C traceparent 头，返回 (trace_id, parent_span_id)，格式不对时返回 None"""
+    if not header:
+        return None
+    match = _TRACEPARENT_RE.match(header.strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2)
+
+
+class Span:
+    """
+    一次操作的耗时记录。
+
+    同一请求经过的各个服务共享 trace_id，通过 traceparent 头把父 span 传给下游；
+    span 结束时交给导出器写入本地文件或发送到 OTLP 收集器。
+    """
+
+    def __init__(self, name: str, trace_id: str = None, parent_id: str = None, **attributes):
+        self.name = name
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.events = []
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self.error = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def child(self, name: str, **attributes) -> "Span":
+        return Span(name, self.trace_id, self.span_id, **attributes)
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append((name, time.time_ns(), attributes))
+
+    def end(self, error: str = None):
+        if self.end_time is not None:
+            return
+        self.end_time = time.time_ns()
+        if error:
+            self.error = error
+        _exporter.export(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(error=str(exc) if exc else None)
+        return False
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(self.end_time),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [
+                {"name": name, "timeUnixNano": str(ts), "attributes": _otlp_attributes(attrs)}
+                for name, ts, attrs in self.events
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def start_span(name: str, traceparent: str = None, **attributes) -> Span:
+    """开始一个服务端 span，带有合法 traceparent 时延续上游的 trace"""
+    parent = parse_traceparent(traceparent)
+    if parent is None:
+        return Span(name, **attributes)
+    return Span(name, parent[0], parent[1], **attributes)
+
+
+def child_span(parent: Span, name: str, **attributes) -> Span:
+    """在 parent 下开始子 span，没有 parent 时开始新的 trace"""
+    if parent is None:
+        return Span(name, **attributes)
+    return parent.child(name, **attributes)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def set_current_span(span: Span):
+    """把 span 设为当前上下文的 span，之后在该上下文中发出的 httpx 请求会自动带上它的 traceparent"""
+    return _current_span.set(span)
+
+
+async def inject_traceparent(request):
+    """httpx 的 request 事件钩子：请求没有显式指定 traceparent 时使用当前 span"""
+    span = _current_span.get()
+    if span is not None and "traceparent" not in request.headers:
+        request.headers["traceparent"] = span.traceparent
+
+
+def httpx_trace_hook(span: Span):
+    """
+    返回 httpx 的 trace 扩展回调，把建立连接、TLS 握手、收到响应头等阶段记录为 span 事件。
+
+    用法：client.stream(..., extensions={"trace": httpx_trace_hook(span)})
+    """
+    recorded = ("connection.connect_tcp.complete", "connection.start_tls.complete",
+                "http11.send_request_headers.started", "http2.send_request_headers.started",
+                "http11.receive_response_headers.complete", "http2.receive_response_headers.complete")
+
+    async def hook(event_name: str, info: dict):
+        if event_name in recorded:
+            span.add_event(event_name)
+
+    return hook
+
+
+async def mark_first(source, span: Span, event: str):
+    """透传 source，在收到第一个元素时给 span 记录 event（如上游首字节、LLM 首 token）"""
+    first = True
+    async for item in source:
+        if first:
+            span.add_event(event)
+            first = False
+        yield item
+
+
+async def traced_stream(source, span: Span):
+    """在 span 中记录流的首个分片时间，流结束（或客户端断开）时结束 span"""
+    first = True
+    error = None
+    try:
+        async for chunk in source:
+            if first:
+                span.add_event("first_chunk")
+                first = False
+            yield chunk
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        span.end(error=error)
+
+
+def _otlp_attributes(attributes: dict) -> list:
+    result = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        result.append({"key": key, "value": typed})
+    return result
+
+
+class SpanExporter:
+    """
+    后台线程批量导出 span。
+
+    设置 TRACE_OTLP_URL 时按 OTLP/HTTP JSON 格式 POST 到收集器；设置 TRACE_FILE 时逐行写入本地文件；
+    都未设置时丢弃 span，traceparent 仍会照常向下游传递。
+    """
+
+    def __init__(self, file_path: str = None, otlp_url: str = None, batch_size: int = 256,
+                 flush_interval: float = 1.0, max_queue: int = 10000):
+        self.file_path = file_path
+        self.otlp_url = otlp_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enabled = bool(file_path or otlp_url)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        if not self.enabled:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            pass  # 导出跟不上时丢弃，不影响请求
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.warning("span export failed: %s", e)
+
+    def _write(self, batch: list):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": _service_name})},
+                "scopeSpans": [{"scope": {"name": "znxz"}, "spans": [span.to_otlp() for span in batch]}],
+            }]
+        }
+        if self.otlp_url:
+            request = urllib.request.Request(self.otlp_url, data=json.dumps(payload).encode("utf-8"),
+                                             headers={"Content-Type": "application/json"}, method="POST")
+            urllib.request.urlopen(request, timeout=5).close()
+        if self.file_path:
+            with open(self.file_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+
+
+_exporter = SpanExporter(file_path=os.getenv("TRACE_FILE"), otlp_url=os.getenv("TRACE_OTLP_URL"))
@@ -0,0 +1,333 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import httpx
+
+from Utils.http_pool import HttpClientRegistry, upstream_key
+from Utils.metrics import REGISTRY
+from Utils.tracing import Span, httpx_trace_hook
+
+logger = logging.getLogger(__name__)
+
+# cpolar 隧道断开时返回 404，这类响应和 5xx 一样说明上游不可用
+TUNNEL_ERROR_STATUSES = (404,)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+circuit_state = REGISTRY.gauge("upstream_circuit_open", "1 while the circuit of an upstream is open", ("upstream",))
+circuit_rejected = REGISTRY.counter("upstream_circuit_rejected_total", "Requests failed fast by an open circuit",
+                                    ("upstream",))
+hedged_requests = REGISTRY.counter("upstream_hedged_requests_total", "Hedged attempts sent to a standby upstream",
+                                   ("upstream", "winner"))
+
+
+class CircuitOpen(Exception):
+    """上游处于熔断状态，请求被直接拒绝"""
+
+    def __init__(self, upstream: str, retry_after: int):
+        super().__init__(f"上游 {upstream} 暂时不可用（已熔断），请 {retry_after} 秒后重试")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    单个上游的熔断器。
+
+    在 window 秒的滑动窗口内统计调用结果，5xx 和 failure_statuses 中的状态码算失败，
+    首字节超过 slow_call_seconds 的调用也算失败；
+    样本数不少于 min_calls 且失败率达到 failure_rate 时断开（open），之后的请求直接失败。
+    后台探测成功或断开超过 open_seconds 后进入半开（half_open），放行一个试探请求，
+    成功则恢复（closed），失败则重新断开。
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 5, window: float = 30.0,
+                 slow_call_seconds: float = 20.0, open_seconds: float = 60.0,
+                 failure_statuses: tuple = TUNNEL_ERROR_STATUSES):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.failure_statuses = frozenset(failure_statuses)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._calls = deque()  # (时间, 是否成功)
+
+    def failed_status(self, status_code: int) -> bool:
+        return status_code >= 500 or status_code in self.failure_statuses
+
+    def retry_after(self) -> int:
+        return max(int(self.opened_at + self.open_seconds - time.monotonic()), 1)
+
+    def allow(self) -> bool:
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.half_open()
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def half_open(self):
+        if self.state == OPEN:
+            logger.info("circuit %s half-open", self.name)
+            self.state = HALF_OPEN
+            self._trial_in_flight = False
+
+    def record(self, ok: bool, latency: float = None):
+        if ok and latency is not None and latency > self.slow_call_seconds:
+            ok = False
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self._trial_in_flight = False
+            if ok:
+                self._close()
+            else:
+                self._open(now)
+            return
+        self._calls.append((now, ok))
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+        failures = sum(1 for _, success in self._calls if not success)
+        if self.state == CLOSED and len(self._calls) >= self.min_calls \
+                and failures / len(self._calls) >= self.failure_rate:
+            self._open(now)
+
+    def cancel_trial(self):
+        """试探请求没有结果就被放弃（如对冲请求落败）时调用，让下一个请求继续试探"""
+        if self.state == HALF_OPEN:
+            self._trial_in_flight = False
+
+    def _open(self, now: float):
+        logger.warning("circuit %s opened", self.name)
+        self.state = OPEN
+        self.opened_at = now
+        self._calls.clear()
+        circuit_state.set(1, upstream=self.name)
+
+    def _close(self):
+        logger.info("circuit %s closed", self.name)
+        self.state = CLOSED
+        self._calls.clear()
+        circuit_state.set(0, upstream=self.name)
+
+    def stats(self) -> dict:
+        failures = sum(1 for _, success in self._calls if not success)
+        return {"state": self.state, "calls": len(self._calls), "failures": failures}
+
+
+class _Attempt:
+    def __init__(self, url: str, response: httpx.Response, iterator, first_chunk: str):
+        self.url = url
+        self.response = response
+        self.iterator = iterator
+        self.first_chunk = first_chunk
+
+    @property
+    def ok(self) -> bool:
+        return self.response.status_code == 200
+
+
+class UpstreamStream:
+    """open_stream 的结果：已经收到首字节的流式响应，用法与 httpx 的流式响应相同"""
+
+    def __init__(self, attempt: _Attempt):
+        self.url = attempt.url
+        self.status_code = attempt.response.status_code
+        self._attempt = attempt
+
+    async def aiter_text(self):
+        if self._attempt.first_chunk:
+            yield self._attempt.first_chunk
+        async for text in self._attempt.iterator:
+            yield text
+
+    async def aclose(self):
+        await self._attempt.response.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
+class UpstreamHealth:
+    """
+    远程智能体的健康层：每个上游一个熔断器，熔断期间后台定期探测恢复；
+    配置了备用地址的上游在首字节迟迟不到时，再向备用地址发一次对冲请求，先返回的一方胜出。
+    """
+
+    def __init__(self, http_clients: HttpClientRegistry, probe_interval: float = 5.0, **breaker_defaults):
+        self.http_clients = http_clients
+        self.probe_interval = probe_interval
+        self.breaker_defaults = breaker_defaults
+        self._breakers = {}
+        self._probe_urls = {}
+        self._standby = {}
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        key = upstream_key(url)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(key, **self.breaker_defaults)
+        self._probe_urls.setdefault(key, url)
+        return breaker
+
+    def configure(self, url: str, **params) -> CircuitBreaker:
+        """为单个上游指定熔断参数，未指定的使用默认值；已有熔断器时原地更新参数，保留当前状态"""
+        key = upstream_key(url)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            self._breakers[key] = CircuitBreaker(key, **{**self.breaker_defaults, **params})
+        else:
+            for name, value in params.items():
+                setattr(breaker, name, value)
+        self._probe_urls[key] = url
+        return self._breakers[key]
+
+    def configure_standby(self, url: str, standby_url: str, hedge_after: float = 3.0):
+        """首字节超过 hedge_after 秒未到达时，向 standby_url 发出对冲请求；standby_url 为 None 时取消"""
+        if standby_url is None:
+            self._standby.pop(url, None)
+            return
+        self._standby[url] = (standby_url, hedge_after)
+        self.breaker(standby_url)
+
+    async def _attempt(self, url: str, payload: dict, span: Span, pool: str = None) -> _Attempt:
+        breaker = self.breaker(url)
+        client = self.http_clients.get(url, pool)
+        request = client.build_request("POST", url, json=payload, headers={"traceparent": span.traceparent},
+                                       extensions={"trace": httpx_trace_hook(span)})
+        start = time.monotonic()
+        response = None
+        try:
+            response = await client.send(request, stream=True)
+            iterator = response.aiter_text()
+            first_chunk = ""
+            if response.status_code == 200:
+                try:
+                    first_chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    pass
+                span.add_event("first_byte", upstream=url)
+        except asyncio.CancelledError:
+            breaker.cancel_trial()
+            if response is not None:
+                await response.aclose()
+            raise
+        except Exception:
+            breaker.record(False)
+            if response is not None:
+                await response.aclose()
+            raise
+        breaker.record(not breaker.failed_status(response.status_code), time.monotonic() - start)
+        return _Attempt(url, response, iterator, first_chunk)
+
+    def _start(self, url: str, payload: dict, span: Span, attempts: dict, pool: str = None):
+        task = asyncio.create_task(self._attempt(url, payload, span, pool))
+        attempts[task] = url
+        return task
+
+    async def open_stream(self, url: str, payload: dict, span: Span, pool: str = None) -> UpstreamStream:
+        """
+        向 url 发起流式 POST，等到首字节后返回；pool 指定使用 http_clients 中的哪个连接池。
+
+        主地址熔断时直接改用备用地址，都不可用时抛出 CircuitOpen；主地址失败时立即切到备用地址，
+        首字节超时时并发请求备用地址，落败的请求会被取消。
+        """
+        standby_url, hedge_after = self._standby.get(url, (None, None))
+        if self.breaker(url).allow():
+            primary, backup = url, standby_url
+        elif standby_url and self.breaker(standby_url).allow():
+            primary, backup = standby_url, None
+        else:
+            circuit_rejected.inc(upstream=upstream_key(url))
+            raise CircuitOpen(upstream_key(url), self.breaker(url).retry_after())
+
+        attempts = {}
+        pending = {self._start(primary, payload, span, attempts, pool)}
+        winner, fallback, error = None, None, None
+        try:
+            while pending:
+                hedging = backup is not None and backup not in attempts.values()
+                done, pending = await asyncio.wait(pending, timeout=hedge_after if hedging else None,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 首字节迟到，向备用地址发对冲请求
+                    if self.breaker(backup).allow():
+                        span.add_event("hedge", upstream=backup)
+                        pending.add(self._start(backup, payload, span, attempts, pool))
+                    backup = None
+                    continue
+                for task in done:
+                    try:
+                        attempt = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if attempt.ok and winner is None:
+                        winner = attempt
+                    elif fallback is None:
+                        fallback = attempt
+                    else:
+                        await attempt.response.aclose()
+                if winner is not None:
+                    break
+                if not pending and backup is not None and backup not in attempts.values() \
+                        and self.breaker(backup).allow():
+                    # 主地址已经失败，立即切换到备用地址
+                    span.add_event("failover", upstream=backup)
+                    pending.add(self._start(backup, payload, span, attempts, pool))
+                    backup = None
+        finally:
+            for task in pending:
+                task.cancel()
+            for task in pending:
+                try:
+                    attempt = await task
+                except (Exception, asyncio.CancelledError):
+                    continue
+                # 取消前已经拿到响应的请求
+                await attempt.response.aclose()
+
+        if len(attempts) > 1:
+            hedged_requests.inc(upstream=upstream_key(url),
+                                winner=upstream_key(winner.url) if winner is not None else "none")
+        if winner is not None:
+            if fallback is not None:
+                await fallback.response.aclose()
+            span.set_attribute("upstream.winner", winner.url)
+            return UpstreamStream(winner)
+        if fallback is not None:
+            return UpstreamStream(fallback)
+        raise error
+
+    async def _probe(self, key: str, breaker: CircuitBreaker):
+        """探测熔断中的上游：返回的状态码不算失败（非 5xx 且不在 failure_statuses 中）就认为隧道已恢复"""
+        url = self._probe_urls[key]
+        try:
+            response = await self.http_clients.get(url).get(url, timeout=5.0)
+            if not breaker.failed_status(response.status_code):
+                breaker.half_open()
+        except httpx.HTTPError:
+            pass
+
+    async def probe_loop(self):
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            probes = [self._probe(key, breaker) for key, breaker in list(self._breakers.items())
+                      if breaker.state == OPEN]
+            if probes:
+                await asyncio.gather(*probes)
+
+    def stats(self) -> dict:
+        return {key: breaker.stats() for key, breaker in self._breakers.items()}
@@ -0,0 +1,207 @@
+"""
+压测驱动：模拟多个用户并发登录、在各模式下提问并翻看历史记录，
+统计各接口的 p50/p99 延迟、/dialog 的首字延迟（TTFT）和同时进行中的流数量峰值。
+
+    python -m bench.load --dialog-url http://127.0.0.1:8000 --user-url http://127.0.0.1:8001 --users 20
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+
+import httpx
+
+MODES = ("1", "2", "3", "4", "5", "6")
+QUESTIONS = {
+    "1": "第{n}个问题：什么是软件工程中的需求分析？",
+    "2": "第{n}个问题：敏捷开发和瀑布模型有什么区别？",
+    "3": "作为第{n}位学生，我希望在线提交作业，以便老师及时批改。",
+    "4": "public class Calculator{n} {{ public int add(int a, int b) {{ return a + b; }} }}",
+    "5": "public class OrderService{n} {{ private Config config = Config.getInstance(); }}",
+    "6": "public class UserManager{n} {{ public void Save_User() {{ }} }}",
+}
+# dialog.py 在转发远程服务前后输出的状态行，不计入首字延迟
+STATUS_PREFIXES = ("# 正在连接到", "# ✅ 已连接", "# ✅ 命中缓存", "# ⏳ 排队中")
+
+
+def percentile(values: list, pct: float):
+    """最近秩法求百分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def has_content(text: str) -> bool:
+    return any(line.strip() and not line.startswith(STATUS_PREFIXES) for line in text.splitlines())
+
+
+class Stats:
+    def __init__(self):
+        self.latency = {}
+        self.ttft = {}
+        self.errors = {}
+        self.rejected = {}
+        self.active_streams = 0
+        self.max_streams = 0
+
+    def record(self, name: str, seconds: float, ok: bool = True):
+        self.latency.setdefault(name, []).append(seconds)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def stream_started(self):
+        self.active_streams += 1
+        self.max_streams = max(self.max_streams, self.active_streams)
+
+    def stream_finished(self):
+        self.active_streams -= 1
+
+    def summary(self, elapsed: float) -> dict:
+        endpoints = {}
+        for name in sorted(set(self.latency) | set(self.rejected)):
+            values = self.latency.get(name, [])
+            ttft = self.ttft.get(name, [])
+            endpoints[name] = {
+                "count": len(values),
+                "errors": self.errors.get(name, 0),
+                "rejected": self.rejected.get(name, 0),
+                "p50": percentile(values, 50),
+                "p99": percentile(values, 99),
+                "ttft_p50": percentile(ttft, 50),
+                "ttft_p99": percentile(ttft, 99),
+            }
+        total = sum(len(values) for values in self.latency.values())
+        return {
+            "elapsed": elapsed,
+            "requests": total,
+            "throughput": total / elapsed if elapsed else 0.0,
+            "max_concurrent_streams": self.max_streams,
+            "endpoints": endpoints,
+        }
+
+
+async def timed(stats: Stats, name: str, call):
+    start = time.perf_counter()
+    try:
+        response = await call()
+        stats.record(name, time.perf_counter() - start, response.status_code == 200)
+        return response
+    except httpx.HTTPError:
+        stats.record(name, time.perf_counter() - start, ok=False)
+        return None
+
+
+async def ask(client: httpx.AsyncClient, stats: Stats, dialog_url: str, token: str, mode: str, n: int):
+    name = f"dialog mode={mode}"
+    payload = {"mode": mode, "question": QUESTIONS[mode].format(n=n), "session_id": -1}
+    start = time.perf_counter()
+    ok = False
+    stats.stream_started()
+    try:
+        async with client.stream("POST", f"{dialog_url}/dialog", json=payload,
+                                 headers={"Authorization": token}) as response:
+            if response.status_code == 429:
+                # 准入控制主动拒绝，单独计数，不计入延迟统计
+                stats.rejected[name] = stats.rejected.get(name, 0) + 1
+                return
+            received = ""
+            ttft = None
+            async for text in response.aiter_text():
+                if ttft is None:
+                    received += text
+                    if has_content(received):
+                        ttft = time.perf_counter() - start
+            ok = response.status_code == 200 and "❌" not in received
+            if ttft is not None:
+                stats.ttft.setdefault(name, []).append(ttft)
+    except httpx.HTTPError:
+        ok = False
+    finally:
+        stats.stream_finished()
+    stats.record(name, time.perf_counter() - start, ok)
+
+
+async def virtual_user(index: int, args, stats: Stats, run_id: str):
+    email = f"bench-{run_id}-{index}@example.com"
+    credentials = {"email": email, "password": "bench"}
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        await timed(stats, "register", lambda: client.post(f"{args.user_url}/register", json=credentials))
+        for iteration in range(args.iterations):
+            response = await timed(stats, "login", lambda: client.post(f"{args.user_url}/login", json=credentials))
+            token = response.json().get("token") if response is not None and response.status_code == 200 else ""
+            if not token:
+                continue
+            for mode in args.modes:
+                await ask(client, stats, args.dialog_url, token, mode, index * args.iterations + iteration)
+            await timed(stats, "session_history", lambda: client.get(
+                f"{args.dialog_url}/session_history", params={"limit": 50}, headers={"Authorization": token}))
+
+
+def print_report(summary: dict, out=sys.stdout):
+    def fmt(value):
+        return "-" if value is None else f"{value * 1000:.0f}ms"
+
+    print(f"\n{'endpoint':<18}{'count':>7}{'errors':>8}{'429':>6}{'p50':>10}{'p99':>10}{'ttft p50':>10}{'ttft p99':>10}",
+          file=out)
+    for name, row in summary["endpoints"].items():
+        print(f"{name:<18}{row['count']:>7}{row['errors']:>8}{row['rejected']:>6}{fmt(row['p50']):>10}{fmt(row['p99']):>10}"
+              f"{fmt(row['ttft_p50']):>10}{fmt(row['ttft_p99']):>10}", file=out)
+    print(f"\n{summary['requests']} requests in {summary['elapsed']:.1f}s "
+          f"({summary['throughput']:.1f} req/s), max concurrent streams: {summary['max_concurrent_streams']}",
+          file=out)
+
+
+async def run(args) -> dict:
+    stats = Stats()
+    run_id = uuid.uuid4().hex[:8]
+    start = time.perf_counter()
+    await asyncio.gather(*(virtual_user(i, args, stats, run_id) for i in range(args.users)))
+    return stats.summary(time.perf_counter() - start)
+
+
+def check_thresholds(summary: dict, args) -> list:
+    """返回超出阈值的条目，用于在部署前拦截性能回退"""
+    failures = []
+    for name, row in summary["endpoints"].items():
+        if row["errors"]:
+            failures.append(f"{name}: {row['errors']} errors")
+        if args.max_p99 is not None and row["p99"] is not None and row["p99"] > args.max_p99:
+            failures.append(f"{name}: p99 {row['p99']:.3f}s > {args.max_p99}s")
+        if args.max_ttft_p99 is not None and row["ttft_p99"] is not None and row["ttft_p99"] > args.max_ttft_p99:
+            failures.append(f"{name}: ttft p99 {row['ttft_p99']:.3f}s > {args.max_ttft_p99}s")
+    return failures
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="dialog / user 服务压测")
+    parser.add_argument("--dialog-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--user-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--users", type=int, default=10, help="并发用户数")
+    parser.add_argument("--iterations", type=int, default=3, help="每个用户的轮数，每轮在各模式下各提问一次")
+    parser.add_argument("--modes", type=lambda value: value.split(","), default=list(MODES),
+                        help="逗号分隔的对话模式，默认 1-6")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="把统计结果写入 JSON 文件")
+    parser.add_argument("--max-p99", type=float, help="任一接口 p99 延迟超过该值（秒）时返回非零退出码")
+    parser.add_argument("--max-ttft-p99", type=float, help="任一模式 TTFT p99 超过该值（秒）时返回非零退出码")
+    return parser
+
+
+def report(summary: dict, args) -> int:
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    failures = check_thresholds(summary, args)
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    arguments = build_parser().parse_args()
+    sys.exit(report(asyncio.run(run(arguments)), arguments))
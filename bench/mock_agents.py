@@ -0,0 +1,112 @@
+"""
+远程智能体的本地模拟服务，压测时代替 cpolar 后面的对话、用户故事、测试用例生成和评审服务。
+
+评审接口与 AI_agent.py / AI_reviewer.py 的 /review 返回相同的 NDJSON（stream_started / chunk / completed），
+延迟参数与 bench.mock_llm 共用 MOCK_* 环境变量。
+
+    python -m bench.mock_agents --port 18200
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from bench.mock_llm import ANSWER_TEXT, DESIGN_REVIEW_JSON, MockConfig, split_tokens, token_stream
+
+MODEL_NAME = "deepseek-chat"
+CODE_REVIEW_TEXT = "# 总体评价\n- 代码结构清晰，命名基本符合规范\n\n# 详细问题报告\n| 类别 | 行号 | 问题描述 | 严重性 | 改进建议 |\n"
+JUNIT_TEMPLATE = """@ParameterizedTest
+@MethodSource("addCases")
+void testAdd(int a, int b) {
+  Calculator instance = new Calculator();
+  // 请在此处添加断言逻辑
+}"""
+
+
+def ndjson(record: dict, ensure_ascii: bool = True) -> str:
+    return json.dumps(record, ensure_ascii=ensure_ascii) + "\n"
+
+
+def create_app(config: MockConfig = None) -> FastAPI:
+    config = config or MockConfig()
+    app = FastAPI()
+
+    async def generated_content(text: str):
+        async for token in token_stream(split_tokens(text, config.completion_tokens), config):
+            yield ndjson({"generated_content": token}, ensure_ascii=False)
+
+    @app.post("/ask")
+    async def ask(request: Request):
+        await request.json()
+        return StreamingResponse(generated_content(ANSWER_TEXT), media_type="application/x-ndjson")
+
+    @app.post("/generate")
+    async def generate(request: Request):
+        await request.json()
+        return StreamingResponse(generated_content("作为学生，我希望查看课程进度，以便安排学习计划。"),
+                                 media_type="application/x-ndjson")
+
+    @app.post("/api/testgen/generate")
+    async def testgen(request: Request):
+        await request.json()
+        # 测试用例生成服务一次返回完整结果
+        async for _ in token_stream([""], config):
+            pass
+        return JSONResponse({"boundaryValues": ["a", "b"], "junitTemplate": JUNIT_TEMPLATE})
+
+    @app.post("/{kind}/review")
+    async def review(kind: str, request: Request):
+        """kind 为 design 时按 AI_agent.py 返回 JSON 评审结果，否则按 AI_reviewer.py 返回 markdown"""
+        data = await request.json()
+        start_time = time.time()
+        design = kind == "design"
+        text = DESIGN_REVIEW_JSON if design else CODE_REVIEW_TEXT
+        tokens = split_tokens(text, (len(text) + 1) // 2)
+
+        if not data.get("stream", False):
+            result = "".join([token async for token in token_stream(tokens, config)])
+            return JSONResponse({
+                "status": "success",
+                "model": MODEL_NAME,
+                "review_result": result,
+                "execution_time": time.time() - start_time,
+            })
+
+        async def records():
+            # AI_reviewer 的开始和分片记录不转义中文，AI_agent 保持默认转义
+            yield ndjson({
+                "status": "stream_started",
+                "model": MODEL_NAME,
+                "start_time": datetime.now().isoformat(),
+            }, ensure_ascii=design)
+            async for token in token_stream(tokens, config):
+                yield ndjson({"chunk": token}, ensure_ascii=design)
+            yield ndjson({
+                "status": "completed",
+                "full_result": text,
+                "execution_time": time.time() - start_time,
+            })
+
+        return StreamingResponse(records(), media_type="text/event-stream")
+
+    return app
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="远程智能体的本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18200)
+    parser.add_argument("--ttft", type=float, help="首个分片延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, help="每秒输出的分片数")
+    parser.add_argument("--completion-tokens", type=int, help="对话类回答的分片数")
+    parser.add_argument("--jitter", type=float, help="延迟的随机抖动比例")
+    args = parser.parse_args()
+    uvicorn.run(create_app(MockConfig(args.ttft, args.tokens_per_second, args.completion_tokens, args.jitter)),
+                host=args.host, port=args.port, log_level="warning")
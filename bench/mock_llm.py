@@ -0,0 +1,161 @@
+"""
+本地的 OpenAI 兼容模拟服务，压测时代替 DeepSeek。
+
+以可配置的首 token 延迟和 token 速率流式返回 chat.completion.chunk，
+支持 stream_options.include_usage，并模拟前缀缓存：同一个系统提示词第二次出现时计为缓存命中。
+
+    python -m bench.mock_llm --port 18100 --ttft 0.3 --tokens-per-second 50 --completion-tokens 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER_TEXT = ("软件工程关注软件从需求、设计、编码、测试到维护的全过程，"
+               "强调用工程化的方法控制质量、进度和成本。")
+DESIGN_REVIEW_JSON = json.dumps({
+    "designPatterns": [{"pattern": "单例模式", "classes": ["Config"], "description": "全局唯一的配置对象"}],
+    "designIssues": [{"issue": "高耦合", "classes": ["OrderService"], "description": "直接依赖具体实现类",
+                      "severity": "medium"}],
+    "graphviz": "digraph G { OrderService -> Config; }",
+    "qualityScore": 78,
+    "suggestions": ["依赖接口而不是具体类", "拆分职责过多的服务类"],
+}, ensure_ascii=False)
+
+
+class MockConfig:
+    """模拟服务的延迟参数，默认值可用 MOCK_* 环境变量覆盖"""
+
+    def __init__(self, ttft: float = None, tokens_per_second: float = None, completion_tokens: int = None,
+                 jitter: float = None):
+        self.ttft = ttft if ttft is not None else float(os.getenv("MOCK_TTFT", 0.3))
+        self.tokens_per_second = (tokens_per_second if tokens_per_second is not None
+                                  else float(os.getenv("MOCK_TOKENS_PER_SECOND", 50)))
+        self.completion_tokens = (completion_tokens if completion_tokens is not None
+                                  else int(os.getenv("MOCK_COMPLETION_TOKENS", 200)))
+        self.jitter = jitter if jitter is not None else float(os.getenv("MOCK_JITTER", 0.1))
+
+    def delay(self, base: float) -> float:
+        """在 base 上叠加 ±jitter 比例的随机抖动"""
+        return max(base * (1 + random.uniform(-self.jitter, self.jitter)), 0.0)
+
+
+def split_tokens(text: str, count: int, size: int = 2) -> list:
+    """把 text 循环切成 count 个长度为 size 的片段，近似模型逐 token 的输出"""
+    pieces = [text[i:i + size] for i in range(0, len(text), size)]
+    return [pieces[i % len(pieces)] for i in range(count)] if pieces else []
+
+
+async def token_stream(tokens: list, config: MockConfig):
+    """按配置的首 token 延迟和速率依次产出 tokens"""
+    await asyncio.sleep(config.delay(config.ttft))
+    interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+    for token in tokens:
+        yield token
+        if interval:
+            await asyncio.sleep(config.delay(interval))
+
+
+def create_app(config: MockConfig = None) -> FastAPI:
+    config = config or MockConfig()
+    app = FastAPI()
+    seen_prefixes = set()
+
+    def usage(messages: list, completion_tokens: int) -> dict:
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 2 + 1
+        hit = len(system) // 2 if system in seen_prefixes else 0
+        seen_prefixes.add(system)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_cache_hit_tokens": hit,
+            "prompt_cache_miss_tokens": prompt_tokens - hit,
+        }
+
+    @app.post("/chat/completions")
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", "mock")
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        if "designPatterns" in system:
+            # JSON 格式的评审结果必须完整输出一遍，否则下游解析会失败
+            tokens = split_tokens(DESIGN_REVIEW_JSON, (len(DESIGN_REVIEW_JSON) + 1) // 2)
+        else:
+            tokens = split_tokens(ANSWER_TEXT,
+                                  min(config.completion_tokens, body.get("max_tokens") or config.completion_tokens))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            content = "".join([token async for token in token_stream(tokens, config)])
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": usage(messages, len(tokens)),
+            })
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def chunk(delta: dict, finish_reason=None, **extra) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            payload.update(extra)
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        async def events():
+            first = True
+            async for token in token_stream(tokens, config):
+                delta = {"role": "assistant", "content": token} if first else {"content": token}
+                first = False
+                yield chunk(delta)
+            yield chunk({}, "stop")
+            if include_usage:
+                yield ("data: " + json.dumps({
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": usage(messages, len(tokens)),
+                }) + "\n\n")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18100)
+    parser.add_argument("--ttft", type=float, help="首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, help="每秒输出的 token 数")
+    parser.add_argument("--completion-tokens", type=int, help="每次回答的 token 数")
+    parser.add_argument("--jitter", type=float, help="延迟的随机抖动比例")
+    args = parser.parse_args()
+    uvicorn.run(create_app(MockConfig(args.ttft, args.tokens_per_second, args.completion_tokens, args.jitter)),
+                host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,104 @@
+"""
+一键离线压测：启动模拟 LLM、模拟智能体、SQLite 版的 dialog.py 和 user.py，跑完压测后全部关闭。
+
+    python -m bench.run --users 20 --iterations 3 --ttft 0.3 --tokens-per-second 50
+
+除 --ttft 等模拟服务参数外，其余参数与 bench.load 相同。各服务的日志写在临时目录中，结束时打印路径。
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench import load
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_service(name: str, module: str, port: int, env: dict, workdir: str) -> subprocess.Popen:
+    log = open(os.path.join(workdir, f"{name}.log"), "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    """轮询直到服务能响应 HTTP 请求（任何状态码都算就绪）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+def main() -> int:
+    parser = load.build_parser()
+    parser.add_argument("--base-port", type=int, default=18100, help="依次占用 base-port 起的 4 个端口")
+    parser.add_argument("--ttft", type=float, default=0.3, help="模拟服务的首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    args = parser.parse_args()
+
+    llm_port, agents_port, dialog_port, user_port = range(args.base_port, args.base_port + 4)
+    agents = f"http://127.0.0.1:{agents_port}"
+    workdir = tempfile.mkdtemp(prefix="znxz-bench-")
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        DB_BACKEND="sqlite",
+        SQLITE_DIR=workdir,
+        SQLITE_SCHEMA=os.path.join(REPO_ROOT, "bench", "schema_sqlite.sql"),
+        LLM_BASE_URL=f"http://127.0.0.1:{llm_port}",
+        CHAT_AGENT_URL=f"{agents}/ask",
+        STORY_AGENT_URL=f"{agents}/generate",
+        TESTGEN_AGENT_URL=f"{agents}/api/testgen/generate",
+        LOCAL_TESTGEN_URL=f"{agents}/api/testgen/generate",
+        DESIGN_REVIEW_URL=f"{agents}/design/review",
+        CODE_REVIEW_URL=f"{agents}/code/review",
+        MOCK_TTFT=str(args.ttft),
+        MOCK_TOKENS_PER_SECOND=str(args.tokens_per_second),
+        MOCK_COMPLETION_TOKENS=str(args.completion_tokens),
+        MOCK_JITTER=str(args.jitter),
+    )
+
+    services = [
+        ("mock_llm", "bench.mock_llm:app", llm_port),
+        ("mock_agents", "bench.mock_agents:app", agents_port),
+        ("dialog", "dialog:app", dialog_port),
+        ("user", "user:app", user_port),
+    ]
+    processes = []
+    try:
+        for name, module, port in services:
+            process = start_service(name, module, port, env, workdir)
+            processes.append(process)
+            wait_ready(f"http://127.0.0.1:{port}/", process)
+
+        args.dialog_url = f"http://127.0.0.1:{dialog_port}"
+        args.user_url = f"http://127.0.0.1:{user_port}"
+        return load.report(asyncio.run(load.run(args)), args)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        print(f"service logs: {workdir}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+-- 压测用的 SQLite 表结构，对应 User/mysql.sql 和 Dialog/mysql.sql
+
+CREATE TABLE IF NOT EXISTS `user` (
+    `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+    `email` VARCHAR(100) NOT NULL UNIQUE,
+    `password` VARCHAR(255) NOT NULL,
+    `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS `session` (
+    `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+    `session_name` varchar(255) NOT NULL,
+    `user_id` INT NOT NULL,
+    `created_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS `idx_session_user_created` ON `session` (`user_id`, `created_at`);
+
+CREATE TABLE IF NOT EXISTS `dialog` (
+    `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+    `session_id` int NOT NULL,
+    `question` text NOT NULL,
+    `message` text NOT NULL,
+    `created_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS `idx_dialog_session_created` ON `dialog` (`session_id`, `created_at`);
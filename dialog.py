@@ -1,20 +1,125 @@
+import base64
+import hmac
+import time
 import json
+import os
 import re
-from typing import AsyncGenerator
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncGenerator, Optional
 
-from fastapi import FastAPI, Header, HTTPException, Depends, Request
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Header, HTTPException, Depends, Request, Query
+from fastapi.responses import StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-import mysql.connector
 import asyncio
 
 from prompt_toolkit.key_binding.bindings.named_commands import forward_word
 
 from Dialog.models import *
-from Utils.llm_api import StreamLlmApi
+from Utils.admission import AdmissionRegistry, QueueFull, admitted
+from Utils.db_pool import DbError, create_pool
+from Utils.dialog_writer import DialogWriter
+from Utils.http_pool import HttpClientRegistry, UpstreamConfig
+from Utils.java_outline import outline
+from Utils.llm_api import AsyncStreamLlmApi, prefix_cache_stats
+from Utils.metrics import REGISTRY, CONTENT_TYPE, StreamMeter, StreamMetrics, monitor_event_loop_lag
+from Utils.ndjson import aiter_records
+from Utils.response_buffer import ResponseAccumulator
+from Utils.review_cache import ReviewCache, cache_key, iter_chunks
+from Utils.routing import Route, RouteConfigError, RouteTable
+from Utils.semantic_cache import SemanticCache
+from Utils.single_flight import Flight, SingleFlight, flight_key
+from Utils.stream_hub import HubStream, StreamGone, StreamHub, sse_event, stream_resumes
+from Utils.stream_shaper import coalesce
+from Utils.tracing import (Span, child_span, configure as configure_tracing, mark_first,
+                           set_current_span, start_span, traced_stream)
+from Utils.upstream_health import CircuitOpen, UpstreamHealth
 import httpx
 
-app = FastAPI()
+# 数据库连接池配置
+db = create_pool(database="dialog_znxz", minsize=2, maxsize=20)
+# 对话记录异步批量落库
+dialog_writer = DialogWriter(db)
+
+LOCAL_TESTGEN_URL = os.getenv("LOCAL_TESTGEN_URL", "http://localhost:5000/api/testgen/generate")
+
+# 每个上游一个长连接客户端，模式 2-6 复用已建立的连接
+http_clients = HttpClientRegistry()
+http_clients.configure(LOCAL_TESTGEN_URL, UpstreamConfig(timeout=120.0))
+
+# 上游熔断：隧道断开或卡住时快速失败，后台探测恢复；路由配置了备用地址时，
+# 首字节超过 hedge_after 秒未到达会向备用地址发出对冲请求
+upstream_health = UpstreamHealth(http_clients)
+
+# 上游准入控制：限制同时进行的调用数，超出的请求按用户轮转排队，队列满时直接返回 429
+admission = AdmissionRegistry(max_concurrent=16, max_queue=64, max_queued_per_user=4)
+QUEUE_NOTICE = "# ⏳ 排队中，前面还有 {position} 个请求...\n"
+QUEUE_TIMEOUT_NOTICE = "# ❌ 排队超时，请稍后重试\n"
+
+# 测试用例生成结果缓存：学生反复提交相同代码时直接重放，不再请求远程智能体
+TESTGEN_PROMPT_VERSION = "v1"
+testgen_cache = ReviewCache(disk_dir=os.getenv("TESTGEN_CACHE_DIR"))
+
+# 模式 1 的近似问题回答缓存：同一门课的学生换个说法问同一个问题时直接复用回答，相似度阈值在路由表中配置
+answer_cache = SemanticCache()
+
+
+def apply_routes(table: dict):
+    """路由表加载或变更后，同步各上游的连接池、熔断、对冲和准入参数"""
+    for route in table.values():
+        admission.configure(route.admission_name, **route.admission_limits())
+        if route.handler == "llm":
+            if route.cache.get("type") == "semantic":
+                answer_cache.threshold = float(route.cache.get("threshold", answer_cache.threshold))
+            continue
+        for url in route.urls:
+            http_clients.configure(url, route.upstream_config(), pool=route.pool_name)
+            upstream_health.configure(url, slow_call_seconds=route.slow_call_seconds,
+                                      failure_statuses=frozenset(route.failure_statuses))
+        upstream_health.configure_standby(route.url, route.standby_url, hedge_after=route.hedge_after)
+
+
+# 模式路由表：各模式的处理方式、上游地址、超时、并发上限、缓存和分片合并参数，修改文件后自动生效
+routes = RouteTable(os.getenv("DIALOG_ROUTES", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            "Dialog", "routes.json")),
+                    on_change=apply_routes)
+
+# 可续传的流式输出：生成在后台进行，断线的客户端凭 X-Stream-Id 和 Last-Event-ID 重连续传
+stream_hub = StreamHub(buffer_size=4096, max_chars=int(os.getenv("STREAM_BUFFER_CHARS", 64 * 1024)),
+                       grace_period=float(os.getenv("STREAM_RESUME_GRACE", 60.0)))
+
+# 相同请求合并：老师布置练习后大量学生同时提交相同的问题或代码时，只向上游发起一次调用
+single_flight = SingleFlight()
+
+# 运行指标，通过 /metrics 以 Prometheus 格式导出
+dialog_requests = REGISTRY.counter("dialog_requests_total", "Dialog requests by mode", ("mode",))
+http_request_latency = REGISTRY.histogram("http_request_duration_seconds",
+                                          "Time until the response starts, by route", ("method", "path", "status"))
+upstream_responses = REGISTRY.counter("upstream_responses_total",
+                                      "Responses from remote agents by upstream and status code", ("upstream", "status"))
+upstream_latency = REGISTRY.histogram("upstream_response_seconds",
+                                      "Time until a remote agent returns response headers", ("upstream",))
+stream_metrics = StreamMetrics("dialog")
+# 链路追踪，导出目标由 TRACE_FILE / TRACE_OTLP_URL 环境变量指定
+configure_tracing("dialog")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db.open()
+    await dialog_writer.start()
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    upstream_probe = asyncio.create_task(upstream_health.probe_loop())
+    yield
+    upstream_probe.cancel()
+    lag_monitor.cancel()
+    await stream_hub.aclose()
+    await http_clients.aclose()
+    await dialog_writer.stop()
+    await db.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 配置 CORS 中间件
 app.add_middleware(
@@ -28,16 +133,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Stream-Id"],
 )
 
-# 数据库连接配置
-connection = mysql.connector.connect(
-    user="root",
-    password="123456",
-    host="localhost",
-    database="dialog_znxz")
 
-model = StreamLlmApi()
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start_time = time.monotonic()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    http_request_latency.observe(time.monotonic() - start_time,
+                                 method=request.method, path=path, status=response.status_code)
+    return response
+
+model = AsyncStreamLlmApi()
 
 
 async def verify_token(request: Request):
@@ -49,142 +159,236 @@ async def verify_token(request: Request):
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
-async def forward_to_remote0(url: str, payload_name: str, question: str, session_id: int, extra_params: dict = None) -> \
-AsyncGenerator[str, None]:
+# 运维接口（如重新加载路由表）的管理令牌，通过 X-Admin-Token 请求头提供；未设置时这些接口不可用
+ADMIN_TOKEN = os.getenv("DIALOG_ADMIN_TOKEN", "")
+
+
+async def verify_admin(x_admin_token: Optional[str] = Header(None)):
+    """
+    Verify the admin token of operational endpoints.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def record_upstream(url: str, status_code: int, request_time: float):
+    """记录远程智能体的响应状态码和响应头到达耗时"""
+    upstream_responses.inc(upstream=url, status=status_code)
+    upstream_latency.observe(time.monotonic() - request_time, upstream=url)
+
+
+def stream_response(route: Route, source, start_time: float, trace: Span = None, ticket=None,
+                    owner=None, sse: bool = False, flight: Flight = None,
+                    meter: StreamMeter = None) -> StreamingResponse:
+    """
+    为各模式的输出流加上指标统计和按路由配置的分片合并，交给 stream_hub 在后台生成；流结束时结束请求的 trace。
+
+    传入 ticket 时先排队等待上游名额，排队期间向客户端输出当前位置。sse 为真时按 text/event-stream
+    输出带事件编号的分片，否则输出纯文本；两种方式都可以凭响应头中的 X-Stream-Id 断线重连。
+    传入 flight 时相同的请求可以加入这次生成，生成结束（包括异常中断）后不再接受加入。
+    meter 为处理函数计数上游内容用的 StreamMeter，首分片延迟和吞吐不包括连接、排队等状态行。
     """
-    通用的远程请求转发函数，支持任何远程服务器URL
+    if ticket is not None:
+        source = admitted(ticket, source, QUEUE_NOTICE, QUEUE_TIMEOUT_NOTICE)
+    if trace is not None:
+        source = traced_stream(source, trace)
+    stream = stream_hub.start(coalesce(stream_metrics.wrap(source, route.mode, start_time, meter), route.shaping), owner)
+    if flight is not None:
+        flight.stream = stream
+        stream.task.add_done_callback(lambda _: single_flight.finish(flight))
+    return replay_response(stream, 0, sse)
+
+
+def replay_response(stream: HubStream, last_event_id: int, sse: bool, trace: Span = None) -> StreamingResponse:
+    """订阅 stream 中 last_event_id 之后的输出；传入 trace 时在输出结束后结束它"""
+    async def render():
+        try:
+            async for event_id, chunk in stream.subscribe(last_event_id):
+                yield sse_event(event_id, chunk) if sse else chunk
+        except StreamGone:
+            # 客户端读得太慢，落后的部分已被挤出缓冲区
+            notice = "# ❌ 输出缓冲区已溢出，请重新提问\n"
+            yield sse_event(stream.last_id, notice, "error") if sse else notice
+            return
+        finally:
+            if trace is not None:
+                trace.end()
+        if sse:
+            yield sse_event(stream.last_id, stream.error or "", "end")
+        elif stream.error:
+            yield f"\n# ❌ 生成中断: {stream.error}\n"
+
+    return StreamingResponse(render(), media_type="text/event-stream" if sse else "text/plain",
+                             headers={"X-Stream-Id": stream.id, "Cache-Control": "no-cache"})
+
+
+def wants_sse(request: Request) -> bool:
+    return "text/event-stream" in request.headers.get("accept", "")
+
+
+def persist_dialog(session_id: int, question: str, message: str, trace: Span = None, flight: Flight = None):
+    """写入对话记录（后台批量）；合并了相同请求时，为每个共享本次结果的会话各写一条"""
+    sessions = single_flight.finish(flight) if flight is not None else [session_id]
+    for session in sessions:
+        dialog_writer.submit(session, question, message, trace)
+
+
+async def forward_to_remote0(url: str, payload_name: str, question: str, session_id: int, extra_params: dict = None,
+                            trace: Span = None, flight: Flight = None, meter: StreamMeter = None,
+                            pool: str = None) -> AsyncGenerator[str, None]:
     """
+    通用的远程请求转发函数，支持任何远程服务器URL；pool 为所用连接池（路由的 pool_name）
+    """
+    meter = meter or StreamMeter()
     payload = {payload_name: question}
     if extra_params:
         payload.update(extra_params)
 
     yield f"# 正在连接到 {url}...\n"
 
-    full_response = ""
+    full_response = ResponseAccumulator()
+    span = child_span(trace, "upstream.request", upstream=url)
+    error = None
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            async with client.stream('POST', url, json=payload) as response:
-                if response.status_code != 200:
-                    error_msg = f"# ❌ 远程服务器返回错误状态码: {response.status_code}\n"
-                    full_response += error_msg
-                    yield error_msg
-                    return
-
-                yield "# ✅ 已连接，接收数据中...\n\n"
-
-                async for chunk in response.aiter_text():
-                    if chunk:
-                        try:
-                            # 尝试解析JSON
-                            json_data = json.loads(chunk)
-
-                            # 格式化JSON为更易读的文本
-                            formatted_text = ""
-
-                            # 如果是字典类型且有特定的键
-                            if isinstance(json_data, dict):
-                                if "review_result" in json_data:
-                                    formatted_text = json_data["review_result"]
-                                elif "generated_content" in json_data:
-                                    formatted_text = json_data["generated_content"]
-                                elif "error" in json_data:
-                                    formatted_text = f"错误: {json_data['error']}"
-                                else:
-                                    # 将JSON转为格式化字符串
-                                    formatted_text = json.dumps(json_data, ensure_ascii=False, indent=2)
-                            else:
-                                # 非字典类型，直接转换
-                                formatted_text = json.dumps(json_data, ensure_ascii=False, indent=2)
-
-                            full_response += formatted_text
-                            yield formatted_text
-                        except json.JSONDecodeError:
-                            # 如果不是JSON，直接输出
-                            full_response += chunk
-                            yield chunk
-
-                        await asyncio.sleep(0.01)
+        request_time = time.monotonic()
+        async with await upstream_health.open_stream(url, payload, span, pool) as response:
+            record_upstream(response.url, response.status_code, request_time)
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code != 200:
+                error_msg = f"# ❌ 远程服务器返回错误状态码: {response.status_code}\n"
+                full_response.append(error_msg)
+                yield error_msg
+                return
+
+            yield "# ✅ 已连接，接收数据中...\n\n"
+
+            async for record in aiter_records(response.aiter_text()):
+                formatted_text = format_remote_record(record)
+                if formatted_text:
+                    full_response.append(formatted_text)
+                    yield meter.content(formatted_text)
     except Exception as e:
+        upstream_responses.inc(upstream=url, status="circuit_open" if isinstance(e, CircuitOpen) else "error")
+        error = str(e)
         error_msg = f"# ❌ 远程请求失败: {str(e)}\n"
-        full_response += error_msg
+        full_response.append(error_msg)
         yield error_msg
+    finally:
+        span.end(error=error)
 
     # 保存完整响应到数据库
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("INSERT INTO dialog (session_id, question, message) VALUES (%s, %s, %s)",
-                           (session_id, question, full_response))
-            connection.commit()
+        persist_dialog(session_id, question, full_response.finish(), trace, flight)
     except Exception as e:
         yield f"# ⚠️ 警告：无法保存对话记录: {str(e)}\n"
 
 
-async def forward_to_remote(url: str, payload_name: str, question: str, session_id: int, extra_params: dict = None) -> AsyncGenerator[str, None]:
+async def forward_to_remote(url: str, payload_name: str, question: str, session_id: int, extra_params: dict = None,
+                           trace: Span = None, flight: Flight = None,
+                           meter: StreamMeter = None, pool: str = None) -> AsyncGenerator[str, None]:
     """
-    通用的远程请求转发函数，支持任何远程服务器URL
+    通用的远程请求转发函数，支持任何远程服务器URL；pool 为所用连接池（路由的 pool_name）
     """
+    meter = meter or StreamMeter()
     payload = {payload_name: question}
     if extra_params:
         payload.update(extra_params)
 
     yield f"# 正在连接到 {url}...\n"
 
-    full_response = ""
+    full_response = ResponseAccumulator()
+    span = child_span(trace, "upstream.request", upstream=url)
+    error = None
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            async with client.stream('POST', url, json=payload) as response:
-                if response.status_code != 200:
-                    error_msg = f"# ❌ 远程服务器返回错误状态码: {response.status_code}\n"
-                    full_response += error_msg
-                    yield error_msg
-                    return
-
-                yield "# ✅ 已连接，接收数据中...\n\n"
-
-                async for chunk in response.aiter_text():
-                    if chunk:
-                        try:
-                            # 尝试解析JSON
-                            json_data = json.loads(chunk)
-
-                            # 如果是执行结果，直接提取review_result
-                            if "review_result" in json_data:
-                                review_result = json_data["review_result"]
-                                # 不再单独输出原始JSON，而是格式化后的内容
-                                formatted_chunk = format_review_result(review_result)
-                                full_response += formatted_chunk
-                                yield formatted_chunk
-                            # 如果是流式块，提取chunk字段
-                            elif "chunk" in json_data:
-                                chunk_content = json_data["chunk"]
-                                full_response += chunk_content
-                                yield chunk_content
-                            # 其他情况，保持原样输出
-                            else:
-                                # 将JSON转换为可读格式
-                                formatted_json = json.dumps(json_data, ensure_ascii=False, indent=2)
-                                full_response += formatted_json
-                                yield formatted_json
-                        except json.JSONDecodeError:
-                            # 如果不是JSON，直接输出
-                            full_response += chunk
-                            yield chunk
-
-                        await asyncio.sleep(0.01)
+        request_time = time.monotonic()
+        async with await upstream_health.open_stream(url, payload, span, pool) as response:
+            record_upstream(response.url, response.status_code, request_time)
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code != 200:
+                error_msg = f"# ❌ 远程服务器返回错误状态码: {response.status_code}\n"
+                full_response.append(error_msg)
+                yield error_msg
+                return
+
+            yield "# ✅ 已连接，接收数据中...\n\n"
+
+            streamed = False
+            async for record in aiter_records(response.aiter_text()):
+                formatted_chunk = format_review_record(record, streamed)
+                if isinstance(record, dict) and "chunk" in record:
+                    streamed = True
+                if formatted_chunk:
+                    full_response.append(formatted_chunk)
+                    yield meter.content(formatted_chunk)
     except Exception as e:
+        upstream_responses.inc(upstream=url, status="circuit_open" if isinstance(e, CircuitOpen) else "error")
+        error = str(e)
         error_msg = f"# ❌ 远程请求失败: {str(e)}\n"
-        full_response += error_msg
+        full_response.append(error_msg)
         yield error_msg
+    finally:
+        span.end(error=error)
 
     # 保存完整响应到数据库
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("INSERT INTO dialog (session_id, question, message) VALUES (%s, %s, %s)",
-                           (session_id, question, full_response))
-            connection.commit()
+        persist_dialog(session_id, question, full_response.finish(), trace, flight)
     except Exception as e:
         yield f"# ⚠️ 警告：无法保存对话记录: {str(e)}\n"
 
+
+def format_remote_record(record) -> str:
+    """
+    把通用远程服务返回的一条记录转换为可读文本
+    """
+    # 非JSON的行直接输出
+    if isinstance(record, str):
+        return record
+
+    # 如果是字典类型且有特定的键
+    if isinstance(record, dict):
+        if "review_result" in record:
+            return record["review_result"]
+        if "generated_content" in record:
+            return record["generated_content"]
+        if "error" in record:
+            return f"错误: {record['error']}"
+
+    # 其他情况将JSON转为格式化字符串
+    return json.dumps(record, ensure_ascii=False, indent=2)
+
+
+def format_review_record(record, streamed: bool) -> str:
+    """
+    把评审服务返回的一条记录转换为输出文本。
+
+    流式评审依次返回 stream_started / chunk / completed 记录，出错时返回 stream_error；
+    非流式评审返回带 review_result 的单条记录。streamed 表示此前是否已经输出过 chunk。
+    """
+    if isinstance(record, str):
+        return record
+    if not isinstance(record, dict):
+        return json.dumps(record, ensure_ascii=False, indent=2)
+
+    status = record.get("status")
+    # 如果是流式块，提取chunk字段
+    if "chunk" in record:
+        return record["chunk"]
+    if status == "stream_started":
+        return ""
+    if status == "completed":
+        # 内容已经逐块输出过时，完成记录只作为结束标记
+        return "" if streamed else format_review_result(record.get("full_result", ""))
+    if status == "stream_error":
+        return f"\n# ❌ {record.get('error', '评审流中断')}\n"
+    # 如果是执行结果，直接提取review_result并格式化
+    if "review_result" in record:
+        return format_review_result(record["review_result"])
+    # 其他情况将JSON转换为可读格式
+    return json.dumps(record, ensure_ascii=False, indent=2)
+
+
 # 添加一个新函数来格式化代码评审结果
 def format_review_result(review_result: str) -> str:
     """
@@ -249,49 +453,72 @@ def format_review_result(review_result: str) -> str:
         return f"格式化评审结果时出错: {str(e)}\n\n原始内容:\n{review_result}"
 
 
-async def forward_test_request(url: str, test_params: dict, session_id: int) -> AsyncGenerator[str, None]:
+async def forward_test_request(url: str, test_params: dict, session_id: int,
+                               trace: Span = None, use_cache: bool = True,
+                               flight: Flight = None, meter: StreamMeter = None,
+                               pool: str = None) -> AsyncGenerator[str, None]:
     """
     转发测试用例生成请求的专用函数
     """
+    meter = meter or StreamMeter()
+    key = cache_key(test_params["javaCode"], TESTGEN_PROMPT_VERSION, url,
+                    f'{test_params["targetClass"]}.{test_params["methodName"]}')
+    cached = testgen_cache.get(key) if use_cache else None
+    if cached is not None:
+        if trace is not None:
+            trace.add_event("testgen_cache_hit")
+        yield "# ✅ 命中缓存，直接返回测试用例...\n\n"
+        for chunk in iter_chunks(cached, 256):
+            yield meter.content(chunk)
+        try:
+            persist_dialog(session_id, json.dumps(test_params), cached, trace, flight)
+        except Exception as e:
+            yield f"# ⚠️ 警告：无法保存测试用例记录: {str(e)}\n"
+        return
+
     yield f"# 正在连接到测试用例生成服务 {url}...\n"
 
-    full_response = ""
+    full_response = ResponseAccumulator()
+    span = child_span(trace, "upstream.request", upstream=url)
+    error = None
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            async with client.stream('POST', url, json=test_params) as response:
-                if response.status_code != 200:
-                    error_msg = f"# ❌ 测试用例生成服务返回错误状态码: {response.status_code}\n"
-                    full_response += error_msg
-                    yield error_msg
-                    return
-
-                yield "# ✅ 已连接，正在生成测试用例...\n\n"
-
-                async for chunk in response.aiter_text():
-                    if chunk:
-                        try:
-                            # 尝试解析JSON响应
-                            json_data = json.loads(chunk)
-                            # 格式化输出JSON响应
-                            formatted_output = format_test_response(json_data)
-                            full_response += formatted_output
-                            yield formatted_output
-                        except json.JSONDecodeError:
-                            # 如果不是JSON，直接输出
-                            full_response += chunk
-                            yield chunk
-                        await asyncio.sleep(0.01)
+        request_time = time.monotonic()
+        async with await upstream_health.open_stream(url, test_params, span, pool) as response:
+            record_upstream(response.url, response.status_code, request_time)
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code != 200:
+                error_msg = f"# ❌ 测试用例生成服务返回错误状态码: {response.status_code}\n"
+                full_response.append(error_msg)
+                yield error_msg
+                return
+
+            yield "# ✅ 已连接，正在生成测试用例...\n\n"
+
+            async for record in aiter_records(response.aiter_text()):
+                if isinstance(record, dict):
+                    # 格式化输出JSON响应
+                    formatted_output = format_test_response(record)
+                else:
+                    # 如果不是JSON，直接输出
+                    formatted_output = record
+                full_response.append(formatted_output)
+                yield meter.content(formatted_output)
+
+            # 只缓存完整成功的结果
+            if use_cache:
+                testgen_cache.set(key, full_response.getvalue())
     except Exception as e:
+        upstream_responses.inc(upstream=url, status="circuit_open" if isinstance(e, CircuitOpen) else "error")
+        error = str(e)
         error_msg = f"# ❌ 测试用例生成请求失败: {str(e)}\n"
-        full_response += error_msg
+        full_response.append(error_msg)
         yield error_msg
+    finally:
+        span.end(error=error)
 
     # 保存完整响应到数据库
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("INSERT INTO dialog (session_id, question, message) VALUES (%s, %s, %s)",
-                           (session_id, json.dumps(test_params), full_response))
-            connection.commit()
+        persist_dialog(session_id, json.dumps(test_params), full_response.finish(), trace, flight)
     except Exception as e:
         yield f"# ⚠️ 警告：无法保存测试用例记录: {str(e)}\n"
 
@@ -380,14 +607,21 @@ def format_test_response(json_data: dict) -> str:
     return result
 
 def extract_class_name(java_code: str) -> str:
-    """从Java代码中提取类名"""
-    match = re.search(r'class\s+(\w+)', java_code)
-    return match.group(1) if match else "UnknownClass"
+    """从Java代码的大纲中取主类型名（第一个 public 顶层类型），注释和字符串中的 class 不会被误认"""
+    primary = outline(java_code).primary_type()
+    return primary.name if primary else "UnknownClass"
 
 def extract_method_name(java_code: str) -> str:
-    """从Java代码中提取方法名"""
-    match = re.search(r'\b\w+\s+(\w+)\s*\(', java_code)
-    return match.group(1) if match else "unknownMethod"
+    """从Java代码的大纲中取待测方法名：主类型中第一个非构造器方法，没有时依次查找其他类型和不在类型中的方法"""
+    code_outline = outline(java_code)
+    primary = code_outline.primary_type()
+    candidates = [primary] if primary else []
+    candidates += [java_type for java_type in code_outline.iter_types() if java_type is not primary]
+    for methods in [java_type.methods for java_type in candidates] + [code_outline.methods]:
+        method = next((method for method in methods if not method.constructor), None)
+        if method is not None:
+            return method.name
+    return "unknownMethod"
 
 async def call_test_agent(code: str) -> dict:
     """调用测试用例智能体 (端口5000)"""
@@ -396,18 +630,24 @@ async def call_test_agent(code: str) -> dict:
         class_name = extract_class_name(code)
         method_name = extract_method_name(code)
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "http://localhost:5000/api/testgen/generate",
-                json={
-                    "javaCode": code,
-                    "targetClass": class_name,
-                    "methodName": method_name
-                },
-                timeout=120.0
-            )
-            response.raise_for_status()
-            return response.json()
+        key = cache_key(code, TESTGEN_PROMPT_VERSION, LOCAL_TESTGEN_URL, f"{class_name}.{method_name}")
+        cached = testgen_cache.get(key)
+        if cached is not None:
+            return cached
+
+        client = http_clients.get(LOCAL_TESTGEN_URL)
+        response = await client.post(
+            LOCAL_TESTGEN_URL,
+            json={
+                "javaCode": code,
+                "targetClass": class_name,
+                "methodName": method_name
+            }
+        )
+        response.raise_for_status()
+        result = response.json()
+        testgen_cache.set(key, result)
+        return result
     except httpx.HTTPStatusError as e:
         return {"error": f"HTTP error: {e.response.status_code}"}
     except httpx.RequestError as e:
@@ -415,16 +655,247 @@ async def call_test_agent(code: str) -> dict:
     except Exception as e:
         return {"error": f"意外错误: {str(e)}"}
 
+async def replay_answer(answer: str) -> AsyncGenerator[str, None]:
+    """把缓存的完整回答按流式接口重放"""
+    for chunk in iter_chunks(answer, 32):
+        yield chunk
+
+
+def route_llm(route: Route, data: dict, question: str, session_id: int, trace: Span, hit=None,
+              flight: Flight = None, meter: StreamMeter = None):
+    """直接调用 LLM API 的模式；hit 为命中的近似问题缓存 (回答, 相似度)"""
+    meter = meter or StreamMeter()
+    if hit is not None:
+        # 命中近似问题缓存，直接重放历史回答
+        trace.add_event("answer_cache_hit", similarity=hit[1])
+    full_response = ResponseAccumulator()
+
+    async def event_generator():
+        llm_span = None
+        error = None
+        try:
+            if hit is not None:
+                stream_generator = replay_answer(hit[0])
+            else:
+                # 获得名额后才调用 LLM API 获取回答
+                llm_span = trace.child("llm.stream")
+                stream_generator = mark_first(await model.znxz(question), llm_span, "first_token")
+            async for chunk in stream_generator:
+                full_response.append(chunk)
+                yield meter.content(chunk)
+        except Exception as e:
+            error = str(e)
+            error_msg = f"# ❌ 大模型请求失败: {error}\n"
+            full_response.append(error_msg)
+            yield error_msg
+        finally:
+            if llm_span is not None:
+                llm_span.end(error=error)
+
+        # 传输完毕后存入对话历史（后台批量写入），失败的回答不进入缓存
+        answer = full_response.finish()
+        if hit is None and error is None and route.cache_enabled():
+            answer_cache.store(question, answer)
+        persist_dialog(session_id, question, answer, trace, flight)
+
+    return event_generator()
+
+
+def route_ndjson(route: Route, data: dict, question: str, session_id: int, trace: Span, hit=None,
+                 flight: Flight = None, meter: StreamMeter = None):
+    """转发到返回 NDJSON 流的远程智能体，format 为 review 时按评审结果格式化"""
+    forward = forward_to_remote if route.format == "review" else forward_to_remote0
+    return forward(route.url, route.payload_name, question, session_id, extra_params=route.extra_params,
+                   trace=trace, flight=flight, meter=meter, pool=route.pool_name)
+
+
+def route_testgen(route: Route, data: dict, question: str, session_id: int, trace: Span, hit=None,
+                  flight: Flight = None, meter: StreamMeter = None):
+    """转发测试用例生成请求，未提供类名和方法名时从代码中提取"""
+    java_code = question
+    target_class = data.get("targetClass", "")
+    method_name = data.get("methodName", "")
+
+    if not java_code:
+        raise HTTPException(status_code=400, detail="Java代码不能为空")
+
+    # 如果未提供类名和方法名，尝试从代码中提取
+    if not target_class:
+        target_class = extract_class_name(java_code)
+        print(target_class)
+    if not method_name:
+        method_name = extract_method_name(java_code)
+        print(method_name)
+
+    # 创建JSON格式的测试参数
+    test_params = {
+        "javaCode": java_code,
+        "targetClass": target_class,
+        "methodName": method_name
+    }
+    return forward_test_request(route.url, test_params, session_id, trace, use_cache=route.cache_enabled(),
+                                flight=flight, meter=meter, pool=route.pool_name)
+
+
+# 路由表中 handler 字段对应的处理函数
+ROUTE_HANDLERS = {
+    "llm": route_llm,
+    "ndjson": route_ndjson,
+    "testgen": route_testgen,
+}
+
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Export runtime metrics in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/admission_stats")
+async def get_admission_stats():
+    """
+    Report in-flight calls and queue lengths of every upstream.
+    """
+    return admission.stats()
+
+
+@app.get("/upstream_health")
+async def get_upstream_health():
+    """
+    Report the circuit breaker state of every remote agent.
+    """
+    return upstream_health.stats()
+
+
+@app.get("/dialog/stream/{stream_id}",
+         dependencies=[Depends(verify_token)])
+async def resume_dialog(stream_id: str, request: Request, last_event_id: Optional[int] = Query(None)):
+    """
+    Reconnect to a dialog answer that is still being generated or finished recently.
+
+    Resumes after the Last-Event-ID header (or the last_event_id query parameter);
+    without either the whole answer is replayed from the start.
+    """
+    stream = stream_hub.get(stream_id)
+    if stream is None or request.headers.get("Authorization") not in {str(owner) for owner in stream.owners}:
+        stream_resumes.inc(result="not_found")
+        raise HTTPException(status_code=404, detail="stream not found or expired")
+    header = request.headers.get("last-event-id")
+    if last_event_id is None:
+        try:
+            last_event_id = int(header) if header else 0
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid Last-Event-ID")
+    if not stream.can_resume(last_event_id):
+        stream_resumes.inc(result="gone")
+        raise HTTPException(status_code=410, detail="requested events are no longer buffered")
+    stream_resumes.inc(result="ok")
+    return replay_response(stream, last_event_id, wants_sse(request))
+
+
+@app.get("/stream_stats")
+async def get_stream_stats():
+    """
+    Report the resumable streams kept in memory.
+    """
+    return {**stream_hub.stats(), "single_flight": single_flight.stats()}
+
+
+@app.get("/routes")
+async def get_routes():
+    """
+    List the mode routing table currently in effect.
+    """
+    return {mode: route.to_dict() for mode, route in routes.routes().items()}
+
+
+@app.post("/routes/reload",
+          dependencies=[Depends(verify_admin)])
+async def reload_routes():
+    """
+    Reload the routing table from disk without waiting for the file change check.
+    """
+    try:
+        table = routes.reload()
+    except (OSError, RouteConfigError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"routes": sorted(table)}
+
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    """
+    Report hit statistics of the local caches and of the provider's prompt prefix cache.
+    """
+    return {
+        "answer_cache": answer_cache.stats(),
+        "testgen_cache": testgen_cache.stats(),
+        "prefix_cache": prefix_cache_stats.stats(),
+    }
+
+
+# 历史记录分页的单页上限
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """把一页最后一行的 (created_at, id) 编码为不透明的游标"""
+    raw = f"{created_at:%Y-%m-%d %H:%M:%S}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S"), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_page(sql: str, args: list, after: Optional[str], limit: Optional[int]) -> tuple:
+    """
+    在按 (created_at, id) 排序的查询上追加 keyset 分页条件。
+
+    从游标位置继续向后读取，不使用 OFFSET，翻到多深都只扫描一页的数据。
+    多取一行用于判断是否还有下一页。
+    """
+    args = list(args)
+    if after:
+        created_at, row_id = decode_cursor(after)
+        sql += " AND (created_at > %s OR (created_at = %s AND id > %s))"
+        args += [created_at, created_at, row_id]
+    sql += " ORDER BY created_at, id"
+    if limit:
+        sql += " LIMIT %s"
+        args.append(limit + 1)
+    return sql, args
+
+
+def next_page_cursor(results: list, limit: Optional[int]) -> tuple:
+    """截掉多取的一行，并返回下一页的游标（没有下一页时为 None）"""
+    if not limit or len(results) <= limit:
+        return results, None
+    results = results[:limit]
+    last = results[-1]
+    return results, encode_cursor(last[-1], last[0])
+
+
 @app.get("/session_history",
          dependencies=[Depends(verify_token)])
-async def get_session_history(request: Request):
+async def get_session_history(request: Request,
+                              limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                              after: Optional[str] = None):
     """
     Retrieve the session history.
+
+    Pass `limit` to page through the history; `next_cursor` of the result is the `after` of the next page.
     """
     # 这里可以使用验证后的 Request 对象
     authorization = request.headers.get("Authorization")
@@ -432,51 +903,64 @@ async def get_session_history(request: Request):
     try:
         user_id = int(authorization)  # type: ignore
 
-        with connection.cursor() as cursor:
-            # 查询用户的对话历史
-            cursor.execute(
-                "SELECT id, session_name FROM session WHERE user_id = %s ORDER BY created_at", (user_id,))
-            results = cursor.fetchall()
+        # 查询用户的对话历史
+        sql, args = keyset_page(
+            "SELECT id, session_name, created_at FROM session WHERE user_id = %s", [user_id], after, limit)
+        results, next_cursor = next_page_cursor(await db.fetchall(sql, args), limit)
 
-            session_history = []
-            if not results:
-                return Result(type=1, message="No Session history found", session_history=[])
+        session_history = []
+        if not results:
+            return Result(type=1, message="No Session history found", session_history=[])
 
-            # 将查询结果转换为字典列表
-            for row in results:
-                session_history.append(
-                    # type: ignore
-                    # type: ignore
-                    Session(session_id=row[0], session_name=row[1]))
+        # 将查询结果转换为字典列表
+        for row in results:
+            session_history.append(
+                # type: ignore
+                # type: ignore
+                Session(session_id=row[0], session_name=row[1], created_at=row[2]))
 
-            return Result(type=1, message="Dialog history retrieved successfully", session_history=session_history)
+        return Result(type=1, message="Dialog history retrieved successfully", session_history=session_history,
+                      next_cursor=next_cursor)
     except (ValueError, TypeError):
         raise HTTPException(status_code=400, detail="Invalid user ID format")
+    except DbError as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/dialog_history/{session_id}",
          dependencies=[Depends(verify_token)])
-async def get_dialog_history(session_id: int):
+async def get_dialog_history(session_id: int,
+                             limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                             after: Optional[str] = None,
+                             lite: bool = False):
     """
     Retrieve the dialog history for a specific session.
+
+    With `lite=true` only ids, question titles and timestamps are returned, without the answers.
     """
     try:
-        with connection.cursor() as cursor:
-            # 查询指定会话的对话历史
-            cursor.execute(
-                "SELECT id, question, message FROM dialog WHERE session_id = %s ORDER BY created_at", (session_id,))
-            results = cursor.fetchall()
-
-            dialog_history = []
-            if not results:
-                return Result(type=2, message="No Dialog history found", dialog_history=[])
-
-            # 将查询结果转换为字典列表
-            for row in results:
+        # 查询指定会话的对话历史，精简模式只取问题前 50 个字符作为标题
+        columns = "id, LEFT(question, 50), created_at" if lite else "id, question, message, created_at"
+        sql, args = keyset_page(
+            f"SELECT {columns} FROM dialog WHERE session_id = %s", [session_id], after, limit)
+        results, next_cursor = next_page_cursor(await db.fetchall(sql, args), limit)
+
+        dialog_history = []
+        if not results:
+            return Result(type=2, message="No Dialog history found", dialog_history=[])
+
+        # 将查询结果转换为字典列表
+        for row in results:
+            if lite:
+                dialog_history.append(Dialog(dialog_id=row[0], question=row[1], created_at=row[2]))
+            else:
                 dialog_history.append(
-                    Dialog(dialog_id=row[0], question=row[1], dialog_content=row[2]))
+                    Dialog(dialog_id=row[0], question=row[1], dialog_content=row[2], created_at=row[3]))
 
-            return Result(type=2, message="Dialog history retrieved successfully", dialog_history=dialog_history)
+        return Result(type=2, message="Dialog history retrieved successfully", dialog_history=dialog_history,
+                      next_cursor=next_cursor)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -487,6 +971,12 @@ async def ask(request: Request):
     """
     Handle a dialog request.
     """
+    start_time = time.monotonic()
+    # 延续前端传来的 trace；之后本请求发出的 httpx 调用都会带上 traceparent
+    trace = start_span("dialog.ask", request.headers.get("traceparent"))
+    set_current_span(trace)
+    ticket = None
+    flight = None
     try:
         authorization = request.headers.get("Authorization")
         user_id = int(authorization)  # type: ignore
@@ -494,6 +984,11 @@ async def ask(request: Request):
         data = await request.json()
 
         mode = data.get("mode")
+        trace.set_attribute("mode", mode)
+        route = routes.get(mode)
+        dialog_requests.inc(mode=mode if route is not None else "unknown")
+        if route is None:
+            raise HTTPException(status_code=400, detail=f"unknown mode: {mode}")
         question = data.get("question")
         if not question:
             raise HTTPException(
@@ -501,110 +996,54 @@ async def ask(request: Request):
 
         session_id = data.get("session_id")
 
-        if session_id == -1:
-            # 获取数据库中最大的 session_id
-            max_session_id = 0
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT MAX(id) FROM session")
-                max_session_id = cursor.fetchone()[0] or 0
-            session_id = max_session_id + 1  # type: ignore
+        # 先申请上游名额，过载时在创建会话之前就拒绝；命中回答缓存或有相同请求正在生成时不需要调用上游
+        hit = answer_cache.lookup(question) if route.handler == "llm" and route.cache_enabled() else None
+        key = None
+        if hit is None and route.single_flight:
+            key = flight_key(mode, question, data.get("targetClass", ""), data.get("methodName", ""))
+        if hit is None and not (key is not None and single_flight.running(key)):
+            ticket = admission.get(route.admission_name).enqueue(user_id)
 
+        if session_id == -1:
             session_name = question[:10] if len(question) > 10 else question
-            # 插入新的会话记录
-            with connection.cursor() as cursor:
-                cursor.execute(
-                    "INSERT INTO session (id, session_name, user_id) VALUES (%s, %s, %s)",
-                    (session_id, session_name, user_id))
-                connection.commit()
-
-        if mode == "1":
-            print("mode1")
-            # 调用 LLM API 获取回答
-            stream_generator = model.znxz(question)
-            full_response = ""
-
-            async def event_generator():
-                nonlocal full_response
-                for chunk in stream_generator:
-                    full_response += chunk
-                    yield chunk
-                    # 添加短暂等待让事件循环有机会处理其他任务
-                    await asyncio.sleep(0.01)
-
-                # 传输完毕后存入对话历史
-                with connection.cursor() as cursor:
-                    cursor.execute("INSERT INTO dialog (session_id, question, message) VALUES (%s, %s, %s)",
-                                   (session_id, question, full_response))
-                    connection.commit()
-
-            # Use StreamingResponse to stream the output to the client
-            return StreamingResponse(event_generator(), media_type="text/plain")
-
-        if mode == "2":
-            print("mode2")
-            return StreamingResponse(
-                forward_to_remote0("http://24f2eeeb.r5.cpolar.top/ask","question", question, session_id),
-                media_type="text/plain"
-            )
-
-        # 任务路由
-        if mode == "3":  # 使用字符串匹配，便于扩展
-            print("mode3")  
-            return StreamingResponse(
-                forward_to_remote0("http://5e74c8f1.r5.cpolar.top/generate","user_story", question, session_id),
-                media_type="text/plain"
-            )
-
-        if mode == "4":
-            print("mode4")
-            # 获取Java相关参数
-            java_code = question
-            target_class = data.get("targetClass", "")
-            method_name = data.get("methodName", "")
-
-            if not java_code:
-                raise HTTPException(status_code=400, detail="Java代码不能为空")
-
-            # 如果未提供类名和方法名，尝试从代码中提取
-            if not target_class:
-                target_class = extract_class_name(java_code)
-                print(target_class)
-            if not method_name:
-                method_name = extract_method_name(java_code)
-                print(method_name)
-
-            # 创建JSON格式的测试参数
-            test_params = {
-                "javaCode": java_code,
-                "targetClass": target_class,
-                "methodName": method_name
-            }
-
-            # 使用自定义forward_test函数处理测试用例生成请求
-            return StreamingResponse(
-                forward_test_request(
-                    "http://40225c6d.r29.cpolar.top/api/testgen/generate",
-                    test_params,
-                    session_id
-                ),
-                media_type="text/plain"
-            )
-
-        if mode == "5":
-            print("mode5")
-            return StreamingResponse(
-                forward_to_remote("http://7e7bb7a1.r29.cpolar.top/review", "code", question, session_id),
-                media_type="text/plain"
-            )
-
-        if mode == "6":
-            print("mode6")
-            return StreamingResponse(
-                forward_to_remote("http://3c90e78d.r29.cpolar.top/review", "code", question, session_id),
-                media_type="text/plain"
-            )
-
+            # 插入新的会话记录，由自增主键分配 session_id，一条语句完成且并发安全
+            with trace.child("db.create_session"):
+                session_id = await db.execute(
+                    "INSERT INTO session (session_name, user_id) VALUES (%s, %s)",
+                    (session_name, user_id))
+        trace.set_attribute("session_id", session_id)
+
+        print(f"mode{mode}")
+        if key is not None:
+            flight = single_flight.join(key, session_id, mode)
+            if flight is not None:
+                # 相同的请求正在生成，订阅同一个输出流，结果由发起的请求为本会话落库
+                if ticket is not None:
+                    ticket.release()
+                flight.stream.owners.add(user_id)
+                trace.add_event("single_flight_joined", stream_id=flight.stream.id)
+                return replay_response(flight.stream, 0, wants_sse(request), trace)
+            if ticket is None:
+                # 等待建会话期间相同的请求已经结束
+                ticket = admission.get(route.admission_name).enqueue(user_id)
+            flight = single_flight.lead(key, session_id)
+        # 首分片延迟和吞吐只统计上游内容，由处理函数在连接提示之后计数
+        meter = StreamMeter()
+        source = ROUTE_HANDLERS[route.handler](route, data, question, session_id, trace, hit, flight, meter)
+        return stream_response(route, source, start_time, trace, ticket, owner=user_id, sse=wants_sse(request),
+                               flight=flight, meter=meter)
+    except QueueFull as e:
+        trace.end(error=str(e))
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
+        # 响应还没开始，已拿到的名额要还回去
+        if ticket is not None:
+            ticket.release()
+        if flight is not None and flight.stream is None:
+            single_flight.finish(flight)
+        trace.end(error=str(e))
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == '__main__':
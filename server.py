@@ -5,7 +5,7 @@ from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import json
 
-from Utils.llm_api import StreamLlmApi, LlmApi
+from Utils.llm_api import AsyncStreamLlmApi, AsyncLlmApi
 
 app = FastAPI()
 
@@ -27,16 +27,13 @@ async def stream_output(request: Request):
     body = await request.json()
     msg = body.get("message")
 
-    # Initialize the StreamLlmApi and get the generator
-    model = StreamLlmApi()
-    stream_generator = model.znxz(msg)
-
-    full_response = ""
+    # Initialize the AsyncStreamLlmApi and get the async generator
+    model = AsyncStreamLlmApi()
+    stream_generator = await model.znxz(msg)
 
     async def event_generator():
-        nonlocal full_response  # 声明使用外部作用域的变量
-        for chunk in stream_generator:
-            full_response += chunk
+        # 这里不保存历史，直接转发，不必在内存中累积完整回答
+        async for chunk in stream_generator:
             yield chunk
 
     # Use StreamingResponse to stream the output to the client
@@ -48,8 +45,8 @@ async def ask_llm(request: Request):
     body = await request.json()
     msg = body.get("message")
 
-    model = LlmApi()
-    result = model.znxz(msg)
+    model = AsyncLlmApi()
+    result = await model.znxz(msg)
 
     return result
 
@@ -0,0 +1,42 @@
+import asyncio
+
+import aiomysql
+import pytest
+
+from Utils.db_pool import DbError, DbPool
+
+
+class BrokenConnection:
+    closed = False
+
+    async def ping(self, reconnect):
+        raise aiomysql.OperationalError(2003, "Can't connect to MySQL server")
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+        self.released = None
+
+    async def acquire(self):
+        return self.conn
+
+    def release(self, conn):
+        self.released = conn
+
+
+def test_failed_health_check_raises_db_error():
+    conn = BrokenConnection()
+    pool = DbPool("test")
+    pool._pool = FakePool(conn)
+
+    async def run():
+        async with pool.acquire():
+            pass
+
+    with pytest.raises(DbError):
+        asyncio.run(run())
+    assert conn.closed and pool._pool.released is conn
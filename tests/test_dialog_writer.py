@@ -0,0 +1,39 @@
+import asyncio
+import json
+import threading
+
+from Utils.dialog_writer import DialogWriter
+
+
+class SlowDb:
+    def __init__(self):
+        self.rows = []
+
+    async def executemany(self, sql, rows):
+        await asyncio.sleep(0.05)
+        self.rows.extend(rows)
+
+
+def test_queue_overflow_is_spilled_off_the_event_loop(tmp_path, monkeypatch):
+    spill_path = tmp_path / "spill.jsonl"
+    writer = DialogWriter(SlowDb(), max_queue=2, spill_path=str(spill_path))
+    threads = []
+    spill = writer._spill
+
+    def recording_spill(rows):
+        threads.append(threading.current_thread())
+        spill(rows)
+
+    monkeypatch.setattr(writer, "_spill", recording_spill)
+
+    async def run():
+        for i in range(5):
+            writer.submit(i, "q", "m")
+        # submit 不在事件循环上写文件
+        assert not spill_path.exists()
+        await writer._spilling
+
+    asyncio.run(run())
+    assert threads and threading.main_thread() not in threads
+    rows = [json.loads(line) for line in spill_path.read_text(encoding="utf-8").splitlines()]
+    assert [row[0] for row in rows] == [2, 3, 4]
@@ -0,0 +1,76 @@
+from Utils.java_outline import outline, parse_outline, tokenize
+
+
+def test_comments_and_literals_are_not_declarations():
+    code = (
+        "// class Fake { void no() {} }\n"
+        "/* interface Hidden { } */\n"
+        "public class Real {\n"
+        '    String s = "class Str { void x() {} }";\n'
+        "    char open = '{';\n"
+        "    char close = '}';\n"
+        '    String block = """\n'
+        "        class Text { }\n"
+        '        """;\n'
+        "    void work() { log(\"}\"); }\n"
+        "}\n"
+    )
+    result = parse_outline(code)
+    assert [t.name for t in result.iter_types()] == ["Real"]
+    real = result.types[0]
+    assert [field.name for field in real.fields] == ["s", "open", "close", "block"]
+    assert [method.name for method in real.methods] == ["work"]
+    assert result.source(real).endswith("}")
+
+
+def test_generics_in_fields_and_methods():
+    code = (
+        "class Repo<T extends Comparable<T>> {\n"
+        "    private Map<String, List<Integer>> index = new HashMap<>();\n"
+        "    public <R> List<R> map(Function<? super T, ? extends R> fn, Map<K, V> m) { return null; }\n"
+        "}\n"
+    )
+    repo = parse_outline(code).types[0]
+    assert repo.name == "Repo"
+    assert repo.fields[0].type == "Map<String, List<Integer>>"
+    method = repo.methods[0]
+    assert method.name == "map"
+    assert method.return_type == "List<R>"
+    assert method.params == ["Function<? super T, ? extends R>", "Map<K, V>"]
+
+
+def test_statements_in_snippet_are_not_methods():
+    code = (
+        "void check(int x) {\n"
+        "    if (x > 0) { run(); }\n"
+        "}\n"
+        "if (ready) { start(); }\n"
+        "while (true) { break; }\n"
+    )
+    result = parse_outline(code)
+    assert [method.name for method in result.methods] == ["check"]
+
+
+def test_param_annotations_and_array_dims():
+    code = 'class C { void a(@RequestParam("q") final String q, int[] arr[], @Size(min = 1, max = 2) int n) {} }'
+    method = parse_outline(code).types[0].methods[0]
+    assert method.params == ["String", "int[][]", "int"]
+
+
+def test_nested_types_and_constructor():
+    code = "public class Outer { Outer() {} static class Inner { void f() {} } enum E { A, B; void g() {} } }"
+    result = parse_outline(code)
+    outer = result.primary_type()
+    assert [t.name for t in result.iter_types()] == ["Outer", "Inner", "E"]
+    assert outer.methods[0].constructor
+    assert outer.types[1].method("g") is not None
+
+
+def test_tokenize_skips_comments_and_tracks_lines():
+    tokens = tokenize("a /* x\ny */ b // c\nd")
+    assert [(token.text, token.line) for token in tokens] == [("a", 1), ("b", 2), ("d", 3)]
+
+
+def test_outline_is_cached():
+    code = "class Cached {}"
+    assert outline(code) is outline(code)
@@ -0,0 +1,34 @@
+import asyncio
+
+from Utils.metrics import MetricsRegistry, StreamMeter, StreamMetrics
+
+
+def test_meter_counts_only_content_chunks():
+    registry = MetricsRegistry()
+    metrics = StreamMetrics("t", registry=registry)
+    meter = StreamMeter()
+
+    async def source():
+        yield "# 正在连接到 upstream...\n"
+        await asyncio.sleep(0.05)
+        for chunk in ("hello ", "world"):
+            yield meter.content(chunk)
+
+    async def run():
+        return [chunk async for chunk in metrics.wrap(source(), "2", meter=meter)]
+
+    assert asyncio.run(run())[0].startswith("# 正在连接到")
+    assert meter.chunks == 2
+    counts, total, count = metrics.ttfb._values[("2",)]
+    assert count == 1 and total >= 0.05
+
+
+def test_wrap_without_meter_counts_every_chunk():
+    metrics = StreamMetrics("u", registry=MetricsRegistry())
+
+    def source():
+        yield "a"
+        yield "b"
+
+    assert list(metrics.wrap_sync(source(), "x")) == ["a", "b"]
+    assert metrics.ttfb._values[("x",)][2] == 1
@@ -0,0 +1,100 @@
+import asyncio
+
+from Utils.ndjson import NdjsonFramer, aiter_records
+
+
+def feed_all(chunks, framer=None):
+    framer = framer or NdjsonFramer()
+    records = []
+    for chunk in chunks:
+        records.extend(framer.feed(chunk))
+    return records + framer.close()
+
+
+def test_records_split_across_chunks():
+    assert feed_all(['{"a": 1}\n{"b"', ': 2}\n']) == [{"a": 1}, {"b": 2}]
+
+
+def test_plain_text_passes_through():
+    assert feed_all(["hello\n", "world"]) == ["hello\n", "world"]
+
+
+def test_partial_text_line_is_passed_through_per_chunk():
+    framer = NdjsonFramer()
+    assert framer.feed("这是一段没有换行的普通文本") == ["这是一段没有换行的普通文本"]
+    assert framer.feed("，继续输出") == ["，继续输出"]
+    assert framer.feed("到行尾\n下一") == ["到行尾\n", "下一"]
+    assert framer.feed("行\n") == ["行\n"]
+    assert framer.close() == []
+
+
+def test_partial_line_that_may_be_json_is_held():
+    framer = NdjsonFramer()
+    assert framer.feed('  {"a"') == []
+    assert framer.feed(": 1}\n") == [{"a": 1}]
+    assert framer.feed("   ") == []
+    assert framer.feed("text\n") == ["   text\n"]
+
+
+def test_pretty_printed_document_is_joined():
+    text = '{\n  "a": {\n    "b": [1, 2]\n  }\n}\n'
+    assert feed_all([text]) == [{"a": {"b": [1, 2]}}]
+
+
+def test_pretty_printed_array_is_joined():
+    assert feed_all(["[\n  1,\n  2\n]\n"]) == [[1, 2]]
+
+
+def test_bracketed_text_line_does_not_buffer():
+    framer = NdjsonFramer()
+    assert framer.feed("[注意] 以下是示例\n") == ["[注意] 以下是示例\n"]
+    assert framer.feed("more text\n") == ["more text\n"]
+    assert framer.close() == []
+
+
+def test_markdown_link_line_does_not_buffer():
+    framer = NdjsonFramer()
+    assert framer.feed("[文档](https://example.com) 参见\n") == ["[文档](https://example.com) 参见\n"]
+    assert framer.feed("next\n") == ["next\n"]
+
+
+def test_brace_prefixed_text_does_not_buffer():
+    assert feed_all(["{ not json\n", "tail\n"]) == ["{ not json\n", "tail\n"]
+
+
+def test_allman_brace_line_is_flushed_as_text():
+    framer = NdjsonFramer()
+    assert framer.feed("public class A\n") == ["public class A\n"]
+    assert framer.feed("{\n") == []
+    # 第二行不是 JSON 键，立即按原文输出，不会一直缓冲
+    assert framer.feed("    int x;\n") == ["{\n    int x;\n"]
+    assert framer.feed("}\n") == ["}\n"]
+    assert framer.close() == []
+
+
+def test_failed_multiline_decode_is_flushed_as_text():
+    framer = NdjsonFramer()
+    assert framer.feed('{\n  "a": 1,\n') == []
+    assert framer.feed("}\n") == ['{\n  "a": 1,\n}\n']
+    assert framer.feed("more text\n") == ["more text\n"]
+
+
+def test_unclosed_document_keeps_newlines_at_close():
+    assert feed_all(['{\n  "a": 1\n']) == ['{\n  "a": 1\n']
+
+
+def test_max_pending_lines_flushes():
+    framer = NdjsonFramer(max_pending_lines=3)
+    records = framer.feed('[\n  1,\n  2,\n  3,\n')
+    assert records == ["[\n  1,\n  2,\n  3,\n"]
+
+
+def test_aiter_records():
+    async def chunks():
+        for chunk in ['{"a": 1}\n', "text"]:
+            yield chunk
+
+    async def collect():
+        return [record async for record in aiter_records(chunks())]
+
+    assert asyncio.run(collect()) == [{"a": 1}, "text"]
@@ -0,0 +1,76 @@
+from Utils.prompt_budget import elide_accessors, elide_generated, split_top_level_types
+
+
+def test_accessor_summary_per_type():
+    code = (
+        "class A {\n"
+        "    int getA() { return a; }\n"
+        "    void work() { run(); }\n"
+        "}\n"
+        "class B {\n"
+        "    int getB() { return b; }\n"
+        "    void setB(int b) { this.b = b; }\n"
+        "}\n"
+    )
+    elided, names = elide_accessors(code)
+    assert names == ["getA", "getB", "setB"]
+    assert elided == (
+        "class A {\n"
+        "    // ... 省略 getter/setter: getA\n"
+        "    void work() { run(); }\n"
+        "}\n"
+        "class B {\n"
+        "    // ... 省略 getter/setter: getB, setB\n"
+        "}\n"
+    )
+
+
+def test_accessor_with_braces_in_string_is_elided():
+    elided, names = elide_accessors('class A {\n    String getS() { return "{}"; }\n}\n')
+    assert names == ["getS"]
+    assert "return" not in elided
+
+
+def test_non_trivial_getter_is_kept():
+    code = "class A {\n    int getX() { if (x) { return 1; } return 2; }\n}\n"
+    assert elide_accessors(code) == (code, [])
+
+
+def test_split_top_level_types():
+    code = 'package p;\nimport a.B;\n/** A { */\npublic class A { String s = "}"; }\ninterface I { void f(); }\n'
+    header, types = split_top_level_types(code)
+    assert header == "package p;\nimport a.B;"
+    assert [name for name, _ in types] == ["A", "I"]
+    assert types[0][1] == '/** A { */\npublic class A { String s = "}"; }'
+
+
+def test_generated_field_does_not_swallow_next_method():
+    code = (
+        "class A {\n"
+        '    @Generated("lombok") private int x;\n'
+        '    public void foo() { bar("}"); }\n'
+        "}\n"
+    )
+    elided, count = elide_generated(code)
+    assert count == 1
+    assert elided == (
+        "class A {\n"
+        "    // ... 生成代码已省略\n"
+        '    public void foo() { bar("}"); }\n'
+        "}\n"
+    )
+
+
+def test_generated_method_and_initializer_are_elided():
+    code = (
+        "class A {\n"
+        "    @Generated\n"
+        '    public String name() { return "{"; }\n'
+        "    @Generated int[] a = {1, 2};\n"
+        "    void keep() {}\n"
+        "}\n"
+    )
+    elided, count = elide_generated(code)
+    assert count == 2
+    assert "keep()" in elided and "name()" not in elided and "{1, 2}" not in elided
+    assert elided.endswith("    void keep() {}\n}\n")
@@ -0,0 +1,128 @@
+import asyncio
+import io
+import threading
+import time
+import zipfile
+
+import pytest
+
+from Utils import review_batch
+from Utils.review_batch import BatchError, afan_out, aiter_batch, fan_out, files_from_zip, iter_batch
+
+
+class Peak:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.now = 0
+        self.peak = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.now += 1
+            self.peak = max(self.peak, self.now)
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.now -= 1
+
+
+def test_fan_out_keeps_order_and_limit():
+    peak = Peak()
+
+    def square(x):
+        with peak:
+            time.sleep(0.01)
+        return x * x
+
+    assert fan_out(list(range(10)), square, 3) == [x * x for x in range(10)]
+    assert peak.peak <= 3
+
+
+def test_fan_out_raises_first_error():
+    def fail(x):
+        if x == 2:
+            raise ValueError("boom")
+        return x
+
+    with pytest.raises(ValueError):
+        fan_out(list(range(5)), fail, 2)
+
+
+def test_iter_batch_fan_out_shares_the_batch_limit():
+    peak = Peak()
+
+    def call(_):
+        with peak:
+            time.sleep(0.01)
+
+    def review_one(name, code):
+        # 每个文件先分块调用 4 次，再做一次汇总调用
+        fan_out([code] * 4, call, 8)
+        call(code)
+        return "ok", False
+
+    files = [(f"f{i}.java", f"class F{i} {{}}") for i in range(6)]
+    records = list(iter_batch(files, review_one, 3))
+    assert records[-1]["succeeded"] == 6
+    assert peak.peak <= 3
+
+
+def test_aiter_batch_afan_out_shares_the_batch_limit():
+    state = {"now": 0, "peak": 0}
+
+    async def call(_):
+        state["now"] += 1
+        state["peak"] = max(state["peak"], state["now"])
+        await asyncio.sleep(0.01)
+        state["now"] -= 1
+
+    async def review_one(name, code):
+        await afan_out([code] * 4, call, 8)
+        await call(code)
+        return "ok", False
+
+    async def run():
+        files = [(f"f{i}.java", f"class F{i} {{}}") for i in range(6)]
+        return [record async for record in aiter_batch(files, review_one, 3)]
+
+    records = asyncio.run(run())
+    assert records[-1]["succeeded"] == 6
+    assert state["peak"] <= 3
+
+
+def test_afan_out_without_batch_uses_limit():
+    async def double(x):
+        await asyncio.sleep(0)
+        return x * 2
+
+    assert asyncio.run(afan_out([1, 2, 3], double, 2)) == [2, 4, 6]
+
+
+def make_zip(entries: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_files_from_zip_reads_java_entries():
+    data = make_zip({"src/A.java": "class A {}", "README.md": "x", "__MACOSX/src/A.java": "junk"})
+    assert files_from_zip(data) == [("src/A.java", "class A {}")]
+
+
+def test_files_from_zip_rejects_too_many_entries_before_reading(monkeypatch):
+    monkeypatch.setattr(review_batch, "MAX_BATCH_FILES", 3)
+    monkeypatch.setattr(review_batch, "_read_entry", lambda *args: pytest.fail("entry was decompressed"))
+    data = make_zip({f"F{i}.java": "class F {}" for i in range(4)})
+    with pytest.raises(BatchError, match="3"):
+        files_from_zip(data)
+
+
+def test_files_from_zip_rejects_total_size_before_reading(monkeypatch):
+    monkeypatch.setattr(review_batch, "MAX_BATCH_BYTES", 1000)
+    monkeypatch.setattr(review_batch, "_read_entry", lambda *args: pytest.fail("entry was decompressed"))
+    data = make_zip({f"F{i}.java": " " * 400 for i in range(3)})
+    assert len(data) < 1000
+    with pytest.raises(BatchError):
+        files_from_zip(data)
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from Utils.http_pool import HttpClientRegistry, UpstreamConfig
+from Utils.routing import RouteConfigError, load_routes
+
+
+def write_routes(tmp_path, routes: dict) -> str:
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps(routes), encoding="utf-8")
+    return str(path)
+
+
+def test_load_routes(tmp_path):
+    path = write_routes(tmp_path, {"_comment": "x", "2": {"handler": "ndjson", "urls": ["http://a/ask"],
+                                                           "timeout": 30, "shaping": {"max_chars": 64}}})
+    route = load_routes(path)["2"]
+    assert route.timeout == 30 and route.pool_name == "mode2"
+    assert route.hedge_after == route.expected_service_time
+
+
+@pytest.mark.parametrize("options", [
+    {"timeout": "60"},
+    {"pool_size": 1.5},
+    {"max_concurrent": True},
+    {"max_queue": -1},
+    {"shaping": {"max_delay": "0.1"}},
+    {"cache": {"threshold": "high"}},
+    {"shaping": []},
+])
+def test_load_routes_rejects_bad_numbers(tmp_path, options):
+    path = write_routes(tmp_path, {"2": {"handler": "ndjson", "urls": ["http://a/ask"], **options}})
+    with pytest.raises(RouteConfigError):
+        load_routes(path)
+
+
+def test_pools_on_the_same_host_keep_their_own_settings():
+    registry = HttpClientRegistry()
+    registry.configure("http://agents:9000/design/review", UpstreamConfig(timeout=150), pool="mode5")
+    registry.configure("http://agents:9000/code/review", UpstreamConfig(timeout=60), pool="mode6")
+    design = registry.get("http://agents:9000/design/review", "mode5")
+    code = registry.get("http://agents:9000/code/review", "mode6")
+    assert design is not code
+    assert design.timeout.read == 150 and code.timeout.read == 60
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from Utils.stream_hub import HubStream, StreamGone, StreamHub
+
+
+async def collect(stream: HubStream, last_event_id: int = 0) -> list:
+    return [event async for event in stream.subscribe(last_event_id)]
+
+
+def test_buffer_is_bounded_by_chars():
+    stream = HubStream("s", max_chars=10)
+    for chunk in ("abcd", "efgh", "ijkl"):
+        stream.append(chunk)
+    stream.finish()
+    assert [event_id for event_id, _ in stream.events] == [2, 3]
+    assert stream.chars == 8
+    assert asyncio.run(collect(stream, 1)) == [(2, "efgh"), (3, "ijkl")]
+    with pytest.raises(StreamGone):
+        asyncio.run(collect(stream, 0))
+
+
+def test_oversized_chunk_keeps_latest_event():
+    stream = HubStream("s", max_chars=4)
+    stream.append("ab")
+    stream.append("0123456789")
+    assert list(stream.events) == [(2, "0123456789")]
+    assert stream.chars == 10
+
+
+def test_buffer_is_bounded_by_count():
+    stream = HubStream("s", buffer_size=2)
+    for chunk in ("a", "bb", "ccc"):
+        stream.append(chunk)
+    assert stream.chars == 5
+
+
+def test_hub_replays_after_source_ends():
+    async def source():
+        for chunk in ("hello ", "world"):
+            yield chunk
+
+    async def run():
+        hub = StreamHub(grace_period=0.01)
+        stream = hub.start(source())
+        await stream.task
+        events = await collect(stream)
+        await hub.aclose()
+        return events, stream
+
+    events, stream = asyncio.run(run())
+    assert events == [(1, "hello "), (2, "world")]
+    assert stream.done and stream.error is None
@@ -0,0 +1,15 @@
+from Utils.upstream_health import OPEN, CircuitBreaker
+
+
+def test_tunnel_404_counts_as_failure():
+    breaker = CircuitBreaker("u", min_calls=2)
+    assert breaker.failed_status(404) and breaker.failed_status(502)
+    assert not breaker.failed_status(200) and not breaker.failed_status(400)
+    for _ in range(2):
+        breaker.record(not breaker.failed_status(404), 0.1)
+    assert breaker.state == OPEN
+
+
+def test_failure_statuses_are_configurable():
+    breaker = CircuitBreaker("u", failure_statuses=(404, 429))
+    assert breaker.failed_status(429)
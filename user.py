@@ -1,9 +1,24 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from User.models import *
-import mysql.connector
+from Utils.db_pool import DbError, create_pool
+from Utils.metrics import REGISTRY, CONTENT_TYPE
+
+# 数据库连接池配置
+db = create_pool(database="user_znxz", minsize=2, maxsize=20)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db.open()
+    yield
+    await db.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 配置 CORS 中间件
 app.add_middleware(
@@ -19,11 +34,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-connection = mysql.connector.connect(
-    user="root",
-    password="123456",
-    host="localhost",
-    database="user_znxz")
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Export runtime metrics in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
 
 
 @app.post("/register")
@@ -34,35 +51,24 @@ async def register_user(info: RegisterInfo):
     email = info.email
     password = info.password
 
-    with connection.cursor() as cursor:
-        token = ""
-        # Check if the user already exists
-        cursor.execute("SELECT * FROM user WHERE email = %s", (email,))
-
-        if cursor.fetchone():
-            # User already exists
-            return Result(code=2, token=token)
-
-        # Insert the new user into the database
-        try:
-            cursor.execute(
-                "INSERT INTO user (email, password) VALUES (%s, %s)", (email, password))
-            connection.commit()
-
-            # JWT token generation would go here
-            # For simplicity, we are returning an self-design token
-            cursor.execute(
-                "SELECT id FROM user WHERE email = %s", (email,))
+    token = ""
+    # Check if the user already exists
+    if await db.fetchone("SELECT id FROM user WHERE email = %s", (email,)):
+        # User already exists
+        return Result(code=2, token=token)
 
-            result = cursor.fetchone()
+    # Insert the new user into the database
+    try:
+        user_id = await db.execute(
+            "INSERT INTO user (email, password) VALUES (%s, %s)", (email, password))
 
-            if result is not None:
-                user_id = result[0]
-                token = str(user_id)  # Simple token for demonstration
-            return Result(code=0, token=token)
-        except mysql.connector.Error as err:
-            connection.rollback()
-            return Result(code=1, token=token)
+        # JWT token generation would go here
+        # For simplicity, we are returning an self-design token
+        if user_id:
+            token = str(user_id)  # Simple token for demonstration
+        return Result(code=0, token=token)
+    except DbError as err:
+        return Result(code=1, token=token)
 
 
 @app.post("/login")
@@ -74,21 +80,18 @@ async def login_user(info: LoginInfo):
     password = info.password
     print(email, password)
 
-    with connection.cursor() as cursor:
-        token = ""
-        # Check if the user exists and the password matches
-        cursor.execute(
-            "SELECT id FROM user WHERE email = %s AND password = %s", (email, password))
-
-        result = cursor.fetchone()
-
-        if result:
-            user_id = result[0]
-            # JWT token generation would go here
-            token = str(user_id)
-            return Result(code=0, token=token)
-        else:
-            return Result(code=1, token=token)
+    token = ""
+    # Check if the user exists and the password matches
+    result = await db.fetchone(
+        "SELECT id FROM user WHERE email = %s AND password = %s", (email, password))
+
+    if result:
+        user_id = result[0]
+        # JWT token generation would go here
+        token = str(user_id)
+        return Result(code=0, token=token)
+    else:
+        return Result(code=1, token=token)
 
 if __name__ == "__main__":
     import uvicorn